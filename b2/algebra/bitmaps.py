@@ -0,0 +1,95 @@
+"""Bitmap indexes for the categorical (low cardinality string) columns of the base tables.
+
+A selection on a categorical chart is a set of values, which is the OR of the
+bitmaps of those values, and the selections of several charts on the same base
+are the AND of their bitmaps. Both work on packed bits, so they touch one
+eighth of a byte per row instead of comparing strings.
+
+The bitmaps are built the first time a column is filtered, and are keyed by
+the identity of the column array, same as the other indexes.
+"""
+from typing import Optional
+import numpy as np
+
+from b2.constants import BITMAP_MAX_KEYS, BITMAP_INDEX_MAX_BYTES
+from .cache import ResultCache
+from .indexes import KeyIndex, NOT_INDEXED, get_key_index
+from .predicate_compiler import CompiledPredicate
+
+
+class BitmapIndex(object):
+    """
+    Arguments:
+        key_index {KeyIndex} -- the distinct values of the column
+        bits {np.ndarray} -- row i has the packed bits of the rows with the i-th value
+        num_rows {int} -- the number of rows of the column (the bits are padded to bytes)
+    """
+    def __init__(self, key_index: KeyIndex, bits: np.ndarray, num_rows: int):
+        self.key_index = key_index
+        self.bits = bits
+        self.num_rows = num_rows
+
+    @classmethod
+    def build(cls, column: np.ndarray) -> Optional['BitmapIndex']:
+        """returns None if the column is not categorical, or if the bitmaps would not fit the budget"""
+        if column.dtype.kind not in "USO":
+            return None
+        key_index = get_key_index([column])
+        if key_index is None or key_index.num_keys > BITMAP_MAX_KEYS:
+            return None
+        keys = key_index.key_columns[0]
+        if keys.dtype.kind == "O" and not all(isinstance(k, str) for k in keys):
+            return None
+        num_bytes = (len(column) + 7) // 8
+        if key_index.num_keys * num_bytes > BITMAP_INDEX_MAX_BYTES:
+            return None
+        rows = np.arange(len(column))
+        # every row sets a different bit of its byte, so adding the bits is the same as or-ing them
+        positions = key_index.codes.astype(np.int64) * num_bytes + (rows >> 3)
+        values = np.left_shift(1, 7 - (rows & 7))
+        bits = np.bincount(positions, weights=values, minlength=key_index.num_keys * num_bytes)
+        return cls(key_index, bits.astype(np.uint8).reshape(key_index.num_keys, num_bytes), len(column))
+
+    @property
+    def nbytes(self) -> int:
+        # the key index is cached on its own
+        return self.bits.nbytes
+
+    def packed(self, compiled: CompiledPredicate) -> Optional[np.ndarray]:
+        """the packed bits of the rows that pass the predicate, or None if it cannot be evaluated on the values"""
+        # the predicate only depends on the value, so it can be evaluated per value instead of per row
+        key_mask = compiled.mask(self.key_index.key_columns[0])
+        if key_mask is None:
+            return None
+        selected = np.flatnonzero(key_mask)
+        if 2 * len(selected) <= self.key_index.num_keys:
+            return union(self.bits, selected)
+        # cheaper to complement the values that are not selected
+        return ~union(self.bits, np.flatnonzero(~key_mask))
+
+    def unpack(self, packed: np.ndarray) -> np.ndarray:
+        return np.unpackbits(packed, count=self.num_rows).view(bool)
+
+
+def get_bitmap_index(column: np.ndarray) -> Optional[BitmapIndex]:
+    key = ("bitmap_index", id(column))
+    index = bitmap_cache.get(key, NOT_INDEXED)
+    if index is NOT_INDEXED:
+        index = BitmapIndex.build(column)
+        nbytes = 0 if index is None else index.nbytes
+        bitmap_cache.put(key, index, nbytes, (column,))
+    return index
+
+
+# shared by all the B2 instances in the kernel, same as the other indexes
+bitmap_cache = ResultCache(BITMAP_INDEX_MAX_BYTES)
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def union(bits: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    if len(selected) == 0:
+        return np.zeros(bits.shape[1], dtype=np.uint8)
+    return np.bitwise_or.reduce(bits[selected], axis=0)
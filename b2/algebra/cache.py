@@ -0,0 +1,297 @@
+"""Memoization of intermediate results, keyed by the structure of the ops.
+
+Every tick creates new MidasDataFrames (with new random ids) for the same
+filters, so the ids cannot be used to find repeated work. Instead each op
+gets a fingerprint made of the base df identity, the predicate values and
+the columns, which is the same for structurally identical subtrees.
+"""
+from collections import OrderedDict, deque
+from threading import RLock
+from typing import Any, Dict, Optional, Set, Tuple, List, cast
+import numbers
+import weakref
+import numpy as np
+
+from b2.constants import RESULT_CACHE_MAX_BYTES
+from .dataframe import RelationalOp, RelationalOpType, BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin
+from .predicate_compiler import compile_predicate, CompiledPredicate
+
+
+class Uncacheable(Exception):
+    """raised when part of an op cannot be fingerprinted (e.g., an array used as a where mask)"""
+    pass
+
+
+class CacheEntry(object):
+    def __init__(self, value: Any, nbytes: int, anchor_ids: Tuple[int, ...], kept: Tuple):
+        self.value = value
+        self.nbytes = nbytes
+        # the ids of the objects that are part of the key
+        self.anchor_ids = anchor_ids
+        # the anchors that cannot be weakly referenced, kept alive so that their ids are not reused
+        self.kept = kept
+
+
+class ResultCache(object):
+    """LRU cache that is bounded by the number of bytes of the values it holds,
+    safe to share between the threads that recompute the charts
+
+    The keys refer to tables and columns by id, so the entries are purged once any of
+    their anchors is garbage collected, which also releases the base columns that the
+    values refer to, and keeps a new object with the same id from finding them.
+
+    Arguments:
+        max_bytes {int} -- the memory budget, values larger than this are not cached
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Any, CacheEntry]' = OrderedDict()
+        self._lock = RLock()
+        # the keys of the entries by the id of their anchors
+        self._anchored: Dict[int, Set[Any]] = {}
+        # the ids of the anchors with a finalizer
+        self._watched: Set[int] = set()
+        # the ids of the anchors that were garbage collected, appended by their finalizers, which
+        # can run in the middle of any operation on the cache, so the entries are purged later
+        self._dead: deque = deque()
+
+    def __len__(self):
+        with self._lock:
+            self._purge_dead()
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._purge_dead()
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._purge_dead()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, key, value, nbytes: int, anchors: Tuple = ()):
+        """
+        Arguments:
+            anchors {Tuple} -- the objects whose id is part of the key
+        """
+        with self._lock:
+            self._purge_dead()
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            kept = tuple(a for a in anchors if not self._watch(a))
+            anchor_ids = tuple(set(id(a) for a in anchors))
+            self._entries[key] = CacheEntry(value, nbytes, anchor_ids, kept)
+            for anchor_id in anchor_ids:
+                self._anchored.setdefault(anchor_id, set()).add(key)
+            self.current_bytes += nbytes
+            self._evict()
+
+    def resize(self, key, added_bytes: int):
+        """accounts for a value that grew after it was put, e.g., one that builds parts of itself on first use"""
+        with self._lock:
+            self._purge_dead()
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.nbytes += added_bytes
+            self.current_bytes += added_bytes
+            if entry.nbytes > self.max_bytes:
+                self._remove(key)
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._anchored.clear()
+            self.current_bytes = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._purge_dead()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.nbytes
+        for anchor_id in entry.anchor_ids:
+            keys = self._anchored.get(anchor_id)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._anchored[anchor_id]
+
+    def _watch(self, anchor) -> bool:
+        """returns False if the anchor cannot be weakly referenced"""
+        if id(anchor) in self._watched:
+            return True
+        try:
+            weakref.finalize(anchor, self._dead.append, id(anchor))
+        except TypeError:
+            return False
+        self._watched.add(id(anchor))
+        return True
+
+    def _purge_dead(self):
+        while len(self._dead) > 0:
+            anchor_id = self._dead.popleft()
+            self._watched.discard(anchor_id)
+            for key in list(self._anchored.get(anchor_id, ())):
+                self._remove(key)
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and len(self._entries) > 0:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+
+# shared by all the B2 instances in the kernel, since they share the base tables
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+
+
+####################################
+########    fingerprints    ########
+####################################
+
+class Fingerprinter(object):
+    """computes the fingerprints for an op tree, remembering the ones already computed,
+    as well as the objects that the fingerprints refer to by id"""
+    def __init__(self):
+        self.memo: Dict[int, Optional[Tuple]] = {}
+        self.anchors: List[Any] = []
+
+    def of(self, op: RelationalOp) -> Optional[Tuple]:
+        """returns None if the op cannot be fingerprinted"""
+        if id(op) in self.memo:
+            return self.memo[id(op)]
+        try:
+            fingerprint = self._of(op)
+        except Uncacheable:
+            fingerprint = None
+        self.memo[id(op)] = fingerprint
+        return fingerprint
+
+    def of_df(self, df) -> Optional[Tuple]:
+        # a df whose table is set might have been sorted or mutated in place
+        if hasattr(df, "_table") and (df._table is not None):
+            return ("table", self.table_version(df._table))
+        return self.of(df._ops)
+
+    def table_version(self, table) -> Tuple:
+        """identifies the table by the arrays it holds, appending a column changes the version"""
+        self.anchors.append(table)
+        columns = tuple((l, id(table.column(l))) for l in table.labels)
+        self.anchors.extend(table.column(l) for l in table.labels)
+        return (id(table), table.num_rows, columns)
+
+    def _of(self, op: RelationalOp) -> Optional[Tuple]:
+        if op.op_type == RelationalOpType.base:
+            b_op = cast(BaseOp, op)
+            return ("base", b_op.df_id, self.table_version(b_op.table))
+        child = self.of(op.child)
+        if child is None:
+            raise Uncacheable("child")
+        if op.op_type == RelationalOpType.where:
+            w_op = cast(Where, op)
+            p = w_op.predicate
+            return ("where", child, column_key(p.column_or_label), self.predicate_key(p.value_or_predicate), column_key(p.other))
+        if op.op_type == RelationalOpType.fused_where:
+            f_op = cast(FusedWhere, op)
+            predicates = tuple((column_key(p.column_or_label), self.predicate_key(p.value_or_predicate), column_key(p.other)) for p in f_op.predicates)
+            return ("fused_where", child, predicates)
+        if op.op_type == RelationalOpType.project:
+            p_op = cast(Select, op)
+            return ("project", child, normalize(p_op.columns))
+        if op.op_type == RelationalOpType.groupby:
+            g_op = cast(GroupBy, op)
+            return ("groupby", child, normalize(g_op.columns), self.hashable_object(g_op.collect))
+        if op.op_type == RelationalOpType.join:
+            j_op = cast(Join, op)
+            other = self.of_df(j_op.other)
+            if other is None:
+                raise Uncacheable("join")
+            return ("join", child, normalize(j_op.self_columns), other, normalize(j_op.other_columns))
+        if op.op_type == RelationalOpType.semi_join:
+            s_op = cast(SemiJoin, op)
+            other = self.of_df(s_op.other)
+            if other is None:
+                raise Uncacheable("semi_join")
+            return ("semi_join", child, normalize(s_op.self_columns), other, normalize(s_op.other_columns))
+        raise Uncacheable(op.op_type)
+
+    def predicate_key(self, value_or_predicate) -> Tuple:
+        compiled = compile_predicate(value_or_predicate)
+        if compiled is not None:
+            return compiled_key(compiled)
+        # a function we do not understand, the object itself is the key
+        return ("callable", self.hashable_object(value_or_predicate))
+
+    def hashable_object(self, o) -> Any:
+        try:
+            hash(o)
+        except TypeError:
+            raise Uncacheable(o)
+        return o
+
+
+def column_key(column_or_label) -> Any:
+    if column_or_label is None or isinstance(column_or_label, (str, numbers.Integral)):
+        return column_or_label
+    # the column is an array of values, e.g., a boolean mask
+    raise Uncacheable("column")
+
+
+def compiled_key(compiled: CompiledPredicate) -> Tuple:
+    args = tuple(sorted((k, normalize(v)) for k, v in compiled.args.items()))
+    return ("compiled", compiled.name, args)
+
+
+def normalize(value) -> Any:
+    """turns the values used in ops into something hashable, such that equal values have equal keys"""
+    if isinstance(value, CompiledPredicate):
+        return compiled_key(value)
+    if isinstance(value, (set, frozenset)):
+        return ("set", frozenset(normalize(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return ("seq", tuple(normalize(v) for v in value))
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return ("seq", tuple(normalize(v) for v in value.tolist()))
+        return ("array", str(value.dtype), value.shape, value.tobytes())
+    try:
+        hash(value)
+    except TypeError:
+        raise Uncacheable(value)
+    return value
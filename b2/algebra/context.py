@@ -1,6 +1,7 @@
-from copy import deepcopy, copy
-from typing import List,  Dict, Optional, cast, Tuple
+from copy import copy
+from typing import List,  Dict, Optional, Set, cast, Tuple
 from collections import defaultdict
+from heapq import heappush, heappop
 # for development
 from IPython.core.debugger import set_trace
 
@@ -8,12 +9,14 @@ from b2.util.errors import InternalLogicalError, debug_log
 from b2.state_types import DFName
 from b2.constants import ISDEBUG
 
-from .dataframe import RelationalOpType, MidasDataFrame, BaseOp, RelationalOp, DFInfo, VisualizedDFInfo, Where, JoinInfo, Select, create_predicate, Join
-from .selection import SelectionValue
+from .dataframe import RelationalOpType, MidasDataFrame, BaseOp, RelationalOp, DFInfo, VisualizedDFInfo, Where, JoinInfo, Select, create_predicate, Join, SemiJoin, ColumnSelection
+from .selection import SelectionValue, ColumnRef
 
 class Context(object):
     # dfs: Dict[DFName, DFInfo]
     join_info: Dict[Tuple[DFName, DFName], JoinInfo]
+    # cheapest join paths from a set of bases to the df of a selection, None if there is none
+    join_paths: Dict[Tuple[Tuple[DFName, ...], DFName], Optional[List[JoinInfo]]]
     # store it for easier df gen...
 
     def __init__(self, df_info_store: Dict[DFName, DFInfo], new_df_from_ops):
@@ -24,9 +27,19 @@ class Context(object):
         """
         self.df_info_store = df_info_store
         self.join_info = {}
+        self.join_paths = {}
         self.new_df_from_ops = new_df_from_ops
 
 
+    def snapshot(self) -> 'Context':
+        """a copy that does not see the dfs and joins added later, for the ticks on the background worker"""
+        context = copy(self)
+        context.df_info_store = dict(self.df_info_store)
+        context.join_info = dict(self.join_info)
+        context.join_paths = dict(self.join_paths)
+        return context
+
+
     def get_df(self, df_name: DFName) -> MidasDataFrame:
         found = self.df_info_store[df_name]
         if found:
@@ -46,6 +59,8 @@ class Context(object):
         if left_df.df_name is not None and right_df.df_name is not None: # type: ignore
             self.join_info[(left_df.df_name, right_df.df_name)] = joins # type: ignore
             self.join_info[(right_df.df_name, left_df.df_name)] = joins.swap_left_right() # type: ignore
+            # the graph changed, so the paths need to be found again
+            self.join_paths = {}
         else:
             raise InternalLogicalError("The DFs with join info should have df_names")
     
@@ -58,36 +73,35 @@ class Context(object):
     #         raise InternalLogicalError("should have df_names")
 
 
-    def apply_join_selection(self, join_info: JoinInfo, selections: List[SelectionValue]) -> RelationalOp:
+    def apply_join_selection(self, join_path: List[JoinInfo], selections: List[SelectionValue]) -> RelationalOp:
         """
         Arguments:
-            join_info {JoinInfo} -- Note that the left one is the "original base" and the right is the one joined
+            join_path {List[JoinInfo]} -- the hops from the "original base" (the left of the first) to the one
+                with the selections (the right of the last), the right of each hop is the left of the next
             selections {List[SelectionValue]} -- [description]
-        
-        Raises:
-            NotImplementedError: if there are more than on ecolumn, do not handle for now.
-        
+
         Returns:
-            RelationalOp -- [description]
+            RelationalOp -- the original base, filtered to the rows that (transitively) join with the selected rows
         """
         # if ISDEBUG: set_trace()
         # we know that join info must base baseop
-        new_ops = cast(BaseOp, deepcopy(join_info.right_df._ops)) # type: ignore
-        filtered_join_df = apply_non_join_selection(new_ops, selections)
-        if len(join_info.columns) > 1:
-            raise NotImplementedError("Currently not supported")
-        base_col = join_info.columns[0].left_col.col_name
-        join_col = join_info.columns[0].right_col.col_name
-        index_column_df = self.new_df_from_ops(Select(join_col, filtered_join_df))
+        new_ops = cast(BaseOp, join_path[-1].right_df._ops) # type: ignore
+        filtered_ops = apply_non_join_selection(new_ops, selections)
         # we must assign something
         selection_columns = "_".join([s.column.col_name for s in selections])
-        index_column_df._suggested_df_name = f"{new_ops.df_name}_filtered_{selection_columns}"
-        # then do the join
-        # TODO: better to do the "in" operations        
-        new_base = deepcopy(join_info.left_df._ops) # type: ignore
-        final_ops = Join(base_col, index_column_df, join_col, new_base)
+        suggested_df_name = f"{new_ops.df_name}_filtered_{selection_columns}"
+        # walk back to the original base, each hop keeps the rows whose keys are in the filtered df
+        #   which, unlike a join, does not repeat rows for repeated keys
+        for join_info in reversed(join_path):
+            base_cols = as_column_selection([c.left_col.col_name for c in join_info.columns])
+            join_cols = as_column_selection([c.right_col.col_name for c in join_info.columns])
+            index_column_df = self.new_df_from_ops(Select(join_cols, filtered_ops))
+            index_column_df._suggested_df_name = suggested_df_name
+            new_base = join_info.left_df._ops # type: ignore
+            filtered_ops = SemiJoin(base_cols, index_column_df, join_cols, new_base)
+            suggested_df_name = f"{join_info.left_df.df_name}_filtered_{selection_columns}"
         # if ISDEBUG: set_trace()
-        return final_ops
+        return filtered_ops
 
     # get a bunch of bases and decide where the column comes from 
     # we might have 2 here, and we need to decide which one to pick
@@ -109,9 +123,10 @@ class Context(object):
                     # we are done
                     return b
         base_op = find_base_with_column(bases)
-        new_selection = deepcopy(s)
         if (base_op):
-            new_selection.column.df_name = base_op.df_name
+            # the values of the selection are shared, only the column is new
+            new_selection = copy(s)
+            new_selection.column = ColumnRef(s.column.col_name, base_op.df_name)
             return new_selection
         else:
             return None
@@ -141,17 +156,54 @@ class Context(object):
         return new_df
 
 
-    def find_joinable_base(self, current_bases: List[BaseOp], selection_base_df: DFName) -> Optional[JoinInfo]:
+    def find_join_path(self, current_bases: List[BaseOp], selection_base_df: DFName) -> Optional[List[JoinInfo]]:
         """
-        note that the current_base is left_df, and the base to join with is right_df
+        note that the current_base is the left_df of the first hop, and the base to join with is the right_df of the last
         """
-        for b in current_bases:
-            r = self.join_info.get((b.df_name, selection_base_df))
-            if r is not None:
-                return r
+        sources = tuple(sorted(set(b.df_name for b in current_bases)))
+        key = (sources, selection_base_df)
+        if key not in self.join_paths:
+            self.join_paths[key] = self.find_cheapest_join_path(set(sources), selection_base_df)
+        return self.join_paths[key]
+
+
+    def find_cheapest_join_path(self, sources: Set[DFName], target: DFName) -> Optional[List[JoinInfo]]:
+        """the join_info pairs are the edges of a graph, and the cost of a path is the
+        number of rows of the dfs in between, since each of them has to be filtered.
+        The search starts from the target, which is where all the paths end."""
+        neighbors = defaultdict(list)
+        for (left, right) in self.join_info.keys():
+            neighbors[right].append(left)
+        costs = {target: 0}
+        next_hop: Dict[DFName, DFName] = {}
+        # the counter breaks the ties without comparing the names
+        queue = [(0, 0, target)]
+        counter = 1
+        while len(queue) > 0:
+            cost, _, current = heappop(queue)
+            if cost > costs[current]:
+                continue
+            if current in sources:
+                path = []
+                while current != target:
+                    path.append(self.join_info[(current, next_hop[current])])
+                    current = next_hop[current]
+                return path
+            for n in neighbors[current]:
+                new_cost = cost + (0 if n in sources else self.get_num_rows(n))
+                if n not in costs or new_cost < costs[n]:
+                    costs[n] = new_cost
+                    next_hop[n] = current
+                    heappush(queue, (new_cost, counter, n))
+                    counter += 1
         return None
 
 
+    def get_num_rows(self, df_name: DFName) -> int:
+        table = self.get_df(df_name).table
+        return 0 if table is None else table.num_rows
+
+
     def apply_selection_from_single_df(self, ops: RelationalOp, df_name: DFName, selections: List[SelectionValue]) -> RelationalOp:
         # here we can assume that all the selections have the same df
         bases = find_all_baseops(ops)
@@ -163,10 +215,10 @@ class Context(object):
             replacement_op = apply_non_join_selection(non_join_base, selections)
         else:
             # search for which one we can actually join with 
-            r = self.find_joinable_base(bases, df_name)
+            r = self.find_join_path(bases, df_name)
             if r:
-                # it's always the right one (by construct)
-                local_base_df_name = r.left_df.df_name
+                # it's always the left of the first hop (by construct)
+                local_base_df_name = r[0].left_df.df_name
                 replacement_op = self.apply_join_selection(r, selections)
             else:
                 # NO OP
@@ -176,7 +228,7 @@ class Context(object):
 
         # 2. apply the replacement
         if replacement_op and local_base_df_name:
-            return set_if_eq(deepcopy(ops), replacement_op, local_base_df_name)
+            return set_if_eq(ops, replacement_op, local_base_df_name)
         raise InternalLogicalError("Replacement Op is not set or the df_name is not set")
 
 
@@ -184,30 +236,21 @@ class Context(object):
 ########    helper funcs    ########
 ####################################
 
-def set_if_eq(original: RelationalOp, replacement: RelationalOp, df_name: DFName):
-    should_return_replacement = False
-    # note that we need the special casing because of the special case
-    def _helper(op: RelationalOp, new_op: RelationalOp, parent_op: Optional[RelationalOp]):
-        if (op.op_type == RelationalOpType.base):
-            base_op = cast(BaseOp, op)
-            if (base_op.df_name == df_name):
-                # if parent_op is not defined, then we are literally replacing
-                if parent_op is None:
-                    should_return_replacement = True
-                    return
-                else:
-                    parent_op.child = new_op
-                    return
-        elif (op.has_child()):
-            return _helper(op.child, new_op, op)
-        else:
-            raise InternalLogicalError("Should either have child or be of base type")
-    
-    _helper(original, replacement, None)
-    if should_return_replacement:
-        return replacement
-    else:
+def set_if_eq(original: RelationalOp, replacement: RelationalOp, df_name: DFName) -> RelationalOp:
+    """replaces the base of df_name with replacement, only the ops on the way to
+    the base are copied, the rest of the tree is shared with the original"""
+    if (original.op_type == RelationalOpType.base):
+        base_op = cast(BaseOp, original)
+        if (base_op.df_name == df_name):
+            return replacement
         return original
+    elif (original.has_child()):
+        new_child = set_if_eq(original.child, replacement, df_name)
+        if new_child is original.child:
+            return original
+        return original.with_child(new_child)
+    else:
+        raise InternalLogicalError("Should either have child or be of base type")
 
     
 
@@ -226,7 +269,7 @@ def find_all_baseops(op: RelationalOp) -> List[BaseOp]:
     if (op.op_type == RelationalOpType.base):
         base_op = cast(BaseOp, op)
         return [base_op]
-    if (op.op_type == RelationalOpType.join):
+    if (op.op_type in (RelationalOpType.join, RelationalOpType.semi_join)):
         join_op = cast(Join, op)
         b1 = find_all_baseops(op.child)
         b2 = find_all_baseops(join_op.other._ops)
@@ -237,10 +280,17 @@ def find_all_baseops(op: RelationalOp) -> List[BaseOp]:
         return []
 
 
+def as_column_selection(columns: List[str]) -> ColumnSelection:
+    # single columns are kept as strings, which reads better in the generated code
+    if len(columns) == 1:
+        return columns[0]
+    return columns
+
+
 def apply_non_join_selection(ops: BaseOp, selections: List[SelectionValue]) -> RelationalOp:
     # it has to be BaseOp because it's used to generate the df to be replaced
     executable_predicates = list(map(create_predicate, selections))
-    new_ops = copy(ops)
+    new_ops: RelationalOp = ops
     for p in executable_predicates:
         new_ops = Where(p, new_ops)
     return new_ops
@@ -1,6 +1,6 @@
 from enum import Enum
 from functools import reduce
-from typing import List, Union, Optional, NamedTuple, Set, cast, Callable, Any
+from typing import List, Union, Optional, NamedTuple, Set, Tuple, cast, Callable, Any
 from datetime import datetime
 import inspect
 import asttokens
@@ -52,8 +52,10 @@ class TypedColumn(NamedTuple):
 
 class RelationalOpType(Enum):
     where = "where"
+    fused_where = "fused_where"
     project = "project"
     join = "join"
+    semi_join = "semi_join"
     groupby = "groupby"
     aggregation = "aggregation"
     base = "base"
@@ -112,6 +114,8 @@ class RuntimeFunctions(NamedTuple):
     # get_stream: Callable[[DFName], MidasSelectionStream] 
     apply_other_selection: Callable[['MidasDataFrame', List[SelectionValue]], Optional['MidasDataFrame']]
     add_join_info: Callable[[JoinInfo], None]
+    # when deferred, the operations only build the op tree, and are executed when the table is accessed
+    is_deferred: Callable[[], bool]
 
 
 class NotInRuntime():
@@ -350,9 +354,16 @@ class MidasDataFrame(object):
         return self.table[col_name]
 
 
+    def _eager_table(self, compute: Callable[[], Table]) -> Optional[Table]:
+        # in the deferred mode, the table is computed from the ops on first access
+        if self._rt_funcs.is_deferred():
+            return None
+        return compute()
+
+
     @add_doc(Table.select.__doc__)
     def select(self, columns: List[str]) -> 'MidasDataFrame':
-        new_table = self.table.select(columns)
+        new_table = self._eager_table(lambda: self.table.select(columns))
         new_ops = Select(columns, self._ops)
         df_name = find_name(False)
         return self.new_df_from_ops(new_ops, new_table, df_name)
@@ -360,7 +371,7 @@ class MidasDataFrame(object):
 
     @add_doc(Table.where.__doc__)
     def where(self, column_or_label, value_or_predicate=None, other=None):
-        new_table = self.table.where(column_or_label, value_or_predicate, other)
+        new_table = self._eager_table(lambda: self.table.where(column_or_label, value_or_predicate, other))
         predicate = Predicate(column_or_label, value_or_predicate, other)
         new_ops = Where(predicate, self._ops)
         df_name = find_name(False)
@@ -369,7 +380,7 @@ class MidasDataFrame(object):
 
     @add_doc(Table.join.__doc__)
     def join(self, column_label, other: 'MidasDataFrame', other_label):
-        new_table = self.table.join(column_label, other.table, other_label)
+        new_table = self._eager_table(lambda: self.table.join(column_label, other.table, other_label))
         new_ops = Join(column_label, other, other_label, self._ops)
         df_name = find_name(False)
         return self.new_df_from_ops(new_ops, new_table, df_name)
@@ -377,7 +388,7 @@ class MidasDataFrame(object):
 
     @add_doc(Table.group.__doc__)
     def group(self, column_or_label: ColumnSelection, collect=None):
-        new_table = self.table.groups(column_or_label, collect)
+        new_table = self._eager_table(lambda: self.table.groups(column_or_label, collect))
         new_ops = GroupBy(column_or_label, collect, self._ops)
         df_name = find_name(False)
         return self.new_df_from_ops(new_ops, new_table, df_name)
@@ -514,13 +525,20 @@ class MidasDataFrame(object):
         return None
 
     
-    def can_join(self, other_df: 'MidasDataFrame', col_name: str,col_name_other: Optional[str]=None):
+    def can_join(self, other_df: 'MidasDataFrame', col_name: ColumnSelection, col_name_other: Optional[ColumnSelection]=None):
+        """the selections on either df filter the other, via the rows with matching keys
+
+        Arguments:
+            col_name {ColumnSelection} -- the key column, or the columns of a composite key
+            col_name_other {Optional[ColumnSelection]} -- the key of the other df, if it is named differently
+        """
         # assume that the joins are the same name!
         if self.df_name and other_df.df_name:
-            if col_name_other:
-                columns = [JoinPredicate(ColumnRef(col_name, self.df_name), ColumnRef(col_name_other, other_df.df_name))]
-            else:
-                columns = [JoinPredicate(ColumnRef(col_name, self.df_name), ColumnRef(col_name, other_df.df_name))]
+            self_columns = [col_name] if isinstance(col_name, str) else list(col_name)
+            other_columns = self_columns if not col_name_other else ([col_name_other] if isinstance(col_name_other, str) else list(col_name_other))
+            if len(self_columns) != len(other_columns):
+                raise UserError(f"The keys {self_columns} and {other_columns} have different numbers of columns")
+            columns = [JoinPredicate(ColumnRef(c, self.df_name), ColumnRef(o, other_df.df_name)) for c, o in zip(self_columns, other_columns)]
             join_info = JoinInfo(self, other_df, columns)
             self._rt_funcs.add_join_info(join_info)
         else:
@@ -556,10 +574,48 @@ class MidasDataFrame(object):
 
 
 class RelationalOp(object):
+    """The ops are immutable, such that a rewrite (e.g., applying a selection) shares all
+    the subtrees it does not touch, instead of copying them (and the tables they hold).
+    Use `with_child` to get a modified copy.
+    """
+    __slots__ = ("op_type",)
     # chilren
     op_type: RelationalOpType
     child: 'RelationalOp'  # type: ignore
 
+    def _set(self, **fields):
+        for k, v in fields.items():
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, name, value):
+        raise InternalLogicalError(f"RelationalOp is immutable, use with_child instead of setting {name}")
+
+    def __delattr__(self, name):
+        raise InternalLogicalError(f"RelationalOp is immutable, cannot delete {name}")
+
+    # nothing to copy since nothing changes
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # the default pickling restores the fields with setattr, which the ops do not allow
+        fields = {k: getattr(self, k) for cls in type(self).__mro__ for k in getattr(cls, "__slots__", ())}
+        return (rebuild_op, (type(self), fields))
+
+    def with_child(self, child: 'RelationalOp') -> 'RelationalOp':
+        """returns a copy of this op (but not of its fields) with the child replaced"""
+        if not self.has_child():
+            raise InternalLogicalError(f"{self.op_type} has no child to replace")
+        new_op = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for k in getattr(cls, "__slots__", ()):
+                object.__setattr__(new_op, k, getattr(self, k))
+        object.__setattr__(new_op, "child", child)
+        return new_op
+
     def has_child(self):
         if hasattr(self, "child") and (self.child is not None):
             return True
@@ -567,12 +623,17 @@ class RelationalOp(object):
     pass
 
 
+def rebuild_op(op_class, fields) -> RelationalOp:
+    op = object.__new__(op_class)
+    op._set(**fields)
+    return op
+
+
 class BaseOp(RelationalOp):
+    __slots__ = ("df_name", "df_id", "table")
+
     def __init__(self, df_name: DFName, df_id: DFId, table: Table):
-        self.op_type = RelationalOpType.base
-        self.df_name = df_name
-        self.df_id = df_id
-        self.table = table
+        self._set(op_type=RelationalOpType.base, df_name=df_name, df_id=df_id, table=table)
     
     def __repr__(self):
         return f"{{{self.op_type.value}: '{self.df_name}'}}"
@@ -580,35 +641,45 @@ class BaseOp(RelationalOp):
         return self.__repr__()
 
 class Select(RelationalOp):
+    __slots__ = ("columns", "child")
+
     def __init__(self, columns: ColumnSelection, child: RelationalOp):
-        self.op_type = RelationalOpType.project
-        self.columns = columns
-        self.child = child
+        self._set(op_type=RelationalOpType.project, columns=columns, child=child)
     
     def __repr__(self):
         return f"{{{self.op_type.value}: {{columns:{self.columns}, of: {self.child}}}}}"
 
 
 class GroupBy(RelationalOp):
+    __slots__ = ("columns", "collect", "child")
+
     def __init__(self, columns: ColumnSelection, collect, child: RelationalOp):
-        self.op_type = RelationalOpType.groupby
-        self.columns = columns
-        self.collect = collect
-        self.child = child
+        self._set(op_type=RelationalOpType.groupby, columns=columns, collect=collect, child=child)
 
     def __repr__(self):
         return f"{{{self.op_type.value}: {{columns:{self.columns}, collect:{self.collect}, child: {self.child}}}}}"
 
 class Where(RelationalOp):
+    __slots__ = ("predicate", "child")
+
     def __init__(self, predicate: Predicate, child: RelationalOp):
-        self.op_type = RelationalOpType.where
-        self.predicate = predicate
-        self.child = child
+        self._set(op_type=RelationalOpType.where, predicate=predicate, child=child)
     
     def __repr__(self):
         return f"{{{self.op_type.value}: {{predicate:{self.predicate}, of: {self.child}}}}}"
 
 
+class FusedWhere(RelationalOp):
+    """consecutive wheres fused by the optimizer into one conjunction, evaluated in the order given"""
+    __slots__ = ("predicates", "child")
+
+    def __init__(self, predicates: List[Predicate], child: RelationalOp):
+        self._set(op_type=RelationalOpType.fused_where, predicates=predicates, child=child)
+
+    def __repr__(self):
+        return f"{{{self.op_type.value}: {{predicates:{self.predicates}, of: {self.child}}}}}"
+
+
 
 class Join(RelationalOp):
     """[summary]
@@ -621,12 +692,30 @@ class Join(RelationalOp):
     
     note that other is a MidasDataFrame because at code gen time we need to knwo their names (but this is not the case for the self. #FIXME seems weird)
     """
+    __slots__ = ("self_columns", "other", "other_columns", "child")
+
     def __init__(self, self_columns: ColumnSelection, other: MidasDataFrame, other_columns: ColumnSelection, child: RelationalOp):
-        self.op_type = RelationalOpType.join
-        self.self_columns = self_columns
-        self.other = other
-        self.other_columns = other_columns
-        self.child = child
+        self._set(op_type=RelationalOpType.join, self_columns=self_columns, other=other, other_columns=other_columns, child=child)
+
+
+    def __repr__(self):
+        return f"{{{self.op_type.value}: {{left: {self.child}, right: {self.other._ops}, on: {self.self_columns},{self.other_columns}}}}}"
+
+
+class SemiJoin(RelationalOp):
+    """keeps the rows of the child whose keys are found in the other df, without adding any of
+    the other's columns, or repeating rows when the other df has repeated keys
+
+    Arguments:
+        self_columns {ColumnSelection} -- columns of the df to match on
+        other {MidasDataFrame} -- other df
+        other_columns {ColumnSelection} -- column from other df
+        child {RelationalOp} -- previous operation that produces "self"
+    """
+    __slots__ = ("self_columns", "other", "other_columns", "child")
+
+    def __init__(self, self_columns: ColumnSelection, other: MidasDataFrame, other_columns: ColumnSelection, child: RelationalOp):
+        self._set(op_type=RelationalOpType.semi_join, self_columns=self_columns, other=other, other_columns=other_columns, child=child)
 
 
     def __repr__(self):
@@ -684,24 +773,10 @@ def get_midas_code(op: RelationalOp, midas_reference_name: str) -> str:
 
         if op.op_type == RelationalOpType.where:
             s_op = cast(Where, op)
-            col_or_label = convert_value_or_predicate(
-              s_op.predicate.column_or_label,
-              midas_reference_name
-            )
-
-            val_or_pred = convert_value_or_predicate(
-              s_op.predicate.value_or_predicate,
-              midas_reference_name
-            )
-
-            if s_op.predicate.other is None:
-                return f"{prev_table}.where({col_or_label}, {val_or_pred})"
-            else:
-                other = convert_value_or_predicate(
-                    s_op.predicate.other,
-                    midas_reference_name
-                )
-                return f"{prev_table}.where({col_or_label}, {val_or_pred}, {other})"
+            return get_where_code(prev_table, s_op.predicate, midas_reference_name)
+        if op.op_type == RelationalOpType.fused_where:
+            f_op = cast(FusedWhere, op)
+            return reduce(lambda t, p: get_where_code(t, p, midas_reference_name), f_op.predicates, prev_table)
         if op.op_type == RelationalOpType.project:
             p_op = cast(Select, op)
             new_table = f"{prev_table}.select({p_op.columns!r})"
@@ -715,22 +790,67 @@ def get_midas_code(op: RelationalOp, midas_reference_name: str) -> str:
                 return f"{prev_table}.group({g_op.columns!r}, {group_fun})"
         if op.op_type == RelationalOpType.join:
             j_op = cast(Join, op)
-            join_prep_code = ""
-            # we assume that the other has data!
-            if j_op.other.df_name is not None:
-                other_df_name = j_op.other.df_name
-            else:
-                if not(hasattr(j_op.other, "_suggested_df_name") or hasattr(j_op.other._suggested_df_name, "_suggested_df_name")):
-                    raise InternalLogicalError("the join df should have a suggested name")
-                ops_code = get_midas_code(j_op.other._ops, midas_reference_name)
-                join_prep_code = f"{j_op.other._suggested_df_name} = {ops_code}"
-                other_df_name = j_op.other._suggested_df_name
+            join_prep_code, other_df_name = get_other_df_code(j_op.other, midas_reference_name)
             new_table = f"{join_prep_code}\n{prev_table}.join({j_op.self_columns!r}, {other_df_name}, {j_op.other_columns!r})"
             return new_table
+        if op.op_type == RelationalOpType.semi_join:
+            s_op = cast(SemiJoin, op)
+            join_prep_code, other_df_name = get_other_df_code(s_op.other, midas_reference_name)
+            if isinstance(s_op.self_columns, (str, int)) or len(s_op.self_columns) == 1:
+                self_column = s_op.self_columns if isinstance(s_op.self_columns, (str, int)) else s_op.self_columns[0]
+                other_column = s_op.other_columns if isinstance(s_op.other_columns, (str, int)) else s_op.other_columns[0]
+                # reads as a where, which is also what it does
+                new_table = f"{join_prep_code}\n{prev_table}.where({self_column!r}, {midas_reference_name}.are.contained_in({other_df_name}.column({other_column!r})))"
+                return new_table
+            # a where only tests a single column, so the rows of the keys are tested instead
+            *prep_code, prev_expression = prev_table.split("\n")
+            prep_code.append(join_prep_code)
+            if not prev_expression.isidentifier():
+                # the rows are read twice below
+                prep_code.append(f"{other_df_name}_probe = {prev_expression}")
+                prev_expression = f"{other_df_name}_probe"
+            prep_code.append(f"{other_df_name}_keys = set({other_df_name}.select({s_op.other_columns!r}).rows)")
+            new_table = f"{prev_expression}.where([row in {other_df_name}_keys for row in {prev_expression}.select({s_op.self_columns!r}).rows])"
+            return "\n".join([c for c in prep_code if c != ""] + [new_table])
         else:
             raise NotImplementedError(op.op_type)   
 
 
+def get_other_df_code(other: MidasDataFrame, midas_reference_name: str) -> Tuple[str, str]:
+    """returns the code to prepare the other df of a join (if it is not named), and its name"""
+    # we assume that the other has data!
+    if other.df_name is not None:
+        return "", other.df_name
+    if not(hasattr(other, "_suggested_df_name") or hasattr(other._suggested_df_name, "_suggested_df_name")):
+        raise InternalLogicalError("the join df should have a suggested name")
+    ops_code = get_midas_code(other._ops, midas_reference_name)
+    # the other might itself need preparation (e.g., for multiple hops), which goes first
+    *nested_prep_code, other_code = ops_code.split("\n")
+    prep_code = "\n".join(nested_prep_code + [f"{other._suggested_df_name} = {other_code}"]).strip("\n")
+    return prep_code, other._suggested_df_name
+
+
+def get_where_code(prev_table: str, predicate: Predicate, midas_reference_name: str) -> str:
+    col_or_label = convert_value_or_predicate(
+      predicate.column_or_label,
+      midas_reference_name
+    )
+
+    val_or_pred = convert_value_or_predicate(
+      predicate.value_or_predicate,
+      midas_reference_name
+    )
+
+    if predicate.other is None:
+        return f"{prev_table}.where({col_or_label}, {val_or_pred})"
+    else:
+        other = convert_value_or_predicate(
+            predicate.other,
+            midas_reference_name
+        )
+        return f"{prev_table}.where({col_or_label}, {val_or_pred}, {other})"
+
+
 def convert_value_or_predicate(val_or_pred, midas_reference_name) -> str:
     """Convert a value or predicate into a code string.
 
@@ -783,33 +903,23 @@ def get_lambda_declaration_or_fn_name(fn: Callable) -> str:
 
 
 def eval_op(op: RelationalOp) -> Optional[Table]:
-    # note that some of the ops would simply return 
-    if op.op_type == RelationalOpType.base:
-        b_op = cast(BaseOp, op)
-        return b_op.table
-    else:
-        prev_table = eval_op(op.child)
-        if not prev_table:
-            return None
-
-        if op.op_type == RelationalOpType.where:
-            s_op = cast(Where, op)
-            new_table = prev_table.where(s_op.predicate.column_or_label, s_op.predicate.value_or_predicate, s_op.predicate.other)
-            return new_table
-        if op.op_type == RelationalOpType.project:
-            p_op = cast(Select, op)
-            new_table = prev_table.select(p_op.columns)
-            return new_table
-        if op.op_type == RelationalOpType.groupby:
-            g_op = cast(GroupBy, op)
-            new_table = prev_table.group(g_op.columns, g_op.collect)
-            return new_table
-        if op.op_type == RelationalOpType.join:
-            j_op = cast(Join, op)
-            new_table = prev_table.join(j_op.self_columns, j_op.other.table, j_op.other_columns)
-            return new_table
-        else:
-            raise NotImplementedError(op.op_type)
+    # note that some of the ops would simply return None (e.g., empty joins)
+    # the whole tree is rewritten and executed columnar, see optimizer.py and engine.py
+    # (imported here because of cyclic imports)
+    from .engine import execute_op
+    from .optimizer import optimize, has_where_above_join
+    from .worker import compute_backend, NOT_OFFLOADED
+    optimized = optimize(op)
+    result = NOT_OFFLOADED
+    # the aggregations (e.g., of the charts) are small enough to be sent back from the workers
+    if compute_backend.enabled and optimized.op_type == RelationalOpType.groupby:
+        result = compute_backend.evaluate(optimized)
+    if result is NOT_OFFLOADED:
+        result = execute_op(optimized)
+    if result is None and has_where_above_join(op):
+        # the join might only be empty because of the wheres pushed below it
+        return execute_op(op)
+    return result
 
 
 def create_predicate(s: SelectionValue) -> Predicate:
@@ -0,0 +1,43 @@
+"""Dictionary encoding of the string columns of the tables loaded into B2.
+
+Categorical columns (e.g., state, category, status) repeat a few values over
+many rows. On load, the (sorted) dictionary of each such column, and the codes
+of its rows in the narrowest type that fits, are registered as the column's
+`DictionaryEncoding`. The column itself is left as it is, while grouping,
+filtering, distinct counts and sending the column to the front end work on
+the codes. The encoding is kept in addition to the values, so it costs
+memory rather than saving it, in exchange for not hashing the strings again.
+"""
+from typing import Optional
+import numpy as np
+from datascience import Table
+
+from b2.constants import DICTIONARY_MAX_DISTINCT_RATIO
+from .indexes import KeyIndex, DictionaryEncoding, register_encoding, get_encoding
+
+
+def encode_table(table: Table) -> Table:
+    """encodes the repetitive string columns of the table"""
+    for label in table.labels:
+        encode_column(table.column(label))
+    return table
+
+
+def encode_column(column: np.ndarray) -> Optional[DictionaryEncoding]:
+    """registers the encoding of the column, returns None if it is not a categorical
+    string column, or if the codes and the dictionary would not be smaller than the values"""
+    if column.dtype.kind not in "UO" or len(column) == 0 or get_encoding(column) is not None:
+        return None
+    index = KeyIndex.build([column])
+    if index is None or index.num_keys > DICTIONARY_MAX_DISTINCT_RATIO * len(column):
+        return None
+    dictionary = index.key_columns[0]
+    if dictionary.dtype.kind == "O":
+        if not all(isinstance(v, str) for v in dictionary):
+            return None
+        dictionary = np.array(dictionary.tolist())
+    encoding = DictionaryEncoding.from_index(dictionary, index)
+    if encoding.nbytes >= column.nbytes:
+        return None
+    register_encoding(column, encoding)
+    return encoding
@@ -0,0 +1,834 @@
+"""Columnar execution of RelationalOp trees.
+
+Instead of materializing a datascience Table at every level of the op tree,
+the ops are evaluated against references to the base columns plus the row
+ids that survive so far. Only the final result is turned into a Table.
+"""
+from functools import reduce
+from typing import Dict, List, Optional, Tuple, Callable, Any, cast
+import numbers
+import numpy as np
+from datascience import Table, are
+
+from b2.util.errors import NotAllCaseHandledError
+from .dataframe import RelationalOp, RelationalOpType, BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin, Predicate, ColumnSelection
+from .predicate_compiler import compile_predicate
+from .cache import Fingerprinter, Uncacheable, result_cache
+from .indexes import NOT_INDEXED, index_cache, get_key_index, get_key_order, pin_key_index, get_sorted_index, get_encoding, get_translation, has_null, comparable_keys
+from .tiles import CountTile, interactive_index
+from .bitmaps import get_bitmap_index
+from .partitions import MERGEABLE_AGGREGATES, partitioned_mask, partitioned_counts, partitioned_aggregates
+
+# marks a cache miss, since None is a valid (empty) result
+NOT_CACHED = object()
+
+
+class Segment(object):
+    """A group of columns that share the same row ids into their original arrays.
+
+    Arguments:
+        columns {Dict[str, np.ndarray]} -- the (unfiltered) arrays, keyed by their label in the view
+        rows {Optional[np.ndarray]} -- the row ids into the arrays, None means all of the rows in order
+        owned {bool} -- whether the arrays were created during execution (as opposed to being the base's)
+    """
+    def __init__(self, columns: Dict[str, np.ndarray], rows: Optional[np.ndarray], owned: bool = False):
+        self.columns = columns
+        self.rows = rows
+        self.owned = owned
+
+    def take(self, positions: np.ndarray) -> 'Segment':
+        if self.rows is None:
+            return Segment(self.columns, positions, self.owned)
+        return Segment(self.columns, self.rows[positions], self.owned)
+
+    @property
+    def nbytes(self) -> int:
+        n = 0 if self.rows is None else self.rows.nbytes
+        if self.owned:
+            n += sum(c.nbytes for c in self.columns.values())
+        return n
+
+    def gather(self, label: str) -> np.ndarray:
+        column = self.columns[label]
+        if self.rows is None:
+            return column
+        return column[self.rows]
+
+
+class ColumnarView(object):
+    """The lazy representation of an intermediate result.
+
+    Filtering and joining only touches the row ids of the segments,
+    the column values are gathered on demand.
+    """
+    def __init__(self, labels: List[str], segments: List[Segment], num_rows: int):
+        self.labels = labels
+        self.segments = segments
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_table(cls, table: Table, owned: bool = False) -> 'ColumnarView':
+        labels = list(table.labels)
+        columns = {l: table.column(l) for l in labels}
+        return cls(labels, [Segment(columns, None, owned)], table.num_rows)
+
+    @classmethod
+    def from_columns(cls, labels: List[str], columns: List[np.ndarray]) -> 'ColumnarView':
+        num_rows = len(columns[0]) if len(columns) > 0 else 0
+        return cls(labels, [Segment(dict(zip(labels, columns)), None, True)], num_rows)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.segments)
+
+    def _segment_of(self, label: str) -> Segment:
+        for s in self.segments:
+            if label in s.columns:
+                return s
+        raise ValueError(f"The column {label} is not in the table")
+
+    def column(self, label: str) -> np.ndarray:
+        if label not in self.labels:
+            raise ValueError(f"The column {label} is not in the table")
+        return self._segment_of(label).gather(label)
+
+    def as_label(self, label_or_index) -> str:
+        if isinstance(label_or_index, numbers.Integral):
+            return self.labels[label_or_index]
+        return label_or_index
+
+    def take(self, positions: np.ndarray) -> 'ColumnarView':
+        segments = [s.take(positions) for s in self.segments]
+        return ColumnarView(self.labels, segments, len(positions))
+
+    def select(self, labels: List[str]) -> 'ColumnarView':
+        for l in labels:
+            # fail early, same as datascience
+            self._segment_of(l)
+        segments = []
+        for s in self.segments:
+            columns = {l: c for l, c in s.columns.items() if l in labels}
+            if len(columns) > 0:
+                segments.append(Segment(columns, s.rows, s.owned))
+        return ColumnarView(labels, segments, self.num_rows)
+
+    def to_table(self) -> Table:
+        labels_and_values = []
+        for l in self.labels:
+            labels_and_values.extend([l, self.column(l)])
+        return Table().with_columns(*labels_and_values)
+
+
+def execute_op(op: RelationalOp) -> Optional[Table]:
+    """Executes the whole op tree and materializes only the final result.
+
+    Returns None if any join along the way is empty, which mirrors
+    datascience's `Table.join`.
+    """
+    view = evaluate(op)
+    if view is None:
+        return None
+    return view.to_table()
+
+
+def evaluate(op: RelationalOp, fingerprints: Optional[Fingerprinter] = None) -> Optional[ColumnarView]:
+    """evaluates the op, reusing the intermediate results of structurally identical ops from `result_cache`"""
+    if op.op_type == RelationalOpType.base:
+        b_op = cast(BaseOp, op)
+        return ColumnarView.from_table(b_op.table)
+
+    if fingerprints is None:
+        fingerprints = Fingerprinter()
+    key = fingerprints.of(op)
+    if key is not None:
+        cached = result_cache.get(key, NOT_CACHED)
+        if cached is not NOT_CACHED:
+            return cached
+    view = evaluate_node(op, fingerprints)
+    if key is not None:
+        nbytes = 0 if view is None else view.nbytes
+        result_cache.put(key, view, nbytes, tuple(fingerprints.anchors))
+    return view
+
+
+def evaluate_node(op: RelationalOp, fingerprints: Fingerprinter) -> Optional[ColumnarView]:
+    if op.op_type == RelationalOpType.groupby and interactive_index.enabled:
+        tiled = apply_group_with_tile(cast(GroupBy, op), fingerprints)
+        if tiled is not None:
+            return tiled
+    prev_view = evaluate(op.child, fingerprints)
+    if prev_view is None:
+        return None
+
+    if op.op_type == RelationalOpType.where:
+        w_op = cast(Where, op)
+        return apply_where(prev_view, w_op.predicate)
+    if op.op_type == RelationalOpType.fused_where:
+        f_op = cast(FusedWhere, op)
+        return apply_fused_where(prev_view, f_op.predicates)
+    if op.op_type == RelationalOpType.project:
+        p_op = cast(Select, op)
+        return prev_view.select(as_labels(prev_view, p_op.columns))
+    if op.op_type == RelationalOpType.groupby:
+        g_op = cast(GroupBy, op)
+        return apply_group(prev_view, g_op.columns, g_op.collect)
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        other_view = evaluate_df(j_op.other, fingerprints)
+        if other_view is None:
+            return None
+        return apply_join(prev_view, j_op.self_columns, other_view, j_op.other_columns)
+    if op.op_type == RelationalOpType.semi_join:
+        s_op = cast(SemiJoin, op)
+        other_view = evaluate_df(s_op.other, fingerprints)
+        if other_view is None:
+            # same as joining with an empty df
+            return prev_view.take(np.arange(0))
+        return apply_semi_join(prev_view, s_op.self_columns, other_view, s_op.other_columns)
+    raise NotImplementedError(op.op_type)
+
+
+def evaluate_df(df, fingerprints: Fingerprinter) -> Optional[ColumnarView]:
+    """evaluates the other side of a join, note that the df might have been sorted
+    or mutated in place, in which case its table is the source of truth."""
+    if hasattr(df, "_table") and (df._table is not None):
+        return ColumnarView.from_table(df._table)
+    return evaluate(df._ops, fingerprints)
+
+
+def as_labels(view: ColumnarView, columns: ColumnSelection) -> List[str]:
+    if isinstance(columns, (str, numbers.Integral)):
+        return [view.as_label(columns)]
+    return [view.as_label(c) for c in columns]
+
+
+####################################
+########       where        ########
+####################################
+
+def apply_where(view: ColumnarView, predicate: Predicate) -> ColumnarView:
+    positions, _ = apply_sorted_index(view, [predicate])
+    if positions is not None:
+        return view.take(positions)
+    mask = where_mask(view, predicate)
+    return view.take(np.flatnonzero(mask))
+
+
+def apply_fused_where(view: ColumnarView, predicates: List[Predicate]) -> ColumnarView:
+    """each predicate is only evaluated on the rows that passed the previous ones,
+    the values are not gathered until the caller needs them"""
+    positions, predicates = apply_sorted_index(view, predicates)
+    if positions is None:
+        positions, predicates = apply_bitmaps(view, predicates)
+    current = view if positions is None else view.take(positions)
+    if positions is None:
+        positions = np.arange(view.num_rows)
+    for p in predicates:
+        if len(positions) == 0:
+            break
+        mask = where_mask(current, p)
+        positions = positions[mask]
+        current = view.take(positions)
+    return current
+
+
+def apply_sorted_index(view: ColumnarView, predicates: List[Predicate]) -> Tuple[Optional[np.ndarray], List[Predicate]]:
+    """finds the rows of the narrowest range predicate on an unfiltered base with binary search,
+    returns the positions that pass it (None if no predicate qualifies) and the other predicates"""
+    if not interactive_index.enabled:
+        # sorting a large column takes much longer than scanning it, so it is only worth it
+        # when the user asked for the indexes that speed up brushing
+        return None, predicates
+    best = None
+    for p in predicates:
+        segment = filter_segment(view, p)
+        if segment is None or segment.rows is not None:
+            continue
+        column = segment.columns[p.column_or_label]
+        compiled = compile_predicate(p.value_or_predicate)
+        bounds = None if compiled is None else compiled.value_range(column)
+        if bounds is None:
+            continue
+        index = get_sorted_index(column)
+        if index is None:
+            continue
+        candidates = index.range_rows(*bounds)
+        # sorting the rows of a wide range costs more than scanning the column
+        if 8 * len(candidates) <= view.num_rows and (best is None or len(candidates) < len(best[1])):
+            best = (p, candidates, compiled, column)
+    if best is None:
+        return None, predicates
+    p, candidates, compiled, column = best
+    positions = np.sort(candidates)
+    # the range is a little wider than the predicate
+    mask = compiled.mask(column[positions])
+    if mask is None:
+        return None, predicates
+    return positions[mask], [q for q in predicates if q is not p]
+
+
+def apply_bitmaps(view: ColumnarView, predicates: List[Predicate]) -> Tuple[Optional[np.ndarray], List[Predicate]]:
+    """ands the bitmaps of the predicates on the categorical columns of an unfiltered base,
+    returns the positions that pass them (None if there were none) and the other predicates"""
+    packed = None
+    rest = []
+    for p in predicates:
+        bits = None
+        segment = filter_segment(view, p)
+        if segment is not None and segment.rows is None:
+            index = get_bitmap_index(segment.columns[p.column_or_label])
+            compiled = None if index is None else compile_predicate(p.value_or_predicate)
+            bits = None if compiled is None else index.packed(compiled)
+        if bits is None:
+            rest.append(p)
+        else:
+            packed = bits if packed is None else packed & bits
+    if packed is None:
+        return None, predicates
+    return np.flatnonzero(np.unpackbits(packed, count=view.num_rows).view(bool)), rest
+
+
+def bitmap_mask(view: ColumnarView, predicate: Predicate) -> Optional[np.ndarray]:
+    segment = filter_segment(view, predicate)
+    if segment is None:
+        return None
+    index = get_bitmap_index(segment.columns[predicate.column_or_label])
+    if index is None or (segment.rows is not None and 8 * len(segment.rows) < index.num_rows):
+        # unpacking all of the bits is not worth it for a few rows
+        return None
+    compiled = compile_predicate(predicate.value_or_predicate)
+    packed = None if compiled is None else index.packed(compiled)
+    if packed is None:
+        return None
+    mask = index.unpack(packed)
+    return mask if segment.rows is None else mask[segment.rows]
+
+
+def encoded_mask(view: ColumnarView, predicate: Predicate) -> Optional[np.ndarray]:
+    """evaluates the predicate once per distinct value of a dictionary encoded column"""
+    segment = filter_segment(view, predicate)
+    if segment is None:
+        return None
+    encoding = get_encoding(segment.columns[predicate.column_or_label])
+    if encoding is None:
+        return None
+    key_mask = predicate_mask(encoding.dictionary, predicate.value_or_predicate)
+    return key_mask[gather_codes(encoding.codes, segment.rows)]
+
+
+def filter_segment(view: ColumnarView, predicate: Predicate) -> Optional[Segment]:
+    """the base segment of the column that the predicate filters on, if it is a plain value predicate"""
+    label = predicate.column_or_label
+    if not isinstance(label, str) or predicate.other is not None or predicate.value_or_predicate is None:
+        return None
+    if label not in view.labels:
+        return None
+    segment = view._segment_of(label)
+    return None if segment.owned else segment
+
+
+def where_mask(view: ColumnarView, predicate: Predicate) -> np.ndarray:
+    """follows the semantics of `Table.where`"""
+    mask = bitmap_mask(view, predicate)
+    if mask is None:
+        mask = encoded_mask(view, predicate)
+    if mask is not None:
+        return mask
+    column = get_column(view, predicate.column_or_label)
+    if predicate.other is not None:
+        if not callable(predicate.value_or_predicate):
+            raise NotAllCaseHandledError("Predicate required for 3-arg where")
+        other = get_column(view, predicate.other)
+        return pairwise_mask(column, predicate.value_or_predicate, other)
+    if predicate.value_or_predicate is not None:
+        return predicate_mask(column, predicate.value_or_predicate)
+    mask = np.zeros(len(column), dtype=bool)
+    mask[np.nonzero(column)[0]] = True
+    return mask
+
+
+def get_column(view: ColumnarView, column_or_label) -> np.ndarray:
+    if isinstance(column_or_label, (str, numbers.Integral)):
+        return view.column(view.as_label(column_or_label))
+    column = np.asarray(column_or_label)
+    if len(column) != view.num_rows:
+        raise ValueError(f"Column length mismatch. Got {len(column)} values for {view.num_rows} rows")
+    return column
+
+
+def predicate_mask(column: np.ndarray, value_or_predicate) -> np.ndarray:
+    compiled = compile_predicate(value_or_predicate)
+    if compiled is not None:
+        # the comparisons are elementwise, so the ranges of a large column can be compared in parallel
+        mask = partitioned_mask(lambda start, end: compiled.mask(column[start:end]), len(column))
+        if mask is not None:
+            return mask
+    # not something we can vectorize, call the predicate per value
+    if callable(value_or_predicate):
+        predicate = value_or_predicate
+    else:
+        predicate = are.equal_to(value_or_predicate)
+    return np.fromiter((bool(predicate(x)) for x in column), dtype=bool, count=len(column))
+
+
+def pairwise_mask(column: np.ndarray, predicate: Callable, other: np.ndarray) -> np.ndarray:
+    return np.fromiter((bool(predicate(y)(x)) for x, y in zip(column, other)), dtype=bool, count=len(column))
+
+
+####################################
+########      group by      ########
+####################################
+
+def apply_group(view: ColumnarView, columns: ColumnSelection, collect) -> ColumnarView:
+    # a list as long as the table is treated as a column by datascience
+    is_column_values = not isinstance(columns, (str, numbers.Integral)) and len(columns) == view.num_rows
+    if collect is not None and not is_column_values and view.num_rows > 0:
+        aggregated = indexed_group_aggregates(view, as_labels(view, columns), collect)
+        if aggregated is not None:
+            return aggregated
+    if collect is not None or is_column_values or view.num_rows == 0:
+        return fallback(view, lambda t: t.group(columns, collect))
+    labels = as_labels(view, columns)
+    count_label = "count"
+    if count_label in labels:
+        # datascience has its own (inconsistent) ways of naming the count here
+        return fallback(view, lambda t: t.group(columns, collect))
+    indexed = indexed_group_counts(view, labels)
+    if indexed is not None:
+        result_columns, counts = indexed
+        return ColumnarView.from_columns(labels + [count_label], result_columns + [counts])
+    key_columns = [view.column(l) for l in labels]
+    encoded = encode_keys(key_columns)
+    if encoded is None:
+        return fallback(view, lambda t: t.group(columns, collect))
+    codes, key_values = encoded
+    group_codes, first_rows, counts = np.unique(codes, return_index=True, return_counts=True)
+    result_columns = [to_group_keys(k[first_rows]) for k in key_values]
+    return ColumnarView.from_columns(labels + [count_label], result_columns + [counts])
+
+
+def indexed_group_counts(view: ColumnarView, labels: List[str]) -> Optional[Tuple[List[np.ndarray], np.ndarray]]:
+    """when grouping the (filtered) rows of a base, the index of the base columns already maps
+    each row to its group, so the counts are a bincount over the remaining rows only"""
+    segment = base_segment_of(view, labels)
+    if segment is None:
+        return None
+    index = get_key_index([segment.columns[l] for l in labels])
+    if index is None:
+        return None
+    counts = partitioned_counts(lambda start, end: gather_range(index.codes, segment.rows, start, end), index.num_keys, view.num_rows)
+    # datascience only has the groups that are not empty
+    present = np.flatnonzero(counts)
+    return [to_group_keys(k[present]) for k in index.key_columns], counts[present]
+
+
+def indexed_group_aggregates(view: ColumnarView, labels: List[str], collect) -> Optional[ColumnarView]:
+    """`group` with one of the numpy aggregates (sum, mean, min and max) as collect, from the index
+    of the base columns and the partial aggregates of each range of rows"""
+    if not is_mergeable(collect):
+        return None
+    kind = MERGEABLE_AGGREGATES[collect]
+    segment = base_segment_of(view, labels)
+    if segment is None:
+        return None
+    others = [l for l in view.labels if l not in labels]
+    other_segments = [view._segment_of(l) for l in others]
+    # strings and objects go to datascience, which collects them in its own ways
+    if any(s.columns[l].dtype.kind not in "iuf" for l, s in zip(others, other_segments)):
+        return None
+    index = get_key_index([segment.columns[l] for l in labels])
+    if index is None:
+        return None
+    counts, aggregates = partitioned_aggregates(
+        lambda start, end: gather_range(index.codes, segment.rows, start, end),
+        lambda start, end: [gather_range(s.columns[l], s.rows, start, end) for l, s in zip(others, other_segments)],
+        kind, index.num_keys, view.num_rows)
+    present = np.flatnonzero(counts)
+    result_columns = [to_group_keys(k[present]) for k in index.key_columns]
+    for l, s, aggregate in zip(others, other_segments, aggregates):
+        result_columns.append(aggregate.result(s.columns[l], counts, present))
+    # same as `_collected_label` in datascience
+    collected_labels = [l if collect.__name__.startswith("<") else f"{l} {collect.__name__}" for l in others]
+    return ColumnarView.from_columns(labels + collected_labels, result_columns)
+
+
+def prepare_group_index(op: RelationalOp):
+    """builds the index used by `indexed_group_counts` ahead of time (e.g., when the chart
+    is shown), such that the first interaction does not pay for it, and pins it, since
+    every interaction with the chart needs it"""
+    if op.op_type != RelationalOpType.groupby:
+        return
+    g_op = cast(GroupBy, op)
+    if g_op.collect is not None and not is_mergeable(g_op.collect):
+        return
+    columns = [g_op.columns] if isinstance(g_op.columns, str) else g_op.columns
+    if not all(isinstance(c, str) for c in columns):
+        return
+    child = g_op.child
+    # these keep the columns of the base as they are
+    while child.op_type in (RelationalOpType.where, RelationalOpType.fused_where, RelationalOpType.project, RelationalOpType.semi_join):
+        child = child.child
+    if child.op_type != RelationalOpType.base:
+        return
+    table = cast(BaseOp, child).table
+    if all(c in table.labels for c in columns):
+        pin_key_index([table.column(c) for c in columns])
+
+
+def apply_group_with_tile(g_op: GroupBy, fingerprints: Fingerprinter) -> Optional[ColumnarView]:
+    """answers the group by of a filtered base from a `CountTile`, when one of
+    the predicates is being brushed. Returns None if it does not apply"""
+    if g_op.collect is not None:
+        return None
+    labels = [g_op.columns] if isinstance(g_op.columns, str) else list(g_op.columns)
+    if "count" in labels or not all(isinstance(l, str) for l in labels):
+        return None
+    chain = where_chain(g_op.child)
+    if chain is None:
+        return None
+    predicates, base = chain
+    table = base.table
+    if not all(l in table.labels for l in labels):
+        return None
+    predicate_keys: Dict[str, Any] = {}
+    for p in predicates:
+        label = p.column_or_label
+        if not isinstance(label, str) or p.other is not None or label in predicate_keys or label not in table.labels:
+            return None
+        try:
+            predicate_keys[label] = fingerprints.predicate_key(p.value_or_predicate)
+        except Uncacheable:
+            return None
+    active_label = interactive_index.find_active((fingerprints.table_version(table), tuple(labels)), predicate_keys)
+    if active_label is None:
+        return None
+    active = [p for p in predicates if p.column_or_label == active_label][0]
+    # the tile is over the rows that pass the other predicates, which do not change while brushing
+    passive_op = reduce(lambda child, p: Where(p, child), [p for p in predicates if p is not active], cast(RelationalOp, base))
+    tile = get_count_tile(passive_op, active_label, labels, fingerprints)
+    if tile is None:
+        return None
+    counts = tile.group_counts(active.value_or_predicate)
+    if counts is None:
+        return None
+    present = np.flatnonzero(counts)
+    if len(present) == 0:
+        # leave the empty table to datascience
+        return None
+    key_columns = [to_group_keys(k[present]) for k in tile.group_index.key_columns]
+    return ColumnarView.from_columns(labels + ["count"], key_columns + [counts[present]])
+
+
+def get_count_tile(passive_op: RelationalOp, active_label: str, labels: List[str], fingerprints: Fingerprinter) -> Optional[CountTile]:
+    passive_key = fingerprints.of(passive_op)
+    if passive_key is None:
+        return None
+    key = ("count_tile", passive_key, active_label, tuple(labels))
+    tile = index_cache.get(key, NOT_INDEXED)
+    if tile is not NOT_INDEXED:
+        return tile
+    tile = None
+    passive_view = evaluate(passive_op, fingerprints)
+    segment = None if passive_view is None else base_segment_of(passive_view, [active_label] + labels)
+    if segment is not None:
+        active_column = segment.columns[active_label]
+        group_columns = [segment.columns[l] for l in labels]
+        active_index = get_key_index([active_column])
+        group_index = get_key_index(group_columns)
+        if active_index is not None and group_index is not None:
+            tile = CountTile.build(active_index, group_index, segment.rows)
+    nbytes = 0 if tile is None else tile.nbytes
+    index_cache.put(key, tile, nbytes, tuple(fingerprints.anchors))
+    return tile
+
+
+def where_chain(op: RelationalOp) -> Optional[Tuple[List[Predicate], BaseOp]]:
+    """the predicates of the wheres directly on top of a base, None if there is anything else"""
+    predicates: List[Predicate] = []
+    while op.op_type in (RelationalOpType.where, RelationalOpType.fused_where):
+        if op.op_type == RelationalOpType.where:
+            predicates.append(cast(Where, op).predicate)
+        else:
+            predicates.extend(cast(FusedWhere, op).predicates)
+        op = op.child
+    if op.op_type != RelationalOpType.base or len(predicates) == 0:
+        return None
+    return predicates, cast(BaseOp, op)
+
+
+def to_group_keys(keys: np.ndarray) -> np.ndarray:
+    # datascience builds the group keys from a python list
+    if keys.dtype == object:
+        return np.array(keys.tolist())
+    return keys
+
+
+####################################
+########        join        ########
+####################################
+
+def apply_join(left: ColumnarView, left_columns: ColumnSelection, right: ColumnarView, right_columns: Optional[ColumnSelection]) -> Optional[ColumnarView]:
+    """follows the semantics of `Table.join`, including its relabeling of repeated columns
+    and sorting by the join columns"""
+    if right_columns is None:
+        right_columns = left_columns
+    if left.num_rows == 0 or right.num_rows == 0:
+        return None
+    left_labels = as_labels(left, left_columns)
+    right_labels = as_labels(right, right_columns)
+    matched = match_indexed_keys(left, left_labels, right, right_labels)
+    if matched is None:
+        matched = match_keys([left.column(l) for l in left_labels], [right.column(l) for l in right_labels])
+    if matched is None:
+        def join_tables(t: Table):
+            return t.join(left_columns, right.to_table(), right_columns)
+        return fallback(left, join_tables)
+    left_rows, right_rows = matched
+    if len(left_rows) == 0:
+        return None
+    return combine_join(left, left_labels, left_rows, right, right_labels, right_rows)
+
+
+def match_indexed_keys(left: ColumnarView, left_labels: List[str], right: ColumnarView, right_labels: List[str]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """same as `match_keys`, but uses the cached `KeyIndex` of the base columns,
+    so joining against the same base again (e.g., on every brush) does not rebuild
+    the index, only the rows that survived the filters are probed.
+    Returns None if neither side is a base column, or the keys cannot be indexed"""
+    coded = indexed_codes(left, left_labels, right, right_labels)
+    if coded is None:
+        return None
+    left_codes, right_codes, num_keys, left_order, right_order = coded
+    return match_codes(left_codes, right_codes, num_keys, left_order, right_order)
+
+
+def indexed_codes(left: ColumnarView, left_labels: List[str], right: ColumnarView, right_labels: List[str]):
+    """the codes of both sides, in terms of the keys of one of the indexes, as well as
+    the rows of each side sorted by code, if the index already has them"""
+    for l, r in zip(left_labels, right_labels):
+        if not comparable_keys(left._segment_of(l).columns[l], right._segment_of(r).columns[r]):
+            return None
+    left_segment = base_segment_of(left, left_labels)
+    right_segment = base_segment_of(right, right_labels)
+    left_columns = None if left_segment is None else [left_segment.columns[l] for l in left_labels]
+    right_columns = None if right_segment is None else [right_segment.columns[l] for l in right_labels]
+    left_index = None if left_columns is None else get_key_index(left_columns)
+    right_index = None if right_columns is None else get_key_index(right_columns)
+    if left_index is None and right_index is None:
+        return None
+
+    index = left_index if left_index is not None else right_index
+    left_order = None
+    if left_index is not None:
+        left_codes = gather_codes(left_index.codes, left_segment.rows)
+        if left_segment.rows is None:
+            left_order = get_key_order(left_index, left_columns)
+    else:
+        left_codes = index.lookup([left.column(l) for l in left_labels])
+    right_order = None
+    if right_index is not None:
+        if right_index is index:
+            right_codes = gather_codes(right_index.codes, right_segment.rows)
+        else:
+            translation = get_translation(index, left_columns, right_index, right_columns)
+            if translation is None:
+                return None
+            right_codes = translation[gather_codes(right_index.codes, right_segment.rows)]
+        if right_segment.rows is None:
+            # the translation preserves the order of the keys
+            right_order = get_key_order(right_index, right_columns)
+    else:
+        right_codes = index.lookup([right.column(l) for l in right_labels])
+    if left_codes is None or right_codes is None:
+        return None
+    return left_codes, right_codes, index.num_keys, left_order, right_order
+
+
+def base_segment_of(view: ColumnarView, labels: List[str]) -> Optional[Segment]:
+    """the segment holding all the labels, if they are columns of a base table,
+    the columns created during execution are not worth indexing"""
+    segment = view._segment_of(labels[0])
+    if segment.owned or any(l not in segment.columns for l in labels):
+        return None
+    return segment
+
+
+def gather_codes(codes: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+    return codes if rows is None else codes[rows]
+
+
+def gather_range(column: np.ndarray, rows: Optional[np.ndarray], start: int, end: int) -> np.ndarray:
+    """the values of the rows from start to end of the view"""
+    return column[start:end] if rows is None else column[rows[start:end]]
+
+
+def is_mergeable(collect) -> bool:
+    try:
+        return collect in MERGEABLE_AGGREGATES
+    except TypeError:
+        # not hashable, so not one of them
+        return False
+
+
+def match_keys(left_keys: List[np.ndarray], right_keys: List[np.ndarray]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """returns the positions of all the matching (left, right) pairs, sorted by the key,
+    and then by the left and right positions, which is the order datascience produces.
+    Returns None if the keys cannot be handled with numpy (e.g., nulls and mixed types)"""
+    n_left = len(left_keys[0])
+    joint_keys = []
+    for l, r in zip(left_keys, right_keys):
+        if not comparable_keys(l, r):
+            return None
+        joint_keys.append(np.concatenate([l, r]))
+    encoded = encode_keys(joint_keys)
+    if encoded is None:
+        return None
+    codes, _ = encoded
+    return match_codes(codes[:n_left], codes[n_left:], int(codes.max(initial=-1)) + 1)
+
+
+def match_codes(left_codes: np.ndarray, right_codes: np.ndarray, num_codes: int, left_order: Optional[np.ndarray] = None, right_order: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """pairs up the rows with the same code, where -1 means no match
+
+    Arguments:
+        left_order {Optional[np.ndarray]} -- the left positions already sorted by code (and position), saves a sort
+        right_order {Optional[np.ndarray]} -- same for the right
+    """
+    if right_order is None:
+        right_order = np.argsort(right_codes, kind="mergesort")
+    right_order = right_order[right_codes[right_order] >= 0]
+    right_counts = np.bincount(right_codes[right_order], minlength=num_codes)
+    right_starts = np.cumsum(right_counts) - right_counts
+    if left_order is None:
+        left_positions = np.flatnonzero(left_codes >= 0)
+    else:
+        left_positions = left_order[left_codes[left_order] >= 0]
+    matched_codes = left_codes[left_positions]
+    counts = right_counts[matched_codes]
+    left_rows = np.repeat(left_positions, counts)
+    offsets = np.arange(len(left_rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    right_rows = right_order[np.repeat(right_starts[matched_codes], counts) + offsets]
+    if left_order is not None:
+        # already sorted by the key
+        return left_rows, right_rows
+    order = np.argsort(left_codes[left_rows], kind="mergesort")
+    return left_rows[order], right_rows[order]
+
+
+def combine_join(left: ColumnarView, left_labels: List[str], left_rows: np.ndarray, right: ColumnarView, right_labels: List[str], right_rows: np.ndarray) -> ColumnarView:
+    other_labels = [unused_label(s, left.labels) for s in right.labels]
+    if len(set(left.labels + other_labels)) != len(left.labels + other_labels):
+        other_labels = [unused_label_in_either(s, left.labels, right.labels) for s in right.labels]
+    label_map = dict(zip(right.labels, other_labels))
+
+    # the join columns of the right side are dropped
+    kept_right = [label_map[l] for l in right.labels if l not in right_labels]
+    right_segments = []
+    for s in right.take(right_rows).segments:
+        renamed = {label_map[l]: c for l, c in s.columns.items() if label_map[l] in kept_right}
+        if len(renamed) > 0:
+            right_segments.append(Segment(renamed, s.rows, s.owned))
+    labels = [l for l in left.labels if l not in left_labels]
+    labels = left_labels + labels + kept_right
+    segments = left.take(left_rows).segments + right_segments
+    return ColumnarView(labels, segments, len(left_rows))
+
+
+def unused_label(label: str, existing: List[str]) -> str:
+    original = label
+    i = 2
+    while label in existing:
+        label = f"{original}_{i}"
+        i += 1
+    return label
+
+
+def unused_label_in_either(label: str, existing_self: List[str], existing_other: List[str]) -> str:
+    original = label
+    i = 2
+    while label in existing_self:
+        label = f"{original}_{i}"
+        i += 1
+        while label in existing_other:
+            label = f"{original}_{i}"
+            i += 1
+    return label
+
+
+####################################
+########     semi join      ########
+####################################
+
+def apply_semi_join(left: ColumnarView, left_columns: ColumnSelection, right: ColumnarView, right_columns: Optional[ColumnSelection]) -> ColumnarView:
+    """keeps the left rows (in their order) whose keys are among the right keys"""
+    if right_columns is None:
+        right_columns = left_columns
+    left_labels = as_labels(left, left_columns)
+    right_labels = as_labels(right, right_columns)
+    if left.num_rows == 0 or right.num_rows == 0:
+        return left.take(np.arange(0))
+    return left.take(np.flatnonzero(semi_join_mask(left, left_labels, right, right_labels)))
+
+
+def semi_join_mask(left: ColumnarView, left_labels: List[str], right: ColumnarView, right_labels: List[str]) -> np.ndarray:
+    coded = indexed_codes(left, left_labels, right, right_labels)
+    if coded is not None:
+        left_codes, right_codes, num_keys, _, _ = coded
+    else:
+        left_keys = [left.column(l) for l in left_labels]
+        right_keys = [right.column(l) for l in right_labels]
+        encoded = None
+        if all(comparable_keys(l, r) for l, r in zip(left_keys, right_keys)):
+            encoded = encode_keys([np.concatenate([l, r]) for l, r in zip(left_keys, right_keys)])
+        if encoded is None:
+            # the keys cannot be ordered, compare them as python values (as `Table.join` would)
+            right_tuples = set(zip(*[r.tolist() for r in right_keys]))
+            return np.fromiter((k in right_tuples for k in zip(*[l.tolist() for l in left_keys])), dtype=bool, count=left.num_rows)
+        codes, _ = encoded
+        left_codes, right_codes = codes[:left.num_rows], codes[left.num_rows:]
+        num_keys = int(codes.max(initial=-1)) + 1
+    found = np.zeros(num_keys, dtype=bool)
+    found[right_codes[right_codes >= 0]] = True
+    return (left_codes >= 0) & found[np.maximum(left_codes, 0)]
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def encode_keys(key_columns: List[np.ndarray]) -> Optional[Tuple[np.ndarray, List[np.ndarray]]]:
+    """Turns one or more key columns into a single int64 code per row, such that
+    the order of the codes is the lexicographical order of the keys.
+
+    Returns:
+        the codes, and the key columns (as numpy sees them), or None if the keys
+        cannot be encoded (nulls, unorderable or too many combinations)
+    """
+    codes = None
+    values = []
+    for column in key_columns:
+        column = np.asarray(column)
+        if has_null(column):
+            return None
+        try:
+            uniques, inverse = np.unique(column, return_inverse=True)
+        except TypeError:
+            return None
+        inverse = inverse.reshape(-1).astype(np.int64)
+        if codes is None:
+            codes = inverse
+        else:
+            if (codes.max(initial=0) + 1) * len(uniques) >= np.iinfo(np.int64).max:
+                return None
+            codes = codes * len(uniques) + inverse
+        values.append(column)
+    if codes is None:
+        return None
+    return codes, values
+
+
+def fallback(view: ColumnarView, table_op: Callable[[Table], Any]) -> Optional[ColumnarView]:
+    """for the cases that are not vectorized, materialize and use datascience"""
+    result = table_op(view.to_table())
+    if result is None:
+        return None
+    return ColumnarView.from_table(result, owned=True)
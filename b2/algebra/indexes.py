@@ -0,0 +1,369 @@
+"""Indexes over the columns of the base tables, built once and reused across ticks.
+
+The indexes are keyed by the identity of the column array, which is what
+changes when the base table is modified (e.g., `t["a"] = ...` replaces the
+array), so a stale index is never used and simply ages out of the cache.
+"""
+from typing import Optional, List, Dict, Set, Tuple
+import numbers
+import weakref
+import numpy as np
+from pandas import isnull
+
+from b2.constants import INDEX_CACHE_MAX_BYTES
+from .cache import ResultCache
+from .partitions import partitioned_unique
+
+# marks a cache miss, since None means the column cannot be indexed
+NOT_INDEXED = object()
+
+
+class KeyIndex(object):
+    """The distinct keys of one or more columns in sorted order, and the rows of each
+    key, which is what the build side of a hash join needs (with the code of a key
+    playing the role of its hash bucket).
+
+    Arguments:
+        key_columns {List[np.ndarray]} -- the distinct keys, one array per column, sorted lexicographically
+        codes {np.ndarray} -- for each row, the position of its key in key_columns,
+            kept in the narrowest unsigned type that fits the number of keys
+    """
+    def __init__(self, key_columns: List[np.ndarray], codes: np.ndarray):
+        self.key_columns = key_columns
+        self.codes = narrow_codes(codes, len(key_columns[0]))
+        self.counts = np.bincount(codes, minlength=self.num_keys)
+        self.starts = np.cumsum(self.counts) - self.counts
+        self._order: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(cls, columns: List[np.ndarray]) -> Optional['KeyIndex']:
+        """returns None if the keys cannot be ordered (e.g., nulls or mixed types)"""
+        if len(columns) > 1:
+            return CompositeKeyIndex.build_composite(columns)
+        column = columns[0]
+        if has_null(column):
+            return None
+        try:
+            uniques, inverse = partitioned_unique(column)
+        except TypeError:
+            return None
+        return cls([uniques], inverse)
+
+    @property
+    def num_keys(self) -> int:
+        return len(self.key_columns[0])
+
+    @property
+    def order(self) -> np.ndarray:
+        """the rows sorted by their key, and the rows of the same key by their position,
+        only the joins need it so it is sorted on first use"""
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind="mergesort")
+        return self._order
+
+    @property
+    def has_order(self) -> bool:
+        return self._order is not None
+
+    @property
+    def nbytes(self) -> int:
+        # the order only once it is sorted, see `get_key_order`
+        order_nbytes = 0 if self._order is None else self._order.nbytes
+        return sum(k.nbytes for k in self.key_columns) + self.codes.nbytes + order_nbytes + self.counts.nbytes + self.starts.nbytes
+
+    def lookup(self, columns: List[np.ndarray]) -> Optional[np.ndarray]:
+        """the codes of the keys in columns, -1 for the ones that are not in the index,
+        or None if the values cannot be compared with the keys"""
+        uniques = self.key_columns[0]
+        values = columns[0]
+        if has_null(values):
+            return None
+        if len(uniques) == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+        try:
+            positions = np.searchsorted(uniques, values)
+            clipped = np.minimum(positions, len(uniques) - 1)
+            found = np.asarray(uniques[clipped] == values, dtype=bool)
+        except TypeError:
+            return None
+        if found.shape != positions.shape:
+            return None
+        return np.where(found, clipped, -1).astype(np.int64)
+
+
+class CompositeKeyIndex(KeyIndex):
+    """A KeyIndex over multiple columns, where each key is the mixed radix number of the
+    codes of the single column indexes, which preserves the lexicographical order
+
+    Arguments:
+        components {List[KeyIndex]} -- the index of each of the columns
+        mixed_keys {np.ndarray} -- the sorted mixed radix numbers of the distinct keys
+    """
+    def __init__(self, components: List[KeyIndex], mixed_keys: np.ndarray, key_columns: List[np.ndarray], codes: np.ndarray):
+        self.components = components
+        self.mixed_keys = mixed_keys
+        super().__init__(key_columns, codes)
+
+    @classmethod
+    def build_composite(cls, columns: List[np.ndarray]) -> Optional['CompositeKeyIndex']:
+        components = [get_key_index([c]) for c in columns]
+        if any(c is None for c in components):
+            return None
+        mixed = mix_codes([c.codes for c in components], components)
+        if mixed is None:
+            return None
+        mixed_keys, inverse = partitioned_unique(mixed)
+        # the digits of the mixed keys are the codes of the components
+        key_columns = []
+        remaining = mixed_keys
+        for c in reversed(components):
+            radix = max(c.num_keys, 1)
+            key_columns.insert(0, c.key_columns[0][remaining % radix])
+            remaining = remaining // radix
+        return cls(components, mixed_keys, key_columns, inverse)
+
+    @property
+    def nbytes(self) -> int:
+        # the components are cached on their own
+        return super().nbytes + self.mixed_keys.nbytes
+
+    def lookup(self, columns: List[np.ndarray]) -> Optional[np.ndarray]:
+        component_codes = []
+        for index, column in zip(self.components, columns):
+            codes = index.lookup([column])
+            if codes is None:
+                return None
+            component_codes.append(codes)
+        missing = np.zeros(len(columns[0]), dtype=bool)
+        for codes in component_codes:
+            missing |= codes < 0
+        mixed = mix_codes([np.maximum(c, 0) for c in component_codes], self.components)
+        if len(self.mixed_keys) == 0:
+            return np.full(len(columns[0]), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.mixed_keys, mixed), len(self.mixed_keys) - 1)
+        found = (self.mixed_keys[positions] == mixed) & ~missing
+        return np.where(found, positions, -1).astype(np.int64)
+
+
+def mix_codes(codes: List[np.ndarray], components: List[KeyIndex]) -> Optional[np.ndarray]:
+    radix = 1
+    for c in components:
+        radix *= max(c.num_keys, 1)
+    if radix >= np.iinfo(np.int64).max:
+        return None
+    # the codes of the components are narrow, the mixed ones need all the bits
+    mixed = codes[0].astype(np.int64)
+    for c, index in zip(codes[1:], components[1:]):
+        mixed = mixed * index.num_keys + c
+    return mixed
+
+
+class SortedIndex(object):
+    """The rows of a numeric or datetime column sorted by their value, such that a
+    range of values is a contiguous range of positions found by binary search
+
+    Arguments:
+        order {np.ndarray} -- the rows sorted by their value
+        sorted_values {np.ndarray} -- the values in that order (datetimes as their int64 epoch)
+    """
+    def __init__(self, order: np.ndarray, sorted_values: np.ndarray):
+        self.order = order
+        self.sorted_values = sorted_values
+
+    @classmethod
+    def build(cls, column: np.ndarray) -> Optional['SortedIndex']:
+        """returns None for the columns that are not numeric or datetime"""
+        if column.dtype.kind == "M":
+            # NaT is the smallest int64, so it ends up first and never passes a predicate
+            values = column.view(np.int64)
+        elif column.dtype.kind in "iuf":
+            # not the booleans, which have no integer bounds (and only two values to scan for)
+            values = column
+        else:
+            return None
+        order = np.argsort(values, kind="stable")
+        return cls(order, values[order])
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.order)
+
+    @property
+    def nbytes(self) -> int:
+        return self.order.nbytes + self.sorted_values.nbytes
+
+    def range_rows(self, low, high) -> np.ndarray:
+        """the rows whose value is between low and high (inclusive, None means unbounded), in sorted order of value"""
+        start = 0 if low is None else np.searchsorted(self.sorted_values, self.as_bound(low, np.floor), side="left")
+        stop = self.num_rows if high is None else np.searchsorted(self.sorted_values, self.as_bound(high, np.ceil), side="right")
+        return self.order[start:max(start, stop)]
+
+    def as_bound(self, value, rounding):
+        # the bound needs the dtype of the values, otherwise numpy converts the whole array to compare them
+        if self.sorted_values.dtype.kind == "f":
+            return np.float64(value)
+        info = np.iinfo(self.sorted_values.dtype)
+        if isinstance(value, numbers.Integral):
+            bound = int(value)
+        else:
+            bound = int(rounding(min(max(float(value), float(info.min)), float(info.max))))
+        return self.sorted_values.dtype.type(min(max(bound, info.min), info.max))
+
+
+def narrow_codes(codes: np.ndarray, num_keys: int) -> np.ndarray:
+    # bincount does not take uint64, which only more than 2^32 keys would need
+    dtype = np.min_scalar_type(max(num_keys - 1, 0)) if num_keys <= 2 ** 32 else np.int64
+    return codes.astype(dtype, copy=False)
+
+
+def get_key_index(columns: List[np.ndarray]) -> Optional[KeyIndex]:
+    ids = tuple(id(c) for c in columns)
+    if ids in pinned_indexes:
+        return pinned_indexes[ids]
+    key = ("key_index", ids)
+    index = index_cache.get(key, NOT_INDEXED)
+    if index is NOT_INDEXED:
+        encoding = get_encoding(columns[0]) if len(columns) == 1 else None
+        index = KeyIndex.build(columns) if encoding is None else encoding.key_index()
+        nbytes = 0 if index is None else index.nbytes
+        if encoding is not None and index.codes is encoding.codes:
+            # the codes are the ones of the encoding, which are not part of the budget
+            nbytes -= index.codes.nbytes
+        index_cache.put(key, index, nbytes, tuple(columns))
+    return index
+
+
+def get_key_order(index: KeyIndex, columns: List[np.ndarray]) -> np.ndarray:
+    """the order of the index, which is sorted on first use, so the cache is told that the index grew"""
+    if not index.has_order:
+        order = index.order
+        index_cache.resize(("key_index", tuple(id(c) for c in columns)), order.nbytes)
+    return index.order
+
+
+def pin_key_index(columns: List[np.ndarray]) -> Optional[KeyIndex]:
+    """keeps the index of the columns outside of the cache's budget until the columns are gone,
+    like the encodings, for the indexes that every interaction with a chart needs"""
+    ids = tuple(id(c) for c in columns)
+    if ids in pinned_indexes:
+        return pinned_indexes[ids]
+    if len(columns) > 1:
+        # the composite index refers to these, so they stay in memory anyway
+        for c in columns:
+            pin_key_index([c])
+    index = get_key_index(columns)
+    if index is None:
+        return None
+    index_cache.discard(("key_index", ids))
+    pinned_indexes[ids] = index
+    for c in columns:
+        weakref.finalize(c, pinned_indexes.pop, ids, None)
+    return index
+
+
+def get_sorted_index(column: np.ndarray) -> Optional[SortedIndex]:
+    key = ("sorted_index", id(column))
+    index = index_cache.get(key, NOT_INDEXED)
+    if index is NOT_INDEXED:
+        if id(column) in sorted_columns:
+            # it was evicted, sorting it again would evict the index of the next column brushed,
+            # which then sorts again as well, so the column is scanned from now on
+            return None
+        # the order and the values, no point in sorting if it would not be kept
+        fits = 2 * len(column) * 8 <= index_cache.max_bytes
+        index = SortedIndex.build(column) if fits else None
+        nbytes = 0 if index is None else index.nbytes
+        index_cache.put(key, index, nbytes, (column,))
+        if index is not None:
+            sorted_columns.add(id(column))
+            weakref.finalize(column, sorted_columns.discard, id(column))
+    return index
+
+
+def get_translation(index: KeyIndex, index_columns: List[np.ndarray], other: KeyIndex, other_columns: List[np.ndarray]) -> Optional[np.ndarray]:
+    """maps the codes of other into the codes of index, which is needed when both sides of a join are indexed"""
+    key = ("translation", tuple(id(c) for c in index_columns), tuple(id(c) for c in other_columns))
+    translation = index_cache.get(key, NOT_INDEXED)
+    if translation is NOT_INDEXED:
+        translation = index.lookup(other.key_columns)
+        nbytes = 0 if translation is None else translation.nbytes
+        index_cache.put(key, translation, nbytes, tuple(index_columns) + tuple(other_columns))
+    return translation
+
+
+# shared by all the B2 instances in the kernel, same as the result cache
+index_cache = ResultCache(INDEX_CACHE_MAX_BYTES)
+# the ids of the columns that were sorted once, see `get_sorted_index`
+sorted_columns: Set[int] = set()
+# the indexes of the grouped columns of the charts, by the ids of the columns, see `pin_key_index`
+pinned_indexes: Dict[Tuple[int, ...], KeyIndex] = {}
+
+
+####################################
+####    dictionary encodings    ####
+####################################
+
+class DictionaryEncoding(object):
+    """The distinct values of a string column, and the position of each row's value among them
+
+    Arguments:
+        dictionary {np.ndarray} -- the distinct values, sorted
+        codes {np.ndarray} -- for each row, the position of its value in the dictionary,
+            in the narrowest unsigned type that fits the number of values
+    """
+    def __init__(self, dictionary: np.ndarray, codes: np.ndarray):
+        self.dictionary = dictionary
+        self.codes = codes
+
+    @classmethod
+    def from_index(cls, dictionary: np.ndarray, index: KeyIndex) -> 'DictionaryEncoding':
+        return cls(dictionary, narrow_codes(index.codes, index.num_keys))
+
+    @property
+    def num_keys(self) -> int:
+        return len(self.dictionary)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dictionary.nbytes + self.codes.nbytes
+
+    def key_index(self) -> KeyIndex:
+        # the dictionary is sorted, so the codes are already the ones of the index
+        return KeyIndex([self.dictionary], self.codes)
+
+
+# the encodings of the string columns, by the id of the column, these are part
+# of the loaded tables so they are not subject to the cache's budget
+encodings: Dict[int, DictionaryEncoding] = {}
+
+
+def register_encoding(column: np.ndarray, encoding: DictionaryEncoding):
+    encodings[id(column)] = encoding
+    # the id can be reused once the column is gone
+    weakref.finalize(column, encodings.pop, id(column), None)
+
+
+def get_encoding(column: np.ndarray) -> Optional[DictionaryEncoding]:
+    return encodings.get(id(column))
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def is_numeric(column: np.ndarray) -> bool:
+    return column.dtype.kind in "biuf"
+
+
+def is_strings(column: np.ndarray) -> bool:
+    return column.dtype.kind == "U" or id(column) in encodings
+
+
+def has_null(column: np.ndarray) -> bool:
+    if column.dtype.kind in "biuUS" or id(column) in encodings:
+        return False
+    return bool(isnull(column).any())
+
+
+def comparable_keys(left: np.ndarray, right: np.ndarray) -> bool:
+    return (is_numeric(left) and is_numeric(right)) or left.dtype.kind == right.dtype.kind or (is_strings(left) and is_strings(right))
@@ -0,0 +1,364 @@
+"""Rule-based rewrites of RelationalOp trees before they are executed.
+
+The rules are
+  * push wheres below selects and joins, so that they filter as early as possible
+  * prune the columns that are not needed above a join
+  * fuse consecutive wheres into one conjunction, ordered such that the
+    most selective (estimated on a sample of the base column) runs first
+
+Note that the rewritten trees are only used for execution, the code shown
+to the user is still generated from the original ops. A join whose inputs
+are emptied by a pushed down where returns None, while the original join
+might have had rows (that the where then removed), which datascience returns
+as an empty table, so `eval_op` runs the original ops when that happens.
+"""
+from typing import List, Optional, Set, Dict, Tuple, cast
+import numbers
+import numpy as np
+
+from .dataframe import RelationalOp, RelationalOpType, BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin, Predicate, ColumnSelection
+from .engine import ColumnarView, where_mask, unused_label, unused_label_in_either
+
+# number of rows of the base column used to estimate selectivity
+SELECTIVITY_SAMPLE_SIZE = 1024
+
+
+class DerivedDF(object):
+    """stands in for the other df of a join once its ops are rewritten,
+    it only carries what the execution needs"""
+    def __init__(self, ops: RelationalOp, df_name: Optional[str]):
+        self._ops = ops
+        self._table = None
+        self.df_name = df_name
+
+
+def optimize(op: RelationalOp) -> RelationalOp:
+    op = push_down_wheres(op)
+    op = prune_join_columns(op, None)
+    op = fuse_wheres(op)
+    return op
+
+
+def has_where_above_join(op: RelationalOp, under_where: bool = False) -> bool:
+    """whether a where of the op could be pushed below a join, which then returns None instead of an empty table"""
+    if op.op_type == RelationalOpType.base:
+        return False
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        return under_where or has_where_above_join(j_op.child) or has_where_above_join(ops_of(j_op.other))
+    if op.op_type == RelationalOpType.semi_join:
+        s_op = cast(SemiJoin, op)
+        return has_where_above_join(s_op.child, under_where) or has_where_above_join(ops_of(s_op.other))
+    # the wheres are not pushed below group bys
+    under_where = op.op_type != RelationalOpType.groupby and (under_where or op.op_type in (RelationalOpType.where, RelationalOpType.fused_where))
+    return has_where_above_join(op.child, under_where)
+
+
+####################################
+########   where push down  ########
+####################################
+
+def push_down_wheres(op: RelationalOp) -> RelationalOp:
+    if op.op_type == RelationalOpType.base:
+        return op
+    if op.op_type == RelationalOpType.where:
+        w_op = cast(Where, op)
+        return push_where(w_op.predicate, push_down_wheres(w_op.child))
+    return with_children(op, push_down_wheres(op.child), push_down_wheres)
+
+
+def push_where(predicate: Predicate, child: RelationalOp) -> RelationalOp:
+    labels = predicate_labels(predicate)
+    if labels is None:
+        return Where(predicate, child)
+    if child.op_type == RelationalOpType.where:
+        w_op = cast(Where, child)
+        return Where(w_op.predicate, push_where(predicate, w_op.child))
+    if child.op_type == RelationalOpType.project:
+        p_op = cast(Select, child)
+        if all(isinstance(c, str) for c in as_list(p_op.columns)):
+            return Select(p_op.columns, push_where(predicate, p_op.child))
+    if child.op_type == RelationalOpType.semi_join:
+        # semi joins keep the schema of their child
+        s_op = cast(SemiJoin, child)
+        return SemiJoin(s_op.self_columns, s_op.other, s_op.other_columns, push_where(predicate, s_op.child))
+    if child.op_type == RelationalOpType.join:
+        j_op = cast(Join, child)
+        sides = join_sides(j_op)
+        if sides is not None:
+            left_labels, label_map = sides
+            if labels.issubset(left_labels):
+                return Join(j_op.self_columns, j_op.other, j_op.other_columns, push_where(predicate, j_op.child))
+            # only the right columns that kept their names (and are not dropped as keys) can be pushed
+            right_keys = as_list(j_op.other_columns if j_op.other_columns is not None else j_op.self_columns)
+            unchanged = set(k for k, v in label_map.items() if k == v and k not in right_keys)
+            if labels.issubset(unchanged) and not labels.intersection(left_labels):
+                other_ops = push_where(predicate, ops_of(j_op.other))
+                return Join(j_op.self_columns, DerivedDF(other_ops, j_op.other.df_name), j_op.other_columns, j_op.child)
+    return Where(predicate, child)
+
+
+####################################
+########   column pruning   ########
+####################################
+
+def prune_join_columns(op: RelationalOp, required: Optional[Set[str]]) -> RelationalOp:
+    """
+    Arguments:
+        required {Optional[Set[str]]} -- the labels that the parents need, None means all of them
+    """
+    if op.op_type == RelationalOpType.base:
+        return op
+    if op.op_type == RelationalOpType.project:
+        p_op = cast(Select, op)
+        columns = as_list(p_op.columns)
+        child_required = set(columns) if all(isinstance(c, str) for c in columns) else None
+        return Select(p_op.columns, prune_join_columns(p_op.child, child_required))
+    if op.op_type == RelationalOpType.groupby:
+        g_op = cast(GroupBy, op)
+        columns = as_list(g_op.columns)
+        child_required = None
+        if g_op.collect is None and all(isinstance(c, str) for c in columns):
+            child_required = set(columns)
+        return GroupBy(g_op.columns, g_op.collect, prune_join_columns(g_op.child, child_required))
+    if op.op_type in (RelationalOpType.where, RelationalOpType.fused_where):
+        child_required = None
+        if required is not None:
+            labels = set()
+            for p in op_predicates(op):
+                p_labels = predicate_labels(p)
+                if p_labels is None:
+                    labels = None
+                    break
+                labels.update(p_labels)
+            child_required = None if labels is None else required.union(labels)
+        return with_children(op, prune_join_columns(op.child, child_required), lambda o: o)
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        return prune_join(j_op, required)
+    if op.op_type == RelationalOpType.semi_join:
+        s_op = cast(SemiJoin, op)
+        keys = as_list(s_op.self_columns)
+        child_required = None
+        if required is not None and all(isinstance(c, str) for c in keys):
+            child_required = required.union(keys)
+        return with_children(op, prune_join_columns(s_op.child, child_required), lambda o: o)
+    return op
+
+
+def prune_join(j_op: Join, required: Optional[Set[str]]) -> RelationalOp:
+    left_labels = labels_of(j_op.child)
+    right_labels = labels_of_df(j_op.other)
+    left_keys = as_list(j_op.self_columns)
+    right_keys = as_list(j_op.other_columns if j_op.other_columns is not None else j_op.self_columns)
+    if required is None or left_labels is None or right_labels is None \
+        or not all(isinstance(c, str) for c in left_keys + right_keys):
+        child = prune_join_columns(j_op.child, None)
+        return Join(j_op.self_columns, j_op.other, j_op.other_columns, child)
+    label_map = join_label_map(left_labels, right_labels)
+    # labels on both sides change how the right columns are renamed, so they are kept
+    shared = set(left_labels).intersection(right_labels).union(set(left_labels).intersection(label_map.values()))
+    needed_left = [l for l in left_labels if l in required or l in left_keys or l in shared]
+    needed_right = [r for r in right_labels if label_map[r] in required or r in right_keys or r in shared or label_map[r] in shared]
+    child = prune_join_columns(j_op.child, set(needed_left))
+    if len(needed_left) < len(left_labels):
+        child = Select(needed_left, child)
+    other = j_op.other
+    if len(needed_right) < len(right_labels):
+        other_ops = prune_join_columns(ops_of(other), set(needed_right))
+        other = DerivedDF(Select(needed_right, other_ops), other.df_name)
+    return Join(j_op.self_columns, other, j_op.other_columns, child)
+
+
+####################################
+########    where fusion    ########
+####################################
+
+def fuse_wheres(op: RelationalOp) -> RelationalOp:
+    if op.op_type == RelationalOpType.base:
+        return op
+    if op.op_type == RelationalOpType.where:
+        predicates = []
+        current = op
+        while current.op_type == RelationalOpType.where and is_fusable(cast(Where, current).predicate):
+            predicates.append(cast(Where, current).predicate)
+            current = current.child
+        if len(predicates) == 0:
+            w_op = cast(Where, op)
+            return Where(w_op.predicate, fuse_wheres(w_op.child))
+        child = fuse_wheres(current)
+        if len(predicates) == 1:
+            return Where(predicates[0], child)
+        return FusedWhere(order_by_selectivity(predicates, child), child)
+    return with_children(op, fuse_wheres(op.child), fuse_wheres)
+
+
+def is_fusable(predicate: Predicate) -> bool:
+    # array masks are aligned to the rows of their child and cannot be moved around
+    return predicate_labels(predicate) is not None
+
+
+def order_by_selectivity(predicates: List[Predicate], child: RelationalOp) -> List[Predicate]:
+    """the most selective predicates run first, so the rest see fewer rows,
+    predicates that are not vectorized are run last since they are called per row"""
+    def sort_key(p: Predicate) -> Tuple[bool, float]:
+        from .predicate_compiler import compile_predicate
+        is_vectorized = compile_predicate(p.value_or_predicate) is not None and p.other is None
+        if not is_vectorized:
+            return (True, 1.0)
+        return (False, estimate_selectivity(p, child))
+    return sorted(predicates, key=sort_key)
+
+
+def estimate_selectivity(predicate: Predicate, child: RelationalOp) -> float:
+    column = resolve_base_column(child, cast(str, predicate.column_or_label))
+    if column is None or len(column) == 0:
+        return 1.0
+    stride = max(1, len(column) // SELECTIVITY_SAMPLE_SIZE)
+    sample = ColumnarView.from_columns([predicate.column_or_label], [column[::stride]])
+    try:
+        return float(np.mean(where_mask(sample, predicate)))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def resolve_base_column(op: RelationalOp, label: str) -> Optional[np.ndarray]:
+    """finds the column of the base table that the label refers to, if it is not derived"""
+    if op.op_type == RelationalOpType.base:
+        table = cast(BaseOp, op).table
+        return table.column(label) if label in table.labels else None
+    if op.op_type in (RelationalOpType.where, RelationalOpType.fused_where, RelationalOpType.project, RelationalOpType.semi_join):
+        return resolve_base_column(op.child, label)
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        sides = join_sides(j_op)
+        if sides is None:
+            return None
+        left_labels, label_map = sides
+        if label in left_labels:
+            return resolve_base_column(j_op.child, label)
+        for right_label, new_label in label_map.items():
+            if new_label == label:
+                if j_op.other._table is not None:
+                    return j_op.other._table.column(right_label)
+                return resolve_base_column(j_op.other._ops, right_label)
+    return None
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def with_children(op: RelationalOp, child: RelationalOp, rewrite) -> RelationalOp:
+    """copies op with the new child, and for joins, also rewrites the other side"""
+    if op.op_type == RelationalOpType.where:
+        return Where(cast(Where, op).predicate, child)
+    if op.op_type == RelationalOpType.fused_where:
+        return FusedWhere(cast(FusedWhere, op).predicates, child)
+    if op.op_type == RelationalOpType.project:
+        return Select(cast(Select, op).columns, child)
+    if op.op_type == RelationalOpType.groupby:
+        g_op = cast(GroupBy, op)
+        return GroupBy(g_op.columns, g_op.collect, child)
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        other_ops = ops_of(j_op.other)
+        new_other_ops = rewrite(other_ops)
+        other = j_op.other if new_other_ops is other_ops else DerivedDF(new_other_ops, j_op.other.df_name)
+        return Join(j_op.self_columns, other, j_op.other_columns, child)
+    if op.op_type == RelationalOpType.semi_join:
+        s_op = cast(SemiJoin, op)
+        other_ops = ops_of(s_op.other)
+        new_other_ops = rewrite(other_ops)
+        other = s_op.other if new_other_ops is other_ops else DerivedDF(new_other_ops, s_op.other.df_name)
+        return SemiJoin(s_op.self_columns, other, s_op.other_columns, child)
+    raise NotImplementedError(op.op_type)
+
+
+def ops_of(df) -> RelationalOp:
+    # a df whose table is set might have been sorted or mutated in place, so the table is the source
+    if hasattr(df, "_table") and (df._table is not None):
+        return BaseOp(df.df_name, df._id if hasattr(df, "_id") else None, df._table)
+    return df._ops
+
+
+def op_predicates(op: RelationalOp) -> List[Predicate]:
+    if op.op_type == RelationalOpType.where:
+        return [cast(Where, op).predicate]
+    return cast(FusedWhere, op).predicates
+
+
+def as_list(columns: Optional[ColumnSelection]) -> List:
+    if columns is None:
+        return []
+    if isinstance(columns, (str, numbers.Integral)):
+        return [columns]
+    return list(columns)
+
+
+def predicate_labels(predicate: Predicate) -> Optional[Set[str]]:
+    """the labels the predicate reads, or None if it uses column indices or arrays"""
+    labels = set()
+    for c in [predicate.column_or_label, predicate.other]:
+        if c is None:
+            continue
+        if not isinstance(c, str):
+            return None
+        labels.add(c)
+    return labels
+
+
+def labels_of(op: RelationalOp) -> Optional[List[str]]:
+    """the labels of the result of the op, None if we cannot tell without executing"""
+    if op.op_type == RelationalOpType.base:
+        return list(cast(BaseOp, op).table.labels)
+    if op.op_type in (RelationalOpType.where, RelationalOpType.fused_where, RelationalOpType.semi_join):
+        return labels_of(op.child)
+    if op.op_type == RelationalOpType.project:
+        columns = as_list(cast(Select, op).columns)
+        if all(isinstance(c, str) for c in columns):
+            return columns
+        child_labels = labels_of(op.child)
+        if child_labels is None:
+            return None
+        return [child_labels[c] if isinstance(c, numbers.Integral) else c for c in columns]
+    if op.op_type == RelationalOpType.groupby:
+        g_op = cast(GroupBy, op)
+        columns = as_list(g_op.columns)
+        if g_op.collect is not None or not all(isinstance(c, str) for c in columns):
+            return None
+        return columns + [unused_label("count", columns)]
+    if op.op_type == RelationalOpType.join:
+        j_op = cast(Join, op)
+        sides = join_sides(j_op)
+        if sides is None:
+            return None
+        left_labels, label_map = sides
+        left_keys = as_list(j_op.self_columns)
+        right_keys = as_list(j_op.other_columns if j_op.other_columns is not None else j_op.self_columns)
+        rest = [l for l in left_labels if l not in left_keys]
+        return left_keys + rest + [v for k, v in label_map.items() if k not in right_keys]
+    return None
+
+
+def labels_of_df(df) -> Optional[List[str]]:
+    if hasattr(df, "_table") and (df._table is not None):
+        return list(df._table.labels)
+    return labels_of(df._ops)
+
+
+def join_sides(j_op: Join) -> Optional[Tuple[List[str], Dict[str, str]]]:
+    """returns the left labels, and how the right labels are renamed by the join"""
+    left_labels = labels_of(j_op.child)
+    right_labels = labels_of_df(j_op.other)
+    if left_labels is None or right_labels is None:
+        return None
+    return left_labels, join_label_map(left_labels, right_labels)
+
+
+def join_label_map(left_labels: List[str], right_labels: List[str]) -> Dict[str, str]:
+    """same renaming as in `Table.join`"""
+    other_labels = [unused_label(s, left_labels) for s in right_labels]
+    if len(set(left_labels + other_labels)) != len(left_labels + other_labels):
+        other_labels = [unused_label_in_either(s, left_labels, right_labels) for s in right_labels]
+    return dict(zip(right_labels, other_labels))
@@ -0,0 +1,158 @@
+"""Splits the work on large columns into ranges of rows that run on a pool of threads.
+
+numpy releases the GIL inside its loops, so the comparisons of a where and the
+bincounts of a group by scale with the cores, as long as each range is large
+enough to amortize handing it to a thread. The partial results are merged
+afterwards: the masks are concatenated, and the per group states (counts, sums,
+minimums and maximums) are combined, which is also what makes a mean mergeable.
+"""
+from typing import Callable, List, Optional, Tuple, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import numpy as np
+
+from b2.constants import PARTITION_ROWS, PARTITION_WORKERS
+
+T = TypeVar("T")
+
+# the collect functions of `group` that are computed from mergeable partial states
+MERGEABLE_AGGREGATES = {
+    np.sum: "sum",
+    np.mean: "mean",
+    np.min: "min",
+    np.max: "max",
+    np.amin: "min",
+    np.amax: "max",
+}
+
+
+class PartitionPool(object):
+    """
+    Arguments:
+        num_workers {int} -- the number of threads, 1 means the ranges are not split
+    """
+    def __init__(self, num_workers: int = PARTITION_WORKERS):
+        self.num_workers = num_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+
+    def set_workers(self, num_workers: int):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.num_workers = num_workers
+
+    def map(self, fn: Callable[[int, int], T], num_rows: int) -> List[T]:
+        """calls fn with the (start, end) of each range of the rows, the results are in the order of the ranges"""
+        if self.num_workers <= 1 or num_rows < 2 * PARTITION_ROWS:
+            return [fn(0, num_rows)]
+        ranges = [(start, min(start + PARTITION_ROWS, num_rows)) for start in range(0, num_rows, PARTITION_ROWS)]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="b2_partition")
+            executor = self._executor
+        return list(executor.map(lambda r: fn(*r), ranges))
+
+
+# shared by all the B2 instances in the kernel, same as the caches
+partition_pool = PartitionPool()
+
+
+def partitioned_unique(column: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """same as `np.unique` with the inverse, where each range is sorted on its own and only
+    the distinct values of the ranges are merged, which is the bulk of building a key index"""
+    parts = partition_pool.map(lambda start, end: np.unique(column[start:end], return_inverse=True), len(column))
+    if len(parts) == 1:
+        uniques, inverse = parts[0]
+        return uniques, inverse.reshape(-1)
+    uniques = np.unique(np.concatenate([u for u, _ in parts]))
+    # the position of each range's distinct values among all of them
+    remaps = [np.searchsorted(uniques, u) for u, _ in parts]
+    inverses = partition_pool.map(lambda start, end: remaps[start // PARTITION_ROWS][parts[start // PARTITION_ROWS][1].reshape(-1)], len(column))
+    return uniques, np.concatenate(inverses)
+
+
+def partitioned_mask(mask_of: Callable[[int, int], Optional[np.ndarray]], num_rows: int) -> Optional[np.ndarray]:
+    """the mask of each range concatenated, None if any of them is None"""
+    masks = partition_pool.map(mask_of, num_rows)
+    if any(m is None for m in masks):
+        return None
+    return masks[0] if len(masks) == 1 else np.concatenate(masks)
+
+
+def partitioned_counts(codes_of: Callable[[int, int], np.ndarray], num_keys: int, num_rows: int) -> np.ndarray:
+    return sum(partition_pool.map(lambda start, end: np.bincount(codes_of(start, end), minlength=num_keys), num_rows))
+
+
+class GroupAggregate(object):
+    """The partial state of an aggregate of one column, per group, which can be merged
+    with the state of the other ranges of rows (the means also need the counts of the groups)
+
+    Arguments:
+        kind {str} -- one of the values of MERGEABLE_AGGREGATES
+        values {np.ndarray} -- the sums (also for the means), the minimums or the maximums
+    """
+    def __init__(self, kind: str, values: np.ndarray):
+        self.kind = kind
+        self.values = values
+
+    @classmethod
+    def of(cls, kind: str, codes: np.ndarray, column: np.ndarray, num_keys: int) -> 'GroupAggregate':
+        if kind in ("sum", "mean"):
+            if column.dtype.kind == "f":
+                # note that the floats are added in a different order than `np.sum` does it
+                values = np.bincount(codes, weights=column, minlength=num_keys)
+            else:
+                # the weights of bincount are floats, which would round the large integers
+                values = np.zeros(num_keys, dtype=np.sum(column[:0]).dtype)
+                np.add.at(values, codes, column)
+            return cls(kind, values)
+        ufunc = np.minimum if kind == "min" else np.maximum
+        values = np.full(num_keys, identity_of(ufunc, column.dtype), dtype=column.dtype)
+        with np.errstate(invalid="ignore"):
+            # the nans win, same as with `np.min`, which does not warn about them
+            ufunc.at(values, codes, column)
+        return cls(kind, values)
+
+    def merge(self, other: 'GroupAggregate') -> 'GroupAggregate':
+        if self.kind in ("sum", "mean"):
+            values = self.values + other.values
+        elif self.kind == "min":
+            values = np.minimum(self.values, other.values)
+        else:
+            values = np.maximum(self.values, other.values)
+        return GroupAggregate(self.kind, values)
+
+    def result(self, column: np.ndarray, counts: np.ndarray, present: np.ndarray) -> np.ndarray:
+        """the aggregate of the groups that have rows, with the type that collecting column would give"""
+        if self.kind == "mean":
+            return (self.values[present] / counts[present]).astype(np.mean(column[:1]).dtype)
+        if self.kind == "sum":
+            return self.values[present].astype(np.sum(column[:0]).dtype)
+        return self.values[present]
+
+
+def partitioned_aggregates(codes_of: Callable[[int, int], np.ndarray], columns_of: Callable[[int, int], List[np.ndarray]], kind: str, num_keys: int, num_rows: int) -> Tuple[np.ndarray, List[GroupAggregate]]:
+    """the counts, and the aggregate of each column, per group"""
+    def aggregate(start: int, end: int) -> Tuple[np.ndarray, List[GroupAggregate]]:
+        codes = codes_of(start, end)
+        return np.bincount(codes, minlength=num_keys), [GroupAggregate.of(kind, codes, c, num_keys) for c in columns_of(start, end)]
+    partials = partition_pool.map(aggregate, num_rows)
+    counts, aggregates = partials[0]
+    for more_counts, more_aggregates in partials[1:]:
+        counts = counts + more_counts
+        aggregates = [a.merge(b) for a, b in zip(aggregates, more_aggregates)]
+    return counts, aggregates
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def identity_of(ufunc, dtype: np.dtype):
+    """the value that never wins the minimum (or maximum), such that the empty groups do not matter"""
+    if dtype.kind == "f":
+        return np.inf if ufunc is np.minimum else -np.inf
+    info = np.iinfo(dtype)
+    return info.max if ufunc is np.minimum else info.min
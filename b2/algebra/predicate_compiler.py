@@ -0,0 +1,257 @@
+"""Compiles the predicates from `datascience.predicates.are` into numpy masks.
+
+`Table.where` calls the predicate once per row, here we recognize the common
+predicates from their closures and evaluate them as a single vectorized
+comparison. Anything we do not recognize returns None so that the caller can
+fall back to calling the predicate.
+"""
+from typing import Optional, Tuple, Dict, Any
+from datetime import datetime, date
+import numbers
+import numpy as np
+
+
+# these are the names of the functions inside `are`
+RANGE_PREDICATES = {
+    "equal_to",
+    "above",
+    "below",
+    "above_or_equal_to",
+    "below_or_equal_to",
+    "strictly_between",
+    "between",
+    "between_or_equal_to",
+}
+SET_PREDICATES = {"contained_in"}
+# the combinators of `_combinable`
+COMBINATORS = {"__neg__", "__and__", "__or__"}
+
+
+class CompiledPredicate(object):
+    """A predicate that we know how to vectorize
+
+    Arguments:
+        name {str} -- name of the `are` predicate, or of the combinator
+        args {Dict[str, Any]} -- the values the predicate closed over (e.g., y and z for between)
+    """
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+
+    def __repr__(self):
+        return f"{{compiled: {self.name}, args: {self.args}}}"
+
+    def mask(self, column: np.ndarray) -> Optional[np.ndarray]:
+        """returns the boolean mask for the column, or None if the column's type is not handled"""
+        try:
+            if self.name == "__neg__":
+                inner = self.args["self"].mask(column)
+                return None if inner is None else ~inner
+            if self.name in ("__and__", "__or__"):
+                left = self.args["self"].mask(column)
+                right = self.args["other"].mask(column)
+                if left is None or right is None:
+                    return None
+                return (left & right) if self.name == "__and__" else (left | right)
+            if self.name in SET_PREDICATES:
+                return contained_in_mask(column, self.args["superstring"])
+            return range_mask(self.name, column, self.args)
+        except TypeError:
+            # e.g., comparing None with numbers in object columns
+            return None
+
+    def value_range(self, column: np.ndarray) -> Optional[Tuple[Any, Any]]:
+        """the (inclusive) range of values that can pass the predicate, in the units of
+        `comparable_column`, with None for an open end. The range is a little wider than
+        the predicate, so the mask still has to be evaluated on the values inside it.
+        Returns None if the predicate is not a range."""
+        column = np.asarray(column)
+        if self.name not in RANGE_PREDICATES or column.dtype.kind not in "iufM":
+            return None
+        y = comparable_value(column, self.args.get("y"))
+        z = comparable_value(column, self.args.get("z")) if "z" in self.args else None
+        if y is None or ("z" in self.args and z is None) or y != y or z != z:
+            return None
+        if self.name == "equal_to":
+            return widen(column, y, -1), widen(column, y, 1)
+        if self.name in ("above", "above_or_equal_to"):
+            return widen(column, y, -1), None
+        if self.name in ("below", "below_or_equal_to"):
+            return None, widen(column, y, 1)
+        return widen(column, y, -1), widen(column, z, 1)
+
+
+def compile_predicate(value_or_predicate) -> Optional[CompiledPredicate]:
+    """
+    Arguments:
+        value_or_predicate -- same as the argument to `Table.where`, a value means equality
+
+    Returns:
+        Optional[CompiledPredicate] -- None if the predicate is not recognized
+    """
+    if not callable(value_or_predicate):
+        return CompiledPredicate("equal_to", {"y": value_or_predicate})
+    # `_combinable` wraps the actual function in `f`
+    f = getattr(value_or_predicate, "f", None)
+    if f is None or not hasattr(f, "__code__"):
+        return None
+    qualname = f.__qualname__.split(".")
+    if len(qualname) < 2:
+        return None
+    owner, name = qualname[0], qualname[1]
+    closure = get_closure_vars(f)
+    if owner == "are" and (name in RANGE_PREDICATES or name in SET_PREDICATES):
+        return CompiledPredicate(name, closure)
+    if owner == "_combinable" and name in COMBINATORS:
+        args = {}
+        for k in ["self", "other"]:
+            if k in closure:
+                compiled = compile_predicate(closure[k])
+                if compiled is None:
+                    return None
+                args[k] = compiled
+        return CompiledPredicate(name, args)
+    return None
+
+
+def get_closure_vars(f) -> Dict[str, Any]:
+    if f.__closure__ is None:
+        return {}
+    return {k: c.cell_contents for k, c in zip(f.__code__.co_freevars, f.__closure__)}
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def range_mask(name: str, column: np.ndarray, args: Dict[str, Any]) -> Optional[np.ndarray]:
+    column = np.asarray(column)
+    y = comparable_value(column, args.get("y"))
+    z = comparable_value(column, args.get("z")) if "z" in args else None
+    if y is None or ("z" in args and z is None):
+        return None
+    values = comparable_column(column)
+    float_equal = equal if column.dtype.kind == "M" else ulp_equal
+    if name == "equal_to":
+        r = float_equal(values, y)
+    elif name == "above":
+        r = values > y
+    elif name == "below":
+        r = values < y
+    elif name == "above_or_equal_to":
+        r = (values >= y) | float_equal(values, y)
+    elif name == "below_or_equal_to":
+        r = (values <= y) | float_equal(values, y)
+    elif name == "strictly_between":
+        r = (values > y) & (values < z)
+    elif name == "between":
+        r = ((values >= y) & (values < z)) | float_equal(values, y)
+    elif name == "between_or_equal_to":
+        r = ((values >= y) & (values <= z)) | float_equal(values, y) | float_equal(values, z)
+    else:
+        return None
+    r = np.asarray(r, dtype=bool)
+    if r.shape != column.shape:
+        return None
+    if column.dtype.kind == "M":
+        # NaT is stored as the smallest int64 and never matches
+        r &= ~np.isnat(column)
+    return r
+
+
+def contained_in_mask(column: np.ndarray, superstring) -> Optional[np.ndarray]:
+    column = np.asarray(column)
+    if isinstance(superstring, str):
+        # `x in "MXL"` is a substring test
+        if column.dtype.kind != "U":
+            return None
+        return np.char.find(superstring, column) >= 0
+    try:
+        values = list(superstring)
+    except TypeError:
+        return None
+    if len(values) == 0:
+        return np.zeros(len(column), dtype=bool)
+    kind = column.dtype.kind
+    if kind in "biuf":
+        if not all(is_real(v) for v in values):
+            return None
+        if any(v != v for v in values):
+            # `nan in s` depends on object identity
+            return None
+    elif kind in "US":
+        if not all(isinstance(v, str) for v in values):
+            return None
+    elif kind != "O":
+        return None
+    return np.isin(column, np.array(values, dtype=column.dtype if kind == "O" else None))
+
+
+def is_real(v) -> bool:
+    return isinstance(v, numbers.Real) and not isinstance(v, (np.datetime64, np.timedelta64))
+
+
+def comparable_column(column: np.ndarray) -> np.ndarray:
+    if column.dtype.kind == "M":
+        return column.view(np.int64)
+    return column
+
+
+def comparable_value(column: np.ndarray, value) -> Optional[Any]:
+    """converts the predicate's value such that it compares with `comparable_column`,
+    or None if the comparison is not one we can vectorize"""
+    if value is None:
+        return None
+    kind = column.dtype.kind
+    if kind == "M":
+        return datetime_to_epoch(column.dtype, value)
+    if kind in "biuf":
+        return value if is_real(value) else None
+    if kind in "US":
+        return value if isinstance(value, str) else None
+    if kind == "O":
+        # object columns compare elementwise, a TypeError will trigger the fallback
+        return value if isinstance(value, (str, numbers.Real)) else None
+    return None
+
+
+def datetime_to_epoch(dtype: np.dtype, value) -> Optional[int]:
+    """the int64 epoch of value in the unit of the column
+    note that plain numbers are treated as milliseconds, which is what the
+    temporal brushes from the front end send"""
+    try:
+        if is_real(value):
+            d = np.datetime64(int(value), "ms")
+        elif isinstance(value, (np.datetime64, datetime, date, str)):
+            d = np.datetime64(value)
+        else:
+            return None
+        d = d.astype(dtype)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if np.isnat(d):
+        return None
+    return int(d.astype(np.int64))
+
+
+def widen(column: np.ndarray, value, direction: int):
+    """moves value a few ulps in the direction, to cover what `ulp_equal` considers equal"""
+    if column.dtype.kind == "M":
+        return value
+    widened = np.float64(value)
+    for _ in range(4):
+        widened = np.nextafter(widened, direction * np.inf)
+    return widened
+
+
+def equal(values: np.ndarray, y) -> np.ndarray:
+    return values == y
+
+
+def ulp_equal(values: np.ndarray, y) -> np.ndarray:
+    """vectorized `_equal_or_float_equal` from datascience, which allows for one ulp of difference"""
+    eq = values == y
+    if values.dtype.kind in "iuf" and is_real(y):
+        as_float = values.astype(np.float64)
+        eq = eq | (np.nextafter(as_float, 1) == y) | (np.nextafter(as_float, 0) == y)
+    return eq
@@ -1,4 +1,4 @@
-from typing import List, cast, Set
+from typing import Dict, List, cast, Set
 from enum import Enum
 import json
 
@@ -160,3 +160,16 @@ def find_selections_with_df_name(current_selection: List[SelectionValue], df_nam
         if s.column.df_name == df_name:
             r.append(s.column)
     return r
+
+
+def selection_values_to_dicts(selections: List[SelectionValue]) -> List[Dict]:
+    """the dictionaries that `sel` takes (one per chart), which is also how the front end receives the selections"""
+    by_df_name: Dict[str, Dict] = {}
+    for s in selections:
+        column_selections = by_df_name.setdefault(s.column.df_name, {})
+        if s.selection_type == SelectionType.numeric_range:
+            r = cast(NumericRangeSelection, s)
+            column_selections[s.column.col_name] = [r.minVal, r.maxVal]
+        elif s.selection_type == SelectionType.string_set:
+            column_selections[s.column.col_name] = list(cast(SetSelection, s).val)
+    return [{df_name: column_selections} for df_name, column_selections in by_df_name.items()]
@@ -0,0 +1,114 @@
+"""Prefix-sum count tiles for brushing, in the style of Falcon.
+
+While the user brushes one chart, only the predicate on the brushed column
+changes between ticks. For every grouped chart on the same base, we keep
+the counts of each (brushed key, group key) pair, accumulated over the
+brushed keys, computed over the rows that pass the other (fixed) predicates.
+A brush update is then the difference of two rows of the tile, which takes
+time in the number of groups instead of the number of rows.
+
+This is opt in, since the tiles take memory in the product of the number of
+keys of the two columns.
+"""
+from threading import Lock
+from typing import Dict, Optional, Any
+import numpy as np
+
+from b2.constants import TILE_MAX_CELLS
+from .predicate_compiler import compile_predicate
+from .indexes import KeyIndex
+
+
+class CountTile(object):
+    """
+    Arguments:
+        active_index {KeyIndex} -- the index of the brushed column
+        group_index {KeyIndex} -- the index of the grouped columns of the chart
+        prefix {np.ndarray} -- row i has the counts of each group over the first i brushed keys
+    """
+    def __init__(self, active_index: KeyIndex, group_index: KeyIndex, prefix: np.ndarray):
+        self.active_index = active_index
+        self.group_index = group_index
+        self.prefix = prefix
+
+    @classmethod
+    def build(cls, active_index: KeyIndex, group_index: KeyIndex, rows: Optional[np.ndarray]) -> Optional['CountTile']:
+        """returns None if the tile would be too large
+
+        Arguments:
+            rows {Optional[np.ndarray]} -- the rows that pass the other predicates, None means all of them
+        """
+        num_active, num_groups = active_index.num_keys, group_index.num_keys
+        if num_active * num_groups > TILE_MAX_CELLS:
+            return None
+        active_codes = active_index.codes if rows is None else active_index.codes[rows]
+        group_codes = group_index.codes if rows is None else group_index.codes[rows]
+        counts = np.bincount(active_codes.astype(np.int64) * num_groups + group_codes, minlength=num_active * num_groups)
+        prefix = np.zeros((num_active + 1, num_groups), dtype=np.int64)
+        np.cumsum(counts.reshape(num_active, num_groups), axis=0, out=prefix[1:])
+        return cls(active_index, group_index, prefix)
+
+    @property
+    def nbytes(self) -> int:
+        return self.prefix.nbytes
+
+    def group_counts(self, value_or_predicate) -> Optional[np.ndarray]:
+        """the counts of each group for the rows whose brushed value passes the predicate,
+        or None if the predicate cannot be evaluated on the keys"""
+        compiled = compile_predicate(value_or_predicate)
+        if compiled is None:
+            return None
+        # the predicate only depends on the value, so it can be evaluated per key instead of per row
+        mask = compiled.mask(self.active_index.key_columns[0])
+        if mask is None:
+            return None
+        selected = np.flatnonzero(mask)
+        if len(selected) == 0:
+            return np.zeros(self.group_index.num_keys, dtype=np.int64)
+        first, last = selected[0], selected[-1]
+        if last - first + 1 == len(selected):
+            # a range, which is the case for brushes
+            return self.prefix[last + 1] - self.prefix[first]
+        return (self.prefix[selected + 1] - self.prefix[selected]).sum(axis=0)
+
+
+class InteractiveIndex(object):
+    """keeps track of which predicate is being brushed, by comparing the
+    predicates of consecutive queries on the same chart"""
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = Lock()
+        self._last_predicates: Dict[Any, Dict[str, Any]] = {}
+        self._active: Dict[Any, str] = {}
+
+    def set_enabled(self, enabled: bool):
+        with self._lock:
+            self.enabled = enabled
+            self._last_predicates.clear()
+            self._active.clear()
+
+    def find_active(self, chart_key, predicate_keys: Dict[str, Any]) -> Optional[str]:
+        """
+        Arguments:
+            chart_key -- identifies the base and grouping of the chart
+            predicate_keys {Dict[str, Any]} -- the fingerprint of the predicate on each column
+
+        Returns:
+            Optional[str] -- the column being brushed, None if it is not clear (yet)
+        """
+        with self._lock:
+            previous = self._last_predicates.get(chart_key)
+            self._last_predicates[chart_key] = predicate_keys
+            if previous is None or previous.keys() != predicate_keys.keys():
+                self._active.pop(chart_key, None)
+                return None
+            changed = [l for l in predicate_keys if predicate_keys[l] != previous[l]]
+            if len(changed) == 1:
+                self._active[chart_key] = changed[0]
+            elif len(changed) > 1:
+                self._active.pop(chart_key, None)
+            return self._active.get(chart_key)
+
+
+# shared by all the B2 instances in the kernel, same as the caches
+interactive_index = InteractiveIndex()
@@ -0,0 +1,384 @@
+"""Evaluates the charts' aggregations in worker processes, over base tables in shared memory.
+
+Even on a background thread, the ticks compete for the GIL with whatever else
+runs in the notebook. When enabled, the columns of the tables loaded into B2
+are moved into `multiprocessing.shared_memory` blocks that the kernel and the
+workers both map, so a table is in memory once however many processes read it.
+The query of a chart (its df with the selections applied, then grouped) is sent
+over as a plan that refers to the shared tables by token, and only the result,
+which is small once aggregated, is sent back.
+
+Anything the plan cannot describe (e.g., predicates that are arbitrary
+functions, or tables that were not shared) is evaluated in the kernel as before.
+"""
+from typing import List, Dict, Tuple, cast
+from collections import deque
+from itertools import count
+from queue import Queue
+from threading import Lock
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+import pickle
+import signal
+import weakref
+import numpy as np
+from datascience import Table
+from datascience.predicates import are
+
+from .dataframe import RelationalOp, RelationalOpType, BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin, Predicate
+from .indexes import DictionaryEncoding, get_encoding, register_encoding
+from .predicate_compiler import CompiledPredicate, compile_predicate
+from .tiles import interactive_index
+
+# marks a query that the workers did not evaluate, so the caller evaluates it in the kernel
+NOT_OFFLOADED = object()
+# the dtypes whose values live inside the array (unlike objects), so they can be placed in shared memory
+SHAREABLE_KINDS = "biufcmMUS"
+
+
+class NotOffloadable(Exception):
+    """raised while building a plan for an op that the workers cannot evaluate"""
+    pass
+
+
+class SharedBlock(object):
+    """A shared memory block seen as a 1-D array. The arrays created from it (with `np.asarray`)
+    keep the block, so it stays mapped for as long as any of them is alive.
+
+    Arguments:
+        shm {SharedMemory} -- the block, created by the kernel or attached by name in the workers
+        dtype {np.dtype} -- the type of the values
+        length {int} -- the number of values
+    """
+    def __init__(self, shm: SharedMemory, dtype: np.dtype, length: int):
+        self.shm = shm
+        # the address is read through a temporary array, so that the block's buffer is not
+        # exported afterwards, otherwise closing the block fails
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {
+            "shape": (length,),
+            "typestr": dtype.str,
+            "data": (address, False),
+            "version": 3,
+        }
+
+    @classmethod
+    def copy_of(cls, column: np.ndarray) -> 'SharedBlock':
+        # blocks cannot be empty
+        shm = SharedMemory(create=True, size=max(column.nbytes, 1))
+        block = cls(shm, column.dtype, len(column))
+        np.asarray(block)[:] = column
+        return block
+
+    @classmethod
+    def attach(cls, name: str, dtype: np.dtype, length: int) -> 'SharedBlock':
+        return cls(SharedMemory(name=name), dtype, length)
+
+
+class SharedTable(object):
+    """
+    Arguments:
+        token {int} -- how the plans refer to the table
+        columns {List[Tuple]} -- what the workers need to map each column, see `attach_table`
+        blocks {List[SharedMemory]} -- unlinked once the table is gone
+    """
+    def __init__(self, token: int, columns: List[Tuple], blocks: List[SharedMemory]):
+        self.token = token
+        self.columns = columns
+        self.blocks = blocks
+
+
+class WorkerProcess(object):
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child,), daemon=True, name="b2_compute_worker")
+        self.process.start()
+        child.close()
+        # held from sending a message to receiving its reply
+        self.lock = Lock()
+        # the tokens of the tables that were garbage collected, dropped before the next message
+        self.dropped: deque = deque()
+
+    def send(self, message):
+        while len(self.dropped) > 0:
+            self.connection.send(("drop", self.dropped.popleft()))
+        self.connection.send(message)
+
+    def stop(self):
+        # the worker exits once the connection is closed
+        self.connection.close()
+        self.process.join(timeout=1)
+
+
+class ComputeBackend(object):
+    """The worker processes, and the tables shared with them, for all the B2 instances in the kernel"""
+    def __init__(self):
+        self.workers: List[WorkerProcess] = []
+        self._idle: 'Queue[WorkerProcess]' = Queue()
+        self._lock = Lock()
+        self._tokens = count()
+        # by the id of the table
+        self._shared: Dict[int, SharedTable] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.workers) > 0
+
+    def set_processes(self, num_processes: int):
+        """restarts the workers, 0 stops them. Should not be called while charts are updating."""
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+            self._idle = Queue()
+            for _ in range(num_processes):
+                self._start_worker()
+
+    def share_table(self, table: Table):
+        """moves the columns of the table into shared memory, in place, so that the
+        ops on the table can be evaluated by the workers"""
+        with self._lock:
+            if id(table) in self._shared:
+                return
+            columns: List[Tuple] = []
+            blocks: List[SharedMemory] = []
+            for label in table.labels:
+                column = table.column(label)
+                encoding = get_encoding(column)
+                if column.ndim == 1 and column.dtype.kind in SHAREABLE_KINDS:
+                    block = SharedBlock.copy_of(column)
+                    table[label] = np.asarray(block)
+                    if encoding is not None:
+                        register_encoding(table.column(label), encoding)
+                    columns.append(("shared", label, block.shm.name, column.dtype.str, len(column)))
+                    blocks.append(block.shm)
+                else:
+                    columns.append(("values", label, column))
+                if encoding is not None:
+                    # so that the workers do not encode the column again
+                    block = SharedBlock.copy_of(encoding.codes)
+                    encoding.codes = np.asarray(block)
+                    columns.append(("encoding", label, block.shm.name, encoding.codes.dtype.str, len(column), encoding.dictionary))
+                    blocks.append(block.shm)
+            shared = SharedTable(next(self._tokens), columns, blocks)
+            self._shared[id(table)] = shared
+            for worker in self.workers:
+                with worker.lock:
+                    worker.send(("register", shared.token, shared.columns))
+            weakref.finalize(table, self._release, id(table), shared)
+
+    def evaluate(self, op: RelationalOp):
+        """evaluates the (optimized) op in one of the workers, returns NOT_OFFLOADED if it could not"""
+        try:
+            plan = self.to_plan(op)
+        except NotOffloadable:
+            return NOT_OFFLOADED
+        worker = self._idle.get()
+        try:
+            with worker.lock:
+                worker.send(("evaluate", plan, interactive_index.enabled))
+                status, result = worker.connection.recv()
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # e.g., lambdas for collect, which do not pickle (and are not sent)
+            self._idle.put(worker)
+            return NOT_OFFLOADED
+        except (EOFError, OSError):
+            # the worker died (e.g., out of memory), so it is replaced
+            self._replace_worker(worker)
+            return NOT_OFFLOADED
+        self._idle.put(worker)
+        if status != "done":
+            # evaluated again in the kernel, which raises the error to the user if there is one
+            return NOT_OFFLOADED
+        if result is None:
+            return None
+        labels, columns = result
+        # imported here because of cyclic imports
+        from .engine import ColumnarView
+        return ColumnarView.from_columns(labels, columns).to_table()
+
+    def to_plan(self, op: RelationalOp) -> Tuple:
+        """describes the op with plain values that pickle, see `from_plan`"""
+        if op.op_type == RelationalOpType.base:
+            b_op = cast(BaseOp, op)
+            return ("base", b_op.df_name, b_op.df_id, self.token_of(b_op.table))
+        if op.op_type == RelationalOpType.where:
+            w_op = cast(Where, op)
+            return ("where", predicate_to_plan(w_op.predicate), self.to_plan(w_op.child))
+        if op.op_type == RelationalOpType.fused_where:
+            f_op = cast(FusedWhere, op)
+            return ("fused_where", [predicate_to_plan(p) for p in f_op.predicates], self.to_plan(f_op.child))
+        if op.op_type == RelationalOpType.project:
+            p_op = cast(Select, op)
+            return ("project", p_op.columns, self.to_plan(p_op.child))
+        if op.op_type == RelationalOpType.groupby:
+            g_op = cast(GroupBy, op)
+            return ("groupby", g_op.columns, g_op.collect, self.to_plan(g_op.child))
+        if op.op_type in (RelationalOpType.join, RelationalOpType.semi_join):
+            j_op = cast(Join, op)
+            other = j_op.other
+            if getattr(other, "_table", None) is not None:
+                other_plan = ("table", self.token_of(other._table))
+            else:
+                other_plan = ("ops", self.to_plan(other._ops))
+            return (op.op_type.value, j_op.self_columns, other.df_name, other_plan, j_op.other_columns, self.to_plan(j_op.child))
+        raise NotOffloadable(op.op_type)
+
+    def token_of(self, table: Table) -> int:
+        shared = self._shared.get(id(table))
+        if shared is None:
+            raise NotOffloadable("the table is not shared")
+        return shared.token
+
+    def _start_worker(self):
+        worker = WorkerProcess(get_context("spawn"))
+        with worker.lock:
+            for shared in self._shared.values():
+                worker.send(("register", shared.token, shared.columns))
+        self.workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace_worker(self, worker: WorkerProcess):
+        with self._lock:
+            if worker not in self.workers:
+                # stopped by set_processes in the meantime
+                return
+            self.workers.remove(worker)
+            self._start_worker()
+
+    def _release(self, table_id: int, shared: SharedTable):
+        # note that this runs when the table is garbage collected, so it cannot take the locks
+        self._shared.pop(table_id, None)
+        for worker in self.workers:
+            worker.dropped.append(shared.token)
+        for shm in shared.blocks:
+            # the memory is freed once the arrays over it are gone in all the processes
+            shm.unlink()
+
+
+# shared by all the B2 instances in the kernel, same as the caches
+compute_backend = ComputeBackend()
+
+
+####################################
+######    worker processes    ######
+####################################
+
+def worker_main(connection):
+    """evaluates the plans sent by the kernel, until the kernel closes the connection"""
+    # interrupting the kernel should not kill the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # imported here because of cyclic imports
+    from .engine import execute_op
+    tables: Dict[int, Table] = {}
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        kind = message[0]
+        if kind == "register":
+            _, token, columns = message
+            tables[token] = attach_table(columns)
+        elif kind == "drop":
+            tables.pop(message[1], None)
+        elif kind == "evaluate":
+            _, plan, interactive = message
+            if interactive != interactive_index.enabled:
+                interactive_index.set_enabled(interactive)
+            try:
+                result = execute_op(from_plan(plan, tables))
+            except Exception as err:
+                connection.send(("failed", repr(err)))
+                continue
+            if result is None:
+                connection.send(("done", None))
+            else:
+                labels = list(result.labels)
+                connection.send(("done", (labels, [result.column(l) for l in labels])))
+
+
+def attach_table(columns: List[Tuple]) -> Table:
+    # appended in place, `with_columns` would copy the columns out of shared memory
+    table = Table()
+    for spec in columns:
+        kind, label = spec[0], spec[1]
+        if kind == "shared":
+            _, _, name, dtype, length = spec
+            column = np.asarray(SharedBlock.attach(name, np.dtype(dtype), length))
+        elif kind == "encoding":
+            # of the column appended right before
+            _, _, name, dtype, length, dictionary = spec
+            codes = np.asarray(SharedBlock.attach(name, np.dtype(dtype), length))
+            register_encoding(table.column(label), DictionaryEncoding(dictionary, codes))
+            continue
+        else:
+            column = spec[2]
+        table.append_column(label, column)
+    return table
+
+
+def from_plan(plan: Tuple, tables: Dict[int, Table]) -> RelationalOp:
+    """the inverse of `ComputeBackend.to_plan`"""
+    # imported here because of cyclic imports
+    from .optimizer import DerivedDF
+    kind = plan[0]
+    if kind == "base":
+        _, df_name, df_id, token = plan
+        return BaseOp(df_name, df_id, tables[token])
+    if kind == "where":
+        return Where(predicate_from_plan(plan[1]), from_plan(plan[2], tables))
+    if kind == "fused_where":
+        return FusedWhere([predicate_from_plan(p) for p in plan[1]], from_plan(plan[2], tables))
+    if kind == "project":
+        return Select(plan[1], from_plan(plan[2], tables))
+    if kind == "groupby":
+        return GroupBy(plan[1], plan[2], from_plan(plan[3], tables))
+    _, self_columns, other_name, other_plan, other_columns, child = plan
+    if other_plan[0] == "table":
+        other = DerivedDF(None, other_name)  # type: ignore
+        other._table = tables[other_plan[1]]
+    else:
+        other = DerivedDF(from_plan(other_plan[1], tables), other_name)
+    join_type = Join if kind == RelationalOpType.join.value else SemiJoin
+    return join_type(self_columns, other, other_columns, from_plan(child, tables))  # type: ignore
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def predicate_to_plan(predicate: Predicate) -> Tuple:
+    value = predicate.value_or_predicate
+    if callable(value):
+        compiled = compile_predicate(value)
+        if compiled is None:
+            raise NotOffloadable("the predicate is not one of `are`")
+        value = ("compiled", compiled_to_plan(compiled))
+    else:
+        value = ("value", value)
+    return (predicate.column_or_label, value, predicate.other)
+
+
+def predicate_from_plan(plan: Tuple) -> Predicate:
+    column_or_label, (kind, value), other = plan
+    if kind == "compiled":
+        value = compiled_from_plan(value)
+    return Predicate(column_or_label, value, other)
+
+
+def compiled_to_plan(compiled: CompiledPredicate) -> Tuple:
+    args = {k: compiled_to_plan(v) if isinstance(v, CompiledPredicate) else v for k, v in compiled.args.items()}
+    return (compiled.name, args)
+
+
+def compiled_from_plan(plan: Tuple):
+    """rebuilds the `are` predicate, which the engine compiles again"""
+    name, args = plan
+    if name == "__neg__":
+        return -compiled_from_plan(args["self"])
+    if name == "__and__":
+        return compiled_from_plan(args["self"]) & compiled_from_plan(args["other"])
+    if name == "__or__":
+        return compiled_from_plan(args["self"]) | compiled_from_plan(args["other"])
+    return getattr(are, name)(**args)
@@ -1,12 +1,15 @@
 from __future__ import absolute_import
 from warnings import filterwarnings
 from IPython import get_ipython
-from typing import Optional, List, Dict, Iterator, Union, cast, Dict, List
+from typing import Optional, List, Dict, Iterator, Union, Callable, cast, Dict, List
 from datascience import Table
 from datascience.predicates import are
 import numpy as np
 import math
 from json import dumps
+import pickle
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import RLock
 
 from IPython.core.debugger import set_trace
 
@@ -18,9 +21,17 @@ except ImportError as err:
     logging = lambda x, y: None
 
 from b2.constants import ISDEBUG
-from b2.algebra.selection import SelectionValue, ColumnRef, EmptySelection, SelectionType, find_selections_with_df_name
-from .algebra.dataframe import MidasDataFrame, DFInfo, VisualizedDFInfo, get_midas_code, JoinInfo, RuntimeFunctions, RelationalOp
+from b2.algebra.selection import SelectionValue, ColumnRef, EmptySelection, SelectionType, find_selections_with_df_name, selection_values_to_dicts
+from .algebra.dataframe import MidasDataFrame, DFInfo, VisualizedDFInfo, get_midas_code, JoinInfo, RuntimeFunctions, RelationalOp, RelationalOpType, BaseOp
 from .algebra.context import Context
+from .algebra.data_types import DFId
+from .algebra.cache import result_cache
+from .algebra.engine import prepare_group_index
+from .algebra.tiles import interactive_index
+from .algebra.encoding import encode_table
+from .algebra.worker import compute_backend
+from .algebra.partitions import partition_pool
+from .snapshot import SnapshotWriter, SnapshotReader, prepare_directory, write_session
 from .util.errors import InternalLogicalError, UserError
 from .util.utils import red_print, isnotebook, find_name
 from .vis_types import EncodingSpec
@@ -54,6 +65,9 @@ class B2(object):
     _assigned_name: str
     df_info_store: Dict[DFName, DFInfo]
     config: MidasConfig
+    _tick_pool: Optional[ThreadPoolExecutor]
+    _background_worker: Optional[ThreadPoolExecutor]
+    _charts_lock: RLock
 
 
     def __init__(self, user_id: Optional[str]=None, task_id: Optional[str]=None):
@@ -73,6 +87,10 @@ class B2(object):
             logger_id = user_id + "_"+ task_id
         
         self.config = MidasConfig(True)
+        result_cache.set_max_bytes(self.config.cache_max_bytes)
+        interactive_index.set_enabled(self.config.interactive_index)
+        compute_backend.set_processes(self.config.compute_processes)
+        partition_pool.set_workers(self.config.partition_workers)
 
         ui_comm = UiComm(
             is_in_ipynb,
@@ -85,9 +103,14 @@ class B2(object):
             self._get_filtered_code,
         )
         self._ui_comm = ui_comm
+        ui_comm.scheduler.set_debounce(self.config.interaction_debounce_ms)
         self.df_info_store = {}
         self._context = Context(self.df_info_store, self.from_ops)
         self.all_selections = []
+        self._tick_pool = None
+        self._background_worker = None
+        # held while the charts in df_info_store are replaced or updated, which the background ticks also do
+        self._charts_lock = RLock()
         self.immediate_interaction_selection = []
         self.current_selection = []
         if is_in_ipynb:
@@ -103,13 +126,15 @@ class B2(object):
             self._get_filtered_df,
             self._context.apply_selection,
             self.add_join_info,
+            self._is_deferred,
         )
 
 
     def _add_df(self, mdf: MidasDataFrame):
         if mdf.df_name is None:
             raise InternalLogicalError("df should have a name to be updated")
-        self.df_info_store[mdf.df_name] = DFInfo(mdf)
+        with self._charts_lock:
+            self.df_info_store[mdf.df_name] = DFInfo(mdf)
 
 
     def show_profile(self, mdf: MidasDataFrame, df_name:str=None):
@@ -126,37 +151,53 @@ class B2(object):
         self._ui_comm.create_profile(mdf)
 
 
+    def _is_deferred(self) -> bool:
+        return self.config.deferred
+
+
+    def set_deferred(self, deferred: bool = True):
+        """when deferred, `where`, `select`, `join` and `group` only record the operations,
+        which are executed together (and optimized) when the result is first accessed,
+        e.g., via `vis`, `num_rows`, or printing the dataframe
+        """
+        self.config.deferred = deferred
+
+
     def _show_df_filtered(self, mdf: Optional[MidasDataFrame], df_name: DFName):
         if not self._i_has_df(df_name):
             raise InternalLogicalError("cannot add filter to charts not created")
-        df_info = self.df_info_store[df_name]
-        if isinstance(df_info, VisualizedDFInfo):
-            di = cast(VisualizedDFInfo, df_info)
-            di.update_df(mdf)
-            di.original_df._set_current_filtered_data(mdf)
-            # ntoe that this MUST HAPPEN AFTER the state has been set...
-            # if ISDEBUG: set_trace()
-            self._ui_comm.update_chart_filtered_value(mdf, df_name)
-        else:
-            raise InternalLogicalError("should not show filtered on df not visualized!")
+        with self._charts_lock:
+            df_info = self.df_info_store[df_name]
+            if isinstance(df_info, VisualizedDFInfo):
+                di = cast(VisualizedDFInfo, df_info)
+                di.update_df(mdf)
+                di.original_df._set_current_filtered_data(mdf)
+                # ntoe that this MUST HAPPEN AFTER the state has been set...
+                # if ISDEBUG: set_trace()
+                self._ui_comm.update_chart_filtered_value(mdf, df_name)
+            else:
+                raise InternalLogicalError("should not show filtered on df not visualized!")
 
 
     def _show_df(self, mdf: MidasDataFrame, spec: EncodingSpec, trigger_filter=True):
         if mdf.df_name is None:
             raise InternalLogicalError("df should have a name to be updated")
         df_name = mdf.df_name
-        # if this visualization has existed, we must remove the existing interactions
-        # the equivalent of updating the selection with empty
-        if self._i_has_df_chart(mdf.df_name):
-            # FIXMENOW & shoud share logic with the remove_df
-            self._add_selection([EmptySelection(ColumnRef(spec.x, df_name))])
-        self.df_info_store[df_name] = VisualizedDFInfo(mdf)
-        self._ui_comm.create_chart(mdf, spec)
-        # now we need to see if we need to apply selection,
-        # need to know if this came from a reactive cell
-        if trigger_filter and len(self.current_selection) > 0:
-            new_df = mdf.apply_selection(self.current_selection)
-            self._show_df_filtered(new_df, df_name)
+        with self._charts_lock:
+            # if this visualization has existed, we must remove the existing interactions
+            # the equivalent of updating the selection with empty
+            if self._i_has_df_chart(mdf.df_name):
+                # FIXMENOW & shoud share logic with the remove_df
+                self._add_selection([EmptySelection(ColumnRef(spec.x, df_name))])
+            self.df_info_store[df_name] = VisualizedDFInfo(mdf)
+            self._ui_comm.create_chart(mdf, spec)
+            # so that the linked updates of grouped charts only need to count the selected rows
+            prepare_group_index(mdf._ops)
+            # now we need to see if we need to apply selection,
+            # need to know if this came from a reactive cell
+            if trigger_filter and len(self.current_selection) > 0:
+                new_df = mdf.apply_selection(self.current_selection)
+                self._show_df_filtered(new_df, df_name)
 
 
     def _i_has_df_chart(self, df_name: DFName):
@@ -200,9 +241,13 @@ class B2(object):
             # make empty selection
             empty_sel = [EmptySelection(c) for c in selected_columns]            
             self._ui_comm.internal_current_selection(empty_sel, df_name) # type: ignore
-        self.df_info_store.pop(df_name)
+        with self._charts_lock:
+            self.df_info_store.pop(df_name)
 
     def create_with_table_wrap(self, table, df_name):
+        encode_table(table)
+        if compute_backend.enabled:
+            compute_backend.share_table(table)
         df = MidasDataFrame.create_with_table(table, df_name, self._rt_funcs)
         self.show_profile(df)
         return df
@@ -246,6 +291,140 @@ class B2(object):
         self._context.add_join_info(join_info)
 
 
+    def set_cache_max_bytes(self, max_bytes: int):
+        """sets the memory budget (in bytes) for the intermediate results that are reused across interactions
+        """
+        self.config.cache_max_bytes = max_bytes
+        result_cache.set_max_bytes(max_bytes)
+
+
+    def cache_stats(self):
+        """returns the hits, misses and size of the cache of intermediate results
+        """
+        return result_cache.stats()
+
+
+    def set_tick_workers(self, tick_workers: int):
+        """sets how many charts are filtered concurrently when a selection is made, 1 means serially
+        """
+        self.config.tick_workers = tick_workers
+        if self._tick_pool is not None:
+            self._tick_pool.shutdown(wait=False)
+            self._tick_pool = None
+
+
+    def set_interactive_index(self, enabled: bool = True):
+        """when enabled, brushing a chart is answered from precomputed count tiles against
+        the other charts on the same data, and narrow ranges of numeric columns from sorted indexes,
+        which keeps large tables interactive at the cost of memory (and of sorting the brushed columns once)
+        """
+        self.config.interactive_index = enabled
+        interactive_index.set_enabled(enabled)
+
+
+    def set_background_ticks(self, enabled: bool = True):
+        """when enabled, the charts are filtered and updated on a background thread, so that the
+        selection cells (and the brushes) return right away instead of waiting for the charts.
+        Note that the kernel still handles the brushes between the cells, so the ones made while
+        a long cell runs are only applied once it finishes.
+        """
+        self.config.background_ticks = enabled
+
+
+    def set_compute_processes(self, num_processes: int):
+        """evaluates the charts' aggregations in separate processes, which read the tables from shared memory,
+        so that the interactions do not compete with the notebook's own work, 0 evaluates them in the kernel again
+        """
+        self.config.compute_processes = num_processes
+        compute_backend.set_processes(num_processes)
+        if num_processes > 0:
+            # the tables loaded so far
+            for df_name in self.df_info_store:
+                df = self._context.get_df(df_name)
+                if df._ops.op_type == RelationalOpType.base:
+                    compute_backend.share_table(cast(BaseOp, df._ops).table)
+
+
+    def set_partition_workers(self, num_workers: int):
+        """sets how many threads the filters and group bys of large tables are split across, 1 does not split them"""
+        self.config.partition_workers = num_workers
+        partition_pool.set_workers(num_workers)
+
+
+    def set_interaction_debounce(self, debounce_ms: int):
+        """sets how long (in milliseconds) the selections of a brush are held before the charts are updated,
+        only the latest selection of each chart within that time is applied, 0 applies every selection
+        """
+        self.config.interaction_debounce_ms = debounce_ms
+        self._ui_comm.scheduler.set_debounce(debounce_ms)
+
+
+    def save_session(self, path: str):
+        """saves the dataframes, charts, joins and selections to the directory at path, so that
+        `load_session` can restore them after the kernel restarts
+        """
+        prepare_directory(path)
+        df_names = list(self.df_info_store.keys())
+        writer = SnapshotWriter(path, df_names)
+        dfs = {}
+        for df_name in df_names:
+            df = self._context.get_df(df_name)
+            try:
+                ops = writer.dumps(df._ops)
+            except (pickle.PicklingError, AttributeError, TypeError) as err:
+                # e.g., a where with a lambda, the values are saved instead
+                red_print(f"The operations of {df_name} cannot be saved ({err}), saving its values instead")
+                ops = writer.dumps(BaseOp(df_name, df._id, df.table))
+            dfs[df_name] = (df._id, ops)
+        # the joins are added in both directions
+        join_info = []
+        for (left, right), info in self._context.join_info.items():
+            if (right, left) not in self._context.join_info or left < right:
+                join_info.append(info)
+        write_session(writer, dfs, {
+            "profiles": [df_name for (function_name, df_name) in self._ui_comm.logged_comms if function_name == "create_profile" and df_name in dfs],
+            "charts": [(df_name, self._ui_comm.vis_spec[df_name]) for df_name in df_names if self._i_has_df_chart(df_name) and df_name in self._ui_comm.vis_spec],
+            "join_info": writer.dumps(join_info),
+            "all_selections": self.all_selections,
+            "current_selection": self.current_selection,
+        })
+
+
+    def load_session(self, path: str) -> Dict[str, MidasDataFrame]:
+        """restores the session saved by `save_session`, the base tables are memory mapped instead of read again
+        note that the snapshot is a pickle, so only load the ones you trust
+
+        Returns:
+            Dict[str, MidasDataFrame] -- the dataframes by name, which are also defined in the notebook
+        """
+        reader = SnapshotReader(path, self._rt_funcs)
+        dfs = reader.restore_dfs(self.__restore_df)
+        session = reader.session
+        with self._ui_comm.batch():
+            for df_name in session["profiles"]:
+                self.show_profile(dfs[df_name])
+            for df_name, spec in session["charts"]:
+                self._show_df(dfs[df_name], spec, trigger_filter=False)
+            for join_info in reader.loads(session["join_info"]):
+                self.add_join_info(join_info)
+            if len(session["current_selection"]) > 0:
+                # the charts are filtered once, with the latest selection
+                self.__sel(session["current_selection"])
+            self.all_selections = session["all_selections"]
+        if is_in_ipynb:
+            get_ipython().user_ns.update(dfs)
+        return dfs
+
+
+    def __restore_df(self, df_name: str, df_id: DFId, ops: RelationalOp) -> MidasDataFrame:
+        table = None
+        if ops.op_type == RelationalOpType.base and cast(BaseOp, ops).df_name == df_name:
+            table = cast(BaseOp, ops).table
+            if compute_backend.enabled:
+                compute_backend.share_table(table)
+        return MidasDataFrame(ops, self._rt_funcs, table, df_name, df_id, is_base=table is not None)
+
+
     def _get_df_vis_info(self, df_name: str):
         return self._ui_comm.vis_spec.get(DFName(df_name))
 
@@ -291,31 +470,89 @@ class B2(object):
         return self.current_selection
 
 
-    def __tick(self, all_predicate: Optional[List[SelectionValue]]=None):
+    def __tick(self, all_predicate: Optional[List[SelectionValue]]=None, after: Optional[Callable[[], None]]=None):
+        """updates the charts with the selections, and then calls after
+
+        Arguments:
+            all_predicate {Optional[List[SelectionValue]]} -- None resets every chart's filter
+        """
+        # only a background tick can become stale while it runs, see `InteractionScheduler.is_stale`
+        generation = self._ui_comm.scheduler.generation
+        # the charts as of now, the store can change while a background tick runs
+        df_infos = list(self.__get_visualized_df_info())
+        if not self.config.background_ticks:
+            self.__run_tick(generation, df_infos, self._context, all_predicate, after)
+            return
+        if self._background_worker is None:
+            self._background_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="b2_background_tick")
+        # the worker filters against a copy, the notebook keeps adding dfs and joins meanwhile
+        context = self._context.snapshot()
+        future = self._background_worker.submit(self.__run_tick, generation, df_infos, context, all_predicate, after)
+        future.add_done_callback(report_background_error)
+
+
+    def __run_tick(self, generation: int, df_infos: List[VisualizedDFInfo], context: Context, all_predicate: Optional[List[SelectionValue]], after: Optional[Callable[[], None]]):
+        with self._ui_comm.batch():
+            self.__update_charts(generation, df_infos, context, all_predicate)
+            # the brushes and reactive cells are left to the newer selection's tick
+            if after is not None and not self._ui_comm.scheduler.is_stale(generation):
+                after()
+
+
+    def __update_charts(self, generation: int, df_infos: List[VisualizedDFInfo], context: Context, all_predicate: Optional[List[SelectionValue]]):
         if all_predicate is None:
             # reset every df's filter
-            for df_info in self.__get_visualized_df_info():
+            for df_info in df_infos:
                 if df_info.df_name:
-                    self._show_df_filtered(None, df_info.df_name)
+                    self.__show_chart_filtered(df_info, None)
                 else:
                     raise InternalLogicalError("df must be named")
         else:
             if not self.config.linked:
                 return
 
-            for df_info in self.__get_visualized_df_info():
-                s = list(filter(lambda p: p.column.df_name != df_info.df_name, all_predicate))
-                if len(s) > 0:
-                    new_df = df_info.original_df.apply_selection(s)
-                    if df_info.df_name:
-                        self._show_df_filtered(new_df, df_info.df_name)
-                    else:
-                        raise InternalLogicalError("df must be named")
+            selections = [list(filter(lambda p: p.column.df_name != df_info.df_name, all_predicate)) for df_info in df_infos]
+            # the charts are filtered concurrently, but the results are always sent in the same order
+            num_charts = len(df_infos)
+            new_dfs = self.__map_charts(self.__apply_chart_selection, df_infos, [context] * num_charts, selections, [generation] * num_charts)
+            for df_info, new_df in zip(df_infos, new_dfs):
+                if self._ui_comm.scheduler.is_stale(generation):
+                    # a newer selection came in, and its tick will update all of the charts
+                    return
+                if df_info.df_name:
+                    # Note: charts without selections get None, which clears the filters that are no longer active.
+                    self.__show_chart_filtered(df_info, new_df)
                 else:
-                    # Note: we need to first clear the selections, otherwise filters that are not active won't happen.
-                    self._show_df_filtered(None, df_info.df_name)
+                    raise InternalLogicalError("df must be named")
+
+
+    def __show_chart_filtered(self, df_info: VisualizedDFInfo, new_df: Optional[MidasDataFrame]):
+        with self._charts_lock:
+            if self.df_info_store.get(df_info.df_name) is not df_info:
+                # removed or shown again while a background tick was running
+                return
+            self._show_df_filtered(new_df, df_info.df_name)
 
 
+    def __apply_chart_selection(self, df_info: VisualizedDFInfo, context: Context, selections: List[SelectionValue], generation: int) -> Optional[MidasDataFrame]:
+        # skips the work once a newer selection came in, the result is dropped by `__update_charts` anyways
+        if len(selections) == 0 or self._ui_comm.scheduler.is_stale(generation):
+            return None
+        new_df = context.apply_selection(df_info.original_df, selections)
+        if new_df is not None and not self._ui_comm.scheduler.is_stale(generation):
+            # executes the ops here, so that it happens on the worker
+            new_df.table
+        return new_df
+
+
+    def __map_charts(self, fn, *args) -> List:
+        """same as map, but on the tick thread pool, which helps since the numpy kernels release the GIL"""
+        if self.config.tick_workers <= 1 or len(args[0]) <= 1:
+            return list(map(fn, *args))
+        if self._tick_pool is None:
+            self._tick_pool = ThreadPoolExecutor(max_workers=self.config.tick_workers, thread_name_prefix="b2_tick")
+        return list(self._tick_pool.map(fn, *args))
+
 
     def __get_visualized_df_info(self) -> Iterator[VisualizedDFInfo]:
         for df_name in list(self.df_info_store):
@@ -336,16 +573,23 @@ class B2(object):
             >>> m.sel(m.all_selections[-2]) # selects the second last selection you made in the past
 
         """
+        # all the updates of the tick reach the front end as one message
+        with self._ui_comm.batch():
+            self.__sel(current_selections_list)
+
+    def __sel(self, current_selections_list: Union[List[Dict], List[SelectionValue]]):
         df_involved = ""
+        all_predicate: Optional[List[SelectionValue]] = None
         if len(current_selections_list) == 0:
             # this is a reset!
             self.current_selection = []
-            self.__tick()
         else:
             # have to ignore because the type checker is dumb
             current_selection: List[SelectionValue] = []
-            if type(current_selections_list[0]) == SelectionValue:
+            if isinstance(current_selections_list[0], SelectionValue):
                 current_selection = current_selections_list # type: ignore
+                # the front end takes the selections as dictionaries
+                current_selections_list = selection_values_to_dicts(current_selection)
             else:
                 for v in current_selections_list:
                     # flatmap
@@ -363,9 +607,12 @@ class B2(object):
             df_involved = ""
             if len(self.immediate_interaction_selection)> 0:
                 df_involved = self.immediate_interaction_selection[0].column.df_name
-            self.__tick(current_selection)
+            all_predicate = current_selection
 
-        self._ui_comm.after_selection(current_selections_list, df_involved, len(self.all_selections))
+        tick = len(self.all_selections)
+        # sent after the charts are updated, which can happen on the background worker
+        after_selection = lambda: self._ui_comm.after_selection(current_selections_list, df_involved, tick)
+        self.__tick(all_predicate, after_selection)
         self.all_selections.append(self.current_selection)
         return
 
@@ -390,4 +637,11 @@ class B2(object):
             raise InternalLogicalError(f"{df_name} is not visualized")
 
 
+def report_background_error(future: Future):
+    # otherwise the error stays inside the future
+    err = future.exception()
+    if err is not None:
+        red_print(f"Failed to update the charts: {err}")
+
+
 __all__ = ['B2']
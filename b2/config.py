@@ -1,6 +1,26 @@
+from b2.constants import RESULT_CACHE_MAX_BYTES, TICK_WORKERS, INTERACTION_DEBOUNCE_MS, COMPUTE_PROCESSES, PARTITION_WORKERS
+
+
 class MidasConfig(object):
-    def __init__(self, linked: bool):
+    def __init__(self, linked: bool, cache_max_bytes: int = RESULT_CACHE_MAX_BYTES, deferred: bool = False, tick_workers: int = TICK_WORKERS, interactive_index: bool = False, interaction_debounce_ms: int = INTERACTION_DEBOUNCE_MS, background_ticks: bool = False, compute_processes: int = COMPUTE_PROCESSES, partition_workers: int = PARTITION_WORKERS):
         self.linked = linked
+        # whether where/select/join/group only record the ops until the result is needed
+        self.deferred = deferred
+        # memory budget for the intermediate results reused across interactions
+        self.cache_max_bytes = cache_max_bytes
+        # how many charts are filtered concurrently on each tick
+        self.tick_workers = tick_workers
+        # whether brushes are answered from prefix-sum tiles, see algebra/tiles.py
+        self.interactive_index = interactive_index
+        # how long selections are coalesced before they are applied, see scheduler.py
+        self.interaction_debounce_ms = interaction_debounce_ms
+        # whether the charts are updated on a background thread instead of the kernel's main thread,
+        #   note that the brushes are still received between the cells
+        self.background_ticks = background_ticks
+        # how many worker processes evaluate the charts' aggregations over shared memory, 0 keeps them in the kernel, see algebra/worker.py
+        self.compute_processes = compute_processes
+        # how many threads the filters and group bys of large columns are split across, see algebra/partitions.py
+        self.partition_workers = partition_workers
 
 
-IS_DEBUG = True
\ No newline at end of file
+IS_DEBUG = True
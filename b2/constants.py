@@ -1,3 +1,5 @@
+import os
+
 ISDEBUG = False
 STUB_DISTRIBUTION_BIN = "10"
 MIDAS_CELL_COMM_NAME = "midas-cell-comm"
@@ -10,4 +12,26 @@ COUNT_COL_NAME = "count"
 MAX_BINS = 100
 # note that max generated bins is much smaller than the allowed bins to make the chart we create a little nicer looking.
 MAX_GENERATED_BINS = 20
-MAX_DOTS = 10000
\ No newline at end of file
+MAX_DOTS = 10000
+# memory budget for the intermediate results shared across ticks
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# memory budget for the indexes over the base columns (e.g., the join keys)
+INDEX_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# number of threads that recompute the linked charts on each tick, 1 means serially
+TICK_WORKERS = 4
+# the largest (brushed keys x groups) count tile kept for the interactive index
+TILE_MAX_CELLS = 4 * 1024 * 1024
+# the string columns with at most this many distinct values get bitmap indexes
+BITMAP_MAX_KEYS = 256
+# memory budget for the bitmap indexes, which take (distinct values x rows) bits per column
+BITMAP_INDEX_MAX_BYTES = 128 * 1024 * 1024
+# the string columns with at most this fraction of distinct values are dictionary encoded when loaded
+DICTIONARY_MAX_DISTINCT_RATIO = 0.5
+# how long the selections of a brush are held so that only the latest one of each chart is applied
+INTERACTION_DEBOUNCE_MS = 30
+# number of worker processes that evaluate the charts' aggregations, 0 evaluates them in the kernel
+COMPUTE_PROCESSES = 0
+# the rows of each range when the filters and group bys of large columns are split across threads
+PARTITION_ROWS = 1024 * 1024
+# number of threads that the ranges of rows are split across, 1 means they are not split
+PARTITION_WORKERS = os.cpu_count() or 1
\ No newline at end of file
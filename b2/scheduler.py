@@ -0,0 +1,58 @@
+"""Coalesces the interactions that arrive faster than the kernel can apply them.
+
+While brushing, the front end sends a selection on every mouse move, and
+only the latest one of each chart matters. The selections are held for a
+short window, each new one replacing the pending one of the same chart, and
+only what is left at the end of the window is applied.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from .constants import INTERACTION_DEBOUNCE_MS
+
+
+class InteractionScheduler(object):
+    """
+    Arguments:
+        call_later {Optional[Callable]} -- schedules a function after a delay in seconds (e.g., the kernel's
+            io loop), without it the work runs right away
+        debounce_ms {int} -- how long the selections are held, 0 means they run right away
+    """
+    def __init__(self, call_later: Optional[Callable[[float, Callable[[], None]], Any]], debounce_ms: int = INTERACTION_DEBOUNCE_MS):
+        self.call_later = call_later
+        self.debounce_ms = debounce_ms
+        # incremented for every interaction, so that the work for older ones can tell it is stale
+        self.generation = 0
+        # the latest work of each key, in the order they were submitted
+        self._pending: 'OrderedDict[Any, Callable[[], None]]' = OrderedDict()
+        self._scheduled = False
+
+    def set_debounce(self, debounce_ms: int):
+        self.debounce_ms = debounce_ms
+
+    def submit(self, key, work: Callable[[], None]):
+        """replaces the pending work of the same key (e.g., the chart that is brushed)"""
+        self.generation += 1
+        self._pending.pop(key, None)
+        self._pending[key] = work
+        if self.debounce_ms <= 0 or self.call_later is None:
+            self.flush()
+        elif not self._scheduled:
+            # not reset by the later submits, so that the charts keep up while the brush is moving
+            self._scheduled = True
+            self.call_later(self.debounce_ms / 1000, self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        while len(self._pending) > 0:
+            _, work = self._pending.popitem(last=False)
+            work()
+
+    def is_stale(self, generation: int) -> bool:
+        """whether there were interactions since the generation was read
+
+        Note that the interactions are submitted from the kernel's message loop, so a tick that
+        runs on the kernel (i.e., without background ticks) never sees itself become stale, the
+        newer selections are only read once it is done, and they then tick on their own.
+        """
+        return generation != self.generation
@@ -0,0 +1,196 @@
+"""Saves the state of a B2 session to a directory, so that it can be restored after the kernel restarts.
+
+The columns of the base tables are saved as .npy files, which are memory mapped
+when restored instead of being parsed again. The dataframes are saved as their
+op trees, pickled with the tables, the other dataframes and the `are`
+predicates saved by reference. Nothing is computed when restoring, the charts
+are filtered again (once) when the selection is applied.
+
+Note that the snapshot is a pickle, so only restore the snapshots you trust.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import io
+import os
+import pickle
+import numpy as np
+from datascience import Table
+from datascience.predicates import _combinable
+
+from .algebra.dataframe import MidasDataFrame, RelationalOp, RuntimeFunctions
+from .algebra.indexes import DictionaryEncoding, get_encoding, register_encoding
+from .algebra.predicate_compiler import compile_predicate
+from .algebra.worker import compiled_to_plan, compiled_from_plan
+from .util.errors import UserError
+
+SNAPSHOT_VERSION = 1
+SESSION_FILE = "session.pkl"
+TABLES_DIR = "tables"
+
+
+class SnapshotWriter(object):
+    """
+    Arguments:
+        path {str} -- the directory of the snapshot
+        df_names {List[str]} -- the dataframes that are saved by name, the others are saved by value
+    """
+    def __init__(self, path: str, df_names: List[str]):
+        self.path = path
+        self.df_names = set(df_names)
+        # by the id of the table, the table is kept so that the id is not reused while writing
+        self.tables: Dict[int, Tuple[int, Table]] = {}
+        self.table_columns: Dict[int, List[Tuple]] = {}
+
+    def dumps(self, obj) -> bytes:
+        buffer = io.BytesIO()
+        SnapshotPickler(buffer, self).dump(obj)
+        return buffer.getvalue()
+
+    def table_token(self, table: Table) -> int:
+        if id(table) in self.tables:
+            return self.tables[id(table)][0]
+        token = len(self.tables)
+        self.tables[id(table)] = (token, table)
+        directory = os.path.join(self.path, TABLES_DIR, str(token))
+        os.makedirs(directory)
+        columns = []
+        for i, label in enumerate(table.labels):
+            column = table.column(label)
+            np.save(os.path.join(directory, f"{i}.npy"), column, allow_pickle=True)
+            encoding = get_encoding(column)
+            if encoding is not None:
+                np.save(os.path.join(directory, f"{i}.codes.npy"), encoding.codes)
+                np.save(os.path.join(directory, f"{i}.dictionary.npy"), encoding.dictionary)
+            columns.append((label, "objects" if column.dtype.kind == "O" else "array", encoding is not None))
+        self.table_columns[token] = columns
+        return token
+
+
+class SnapshotPickler(pickle.Pickler):
+    def __init__(self, file, writer: SnapshotWriter):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.writer = writer
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Table):
+            return ("table", self.writer.table_token(obj))
+        if isinstance(obj, MidasDataFrame) and obj.df_name in self.writer.df_names:
+            return ("df", obj.df_name)
+        if isinstance(obj, RuntimeFunctions):
+            # the functions of the B2 instance that restores the snapshot
+            return ("runtime",)
+        if isinstance(obj, _combinable):
+            compiled = compile_predicate(obj)
+            if compiled is not None:
+                return ("predicate", compiled_to_plan(compiled))
+        return None
+
+
+class SnapshotReader(object):
+    """
+    Arguments:
+        path {str} -- the directory of the snapshot
+        rt_funcs {RuntimeFunctions} -- of the B2 instance that restores the snapshot
+    """
+    def __init__(self, path: str, rt_funcs: RuntimeFunctions):
+        session_file = os.path.join(path, SESSION_FILE)
+        if not os.path.isfile(session_file):
+            raise UserError(f"{path} is not a B2 snapshot")
+        self.path = path
+        self.rt_funcs = rt_funcs
+        with open(session_file, "rb") as f:
+            self.session = pickle.load(f)
+        if self.session["version"] != SNAPSHOT_VERSION:
+            raise UserError(f"The snapshot at {path} is from another version of B2")
+        self.tables: Dict[int, Table] = {}
+        self.dfs: Dict[str, MidasDataFrame] = {}
+        self._create_df: Optional[Callable[[str, str, RelationalOp], MidasDataFrame]] = None
+
+    def loads(self, blob: bytes):
+        return SnapshotUnpickler(io.BytesIO(blob), self).load()
+
+    def restore_dfs(self, create_df: Callable[[str, str, RelationalOp], MidasDataFrame]) -> Dict[str, MidasDataFrame]:
+        """
+        Arguments:
+            create_df {Callable} -- creates the df from its name, id and ops
+
+        Returns:
+            Dict[str, MidasDataFrame] -- the dataframes by name, in the order they were created
+        """
+        self._create_df = create_df
+        for df_name in self.session["dfs"]:
+            self.restore_df(df_name)
+        return self.dfs
+
+    def restore_df(self, df_name: str) -> MidasDataFrame:
+        # the ops can refer to dfs that were created later, if a name was reassigned
+        if df_name not in self.dfs:
+            if self._create_df is None:
+                raise UserError("the dataframes have to be restored first")
+            df_id, blob = self.session["dfs"][df_name]
+            self.dfs[df_name] = self._create_df(df_name, df_id, self.loads(blob))
+        return self.dfs[df_name]
+
+    def table(self, token: int) -> Table:
+        if token in self.tables:
+            return self.tables[token]
+        directory = os.path.join(self.path, TABLES_DIR, str(token))
+        # appended in place, `with_columns` would copy the columns (and lose the memory map)
+        table = Table()
+        for i, (label, kind, encoded) in enumerate(self.session["tables"][token]):
+            if kind == "objects":
+                column = np.load(os.path.join(directory, f"{i}.npy"), allow_pickle=True)
+            else:
+                column = memory_map(os.path.join(directory, f"{i}.npy"))
+            if encoded:
+                codes = memory_map(os.path.join(directory, f"{i}.codes.npy"))
+                dictionary = np.load(os.path.join(directory, f"{i}.dictionary.npy"))
+                register_encoding(column, DictionaryEncoding(dictionary, codes))
+            table.append_column(label, column)
+        self.tables[token] = table
+        return table
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, reader: SnapshotReader):
+        super().__init__(file)
+        self.reader = reader
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == "table":
+            return self.reader.table(pid[1])
+        if kind == "df":
+            return self.reader.restore_df(pid[1])
+        if kind == "runtime":
+            return self.reader.rt_funcs
+        if kind == "predicate":
+            return compiled_from_plan(pid[1])
+        raise pickle.UnpicklingError(f"unknown reference {kind}")
+
+
+def write_session(writer: SnapshotWriter, dfs: Dict[str, bytes], session: Dict[str, Any]):
+    """writes the session file last, so that a snapshot that failed halfway is not restored"""
+    session = dict(session, version=SNAPSHOT_VERSION, dfs=dfs, tables=writer.table_columns)
+    with open(os.path.join(writer.path, SESSION_FILE), "wb") as f:
+        pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def prepare_directory(path: str):
+    """the directory has to be empty, or an earlier snapshot, which is replaced"""
+    if os.path.isdir(path) and len(os.listdir(path)) > 0:
+        if not os.path.isfile(os.path.join(path, SESSION_FILE)):
+            raise UserError(f"{path} is not empty, and is not a B2 snapshot")
+        os.remove(os.path.join(path, SESSION_FILE))
+        # imported here since it is only used to replace a snapshot
+        from shutil import rmtree
+        rmtree(os.path.join(path, TABLES_DIR), ignore_errors=True)
+    os.makedirs(os.path.join(path, TABLES_DIR), exist_ok=True)
+
+
+####################################
+########    helper funcs    ########
+####################################
+
+def memory_map(file: str) -> np.ndarray:
+    # copy on write, so that changing the table in the notebook does not change the snapshot
+    return np.load(file, mmap_mode="c").view(np.ndarray)
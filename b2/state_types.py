@@ -3,3 +3,12 @@ from typing import NamedTuple, Callable, List, NewType, Union, Any, Optional, Di
 
 
 DFName = NewType('DFName', str)
+
+
+class SentChartData(NamedTuple):
+    """what the front end has for a chart, which the next update is diffed against"""
+    seq: int
+    # the filtered MidasDataFrame, kept to resend all of it if the front end asks
+    df: Any
+    # see `keyed_rows`, None if the data cannot be diffed
+    keyed: Optional[Tuple[List[str], int, Dict[tuple, tuple]]]
@@ -9,6 +9,9 @@ import json
 from pyperclip import copy
 import ast
 import functools
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 import inspect
 
 # for development
@@ -18,35 +21,52 @@ from .constants import ISDEBUG
 from .algebra.data_types import DFId
 from .algebra.dataframe import MidasDataFrame, RelationalOp, DFInfo, VisualizedDFInfo, get_midas_code
 from .algebra.selection import SelectionValue, NumericRangeSelection, SetSelection, ColumnRef, EmptySelection
+from .algebra.indexes import get_encoding
 from .constants import MIDAS_CELL_COMM_NAME, MAX_BINS, MIDAS_RECOVERY_COMM_NAME, STUB_DISTRIBUTION_BIN
-from .state_types import DFName
+from .state_types import DFName, SentChartData
+from .scheduler import InteractionScheduler
 from .util.errors import InternalLogicalError, MockComm, debug_log, NotAllCaseHandledError
 from .util.utils import sanitize_string_for_var_name
 from .vis_types import EncodingSpec, FilterLabelOptions
-from .util.data_processing import dataframe_to_dict, get_numeric_distribution_code, get_datetime_distribution_code, get_basic_group_vis
+from .util.data_processing import dataframe_to_columns, keyed_rows, diff_rows, get_numeric_distribution_code, get_datetime_distribution_code, get_basic_group_vis
 
-def logged(remove_on_chart_removal: bool):
+def logged(remove_on_chart_removal: bool, latest_only: bool = False):
+    """logs the call to be replayed when the front end reconnects, only the latest call
+    of the function for the same df is kept, since it supersedes the earlier ones
+    (or the latest call of the function for any df, with latest_only)"""
     def wrapper_factory(f):
+        params = list(inspect.signature(f).parameters)
         @functools.wraps(f)
         def wrapper(self, *args, **kwargs):
             ret = f(self, *args, **kwargs)
-            params = inspect.signature(f).parameters
-
-            if remove_on_chart_removal and "df_name" in params:
-                index = list(inspect.signature(f).parameters).index("df_name") - 1
-                df_to_remove = args[index]
-                assert isinstance(df_to_remove, str)
-            elif remove_on_chart_removal and "df" in params:
-                index = list(inspect.signature(f).parameters).index("df") - 1
-                df_to_remove = args[index].df_name
-                assert isinstance(df_to_remove, str)
-            else:
-                df_to_remove = None
-            self.log(f, args, kwargs, df_to_remove)
+            df_name = logged_df_name(params, args, kwargs)
+            self.log(f, args, kwargs, df_name if remove_on_chart_removal else None, None if latest_only else df_name)
             return ret
         return wrapper
     return wrapper_factory
 
+
+def logged_df_name(params: List[str], args, kwargs) -> Optional[str]:
+    """the df that the logged call is about, from its df_name or df argument"""
+    for name in ["df_name", "df"]:
+        if name not in params:
+            continue
+        # params include self
+        index = params.index(name) - 1
+        value = kwargs[name] if name in kwargs else (args[index] if index < len(args) else None)
+        if name == "df" and value is not None:
+            value = value.df_name
+        if value is not None:
+            assert isinstance(value, str)
+            return value
+    return None
+
+
+def selected_df_names(selections) -> List[str]:
+    """the charts of the selections passed to `after_selection`"""
+    return [df_name for s in selections if isinstance(s, dict) for df_name in s]
+
+
 class UiComm(object):
     comm: Comm
     recovery_comm: Comm
@@ -68,6 +88,9 @@ class UiComm(object):
 
         # functions passed at creation time
         self.is_in_ipynb = is_in_ipynb
+        # the batches of `batch` are per thread, since the ticks can run on a background thread
+        self._batches = threading.local()
+        self.scheduler = InteractionScheduler(get_ipython().kernel.io_loop.call_later if is_in_ipynb else None)
         self.midas_instance_name = midas_instance_name
         self.set_comm(midas_instance_name, logger_id)
         self.register_recovery_comm(midas_instance_name, logger_id)
@@ -82,26 +105,98 @@ class UiComm(object):
         self.vis_spec = {}
         self.id_by_df_name = {}
         self.shelf_selections = {}
-        self.logged_comms = []
-        self.tmp_log = []
-
-    def log(self, function, args, kwargs, associated_df_name: str):
-        self.logged_comms.append((
+        # the latest call of each logged function for each df, keyed by (function name, df name), in the order of the latest calls
+        self.logged_comms: 'OrderedDict[Tuple[str, Optional[str]], Tuple]' = OrderedDict()
+        # only the recent messages, for debugging
+        self.tmp_log: deque = deque(maxlen=100)
+        self.sent_data: Dict[DFName, SentChartData] = {}
+
+    @property
+    def pending(self) -> Optional[List[Tuple[Dict, List]]]:
+        """the messages held back by `batch` on this thread, None when there is no batch open"""
+        return getattr(self._batches, "pending", None)
+
+    @pending.setter
+    def pending(self, pending: Optional[List[Tuple[Dict, List]]]):
+        self._batches.pending = pending
+
+    def send(self, message: Dict, buffers: Optional[List] = None):
+        # note that the kernel's iopub socket can be used from any thread
+        if self.pending is not None:
+            self.pending.append((message, buffers or []))
+        else:
+            self.comm.send(message, buffers=buffers)
+
+    @contextmanager
+    def batch(self):
+        """the messages sent inside are sent together as one batch message, which the front end
+        applies at once, when the outermost batch exits"""
+        if self.pending is not None:
+            yield
+            return
+        self.pending = []
+        try:
+            yield
+        finally:
+            pending, self.pending = self.pending, None
+            self.send_batch(pending)
+
+    def send_batch(self, pending: List[Tuple[Dict, List]]):
+        if len(pending) == 0:
+            return
+        if len(pending) == 1:
+            self.send(pending[0][0], pending[0][1])
+            return
+        messages = []
+        buffers: List = []
+        for message, message_buffers in pending:
+            # the range of the message's buffers in the buffers of the batch
+            messages.append({"message": message, "buffers": [len(buffers), len(buffers) + len(message_buffers)]})
+            buffers.extend(message_buffers)
+        self.comm.send({
+            "type": "batch",
+            "messages": messages
+        }, buffers=buffers)
+
+    def log(self, function, args, kwargs, associated_df_name: Optional[str], df_name: Optional[str]):
+        key = (function.__name__, df_name)
+        keys = list(self.logged_comms)
+        self.logged_comms[key] = (
             function,           # 0
             args,               # 1
             kwargs,             # 2
             associated_df_name, # 3
-        ))
+        )
+        if key not in keys:
+            return
+        # the replay ends on the latest calls, e.g., the brush of the latest selection
+        self.logged_comms.move_to_end(key)
+        if df_name is not None:
+            # the calls about the same df that came after the replaced one follow it, so that
+            # a chart that is shown again (unchanged) is still created before it is updated
+            for later in keys[keys.index(key) + 1:]:
+                if later[1] == df_name:
+                    self.logged_comms.move_to_end(later)
 
 
     def run_log(self):
-        for f, args, kwargs, _ in self.logged_comms:
-          f(self, *args, *kwargs)
+        logged = list(self.logged_comms.items())
+        for f, args, kwargs, _ in [entry for _, entry in logged]:
+            f(self, *args, **kwargs)
+        # recreating the charts would remove their updates from the log, which are replayed right after
+        self.logged_comms = OrderedDict(logged)
 
     def remove_df_from_log(self, df_name):
-        def does_not_contain_df_name(entry):
-            return entry[3] != df_name
-        self.logged_comms = list(filter(does_not_contain_df_name, self.logged_comms))
+        for key in [k for k, entry in self.logged_comms.items() if entry[3] == df_name]:
+            del self.logged_comms[key]
+
+    def remove_superseded_from_log(self, df_name: str):
+        """the chart was created again, so its earlier updates no longer apply"""
+        self.logged_comms.pop(("update_chart_filtered_value", df_name), None)
+        after_selection = self.logged_comms.get(("after_selection", None))
+        if after_selection is not None and (after_selection[3] == df_name or df_name in selected_df_names(after_selection[1][0])):
+            # the brush of the latest selection was drawn on the old chart
+            del self.logged_comms[("after_selection", None)]
 
     def handle_msg(self, data_raw):
         data = data_raw["content"]["data"]
@@ -145,12 +240,18 @@ class UiComm(object):
                 del self.vis_spec[df_name]
                 self.remove_df_from_log(df_name)
                 return
+            elif command == "resync":
+                # the front end missed an update
+                self.resend_chart_data(DFName(data["df_name"]))
+                return
             elif command == "add_current_selection":
                 value = json.loads(data["value"])
                 # parse it first!
                 s = data["value"]
                 debug_log(f"add_current_selection {s}")
-                self.handle_add_current_selection(value)
+                # while brushing, only the latest selection of each chart is applied
+                chart = next(iter(value), None) if isinstance(value, dict) else None
+                self.scheduler.submit(chart, lambda: self.handle_add_current_selection(value))
                 return
             else:
                 m = f"Command {command} not handled!"
@@ -204,6 +305,7 @@ class UiComm(object):
                     self.set_comm(self.midas_instance_name, logger_id)
                     debug_log("Clearing stored visualizations...")
                     self.vis_spec = {}
+                    self.sent_data = {}
                     debug_log("Comm reopened. Rerunning logged commands...")
                     self.run_log()
  
@@ -222,7 +324,7 @@ class UiComm(object):
             "dfName": df.df_name,
             "columns": json.dumps(columns)
         }
-        self.comm.send(message)
+        self.send(message)
         return
 
 
@@ -237,12 +339,16 @@ class UiComm(object):
 
         self.vis_spec[df.df_name] = encoding
         self.id_by_df_name[df.df_name] = df._id
+        # the front end starts over with the chart
+        self.sent_data.pop(df.df_name, None)
+        self.remove_superseded_from_log(df.df_name)
 
         # if ISDEBUG: set_trace()
-        records = dataframe_to_dict(df, FilterLabelOptions.unfiltered)
+        buffers: List[memoryview] = []
+        columns = dataframe_to_columns(df, FilterLabelOptions.unfiltered, buffers)
         code = get_midas_code(df._ops, self.midas_instance_name)
         # TODO: check if we even need to do the dumping
-        data = json.dumps(records)
+        data = json.dumps(columns)
         hash_val = df._id + "_" + encoding.to_hash()
         message = {
             'type': 'chart_render',
@@ -252,7 +358,7 @@ class UiComm(object):
             'code': code,
             'hashVal': hash_val
         }
-        self.comm.send(message)
+        self.send(message, buffers=buffers)
         return
         
 
@@ -291,26 +397,72 @@ class UiComm(object):
         if df_name not in self.vis_spec:
             raise InternalLogicalError(f"Cannot update df: {df_name}, since it was not visualized before")
         code = self.get_filtered_code(df_name)
+        sent = self.sent_data.get(df_name)
+        seq = 0 if sent is None else sent.seq + 1
+        keyed = None if df is None or df.table is None else keyed_rows(df)
+        self.sent_data[df_name] = SentChartData(seq, df, keyed)
+        if sent is not None and sent.keyed is not None and keyed is not None:
+            fields, key_count, rows = keyed
+            if fields == sent.keyed[0]:
+                changed, removed = diff_rows(sent.keyed[2], rows)
+                # only worth it when most of the rows stayed the same
+                if 2 * (len(changed) + len(removed)) < len(rows):
+                    self.send_chart_delta(df_name, code, seq, fields, key_count, [k + rows[k] for k in changed], removed)
+                    return
+        self.send_chart_data(df, df_name, code, seq)
+        return
+
+    def send_chart_data(self, df: Optional[MidasDataFrame], df_name: DFName, code: str, seq: int):
         if df is None or df.table is None:
-            self.comm.send({
+            self.send({
                 "type": "chart_update_data",
                 "dfName": df_name,
-                "newData": [],
-                "code": code
+                "newData": {"fields": [], "columns": [], "numRows": 0},
+                "code": code,
+                "seq": seq
             })
         else:
-            new_data = dataframe_to_dict(df, FilterLabelOptions.filtered)
-            self.comm.send({
+            buffers: List[memoryview] = []
+            new_data = dataframe_to_columns(df, FilterLabelOptions.filtered, buffers)
+            self.send({
                 "type": "chart_update_data",
                 "dfName": df_name,
                 "newData": new_data,
-                "code": code
-            })
-        return
+                "code": code,
+                "seq": seq
+            }, buffers=buffers)
 
-    @logged(remove_on_chart_removal=True)
+    def send_chart_delta(self, df_name: DFName, code: str, seq: int, fields: List[str], key_count: int, upserts: List[tuple], removed: List[tuple]):
+        """
+        Arguments:
+            upserts {List[tuple]} -- the rows that changed or are new
+            removed {List[tuple]} -- the keys of the rows that are gone
+        """
+        columns = [list(c) for c in zip(*upserts)] if len(upserts) > 0 else [[] for _ in fields]
+        self.send({
+            "type": "chart_update_delta",
+            "dfName": df_name,
+            "delta": {
+                "keyCount": key_count,
+                "upserts": {"fields": fields, "columns": columns, "numRows": len(upserts), "overview": FilterLabelOptions.filtered.value},
+                "removed": [list(k) for k in removed],
+            },
+            "code": code,
+            "seq": seq,
+            "baseSeq": seq - 1
+        })
+
+    def resend_chart_data(self, df_name: DFName):
+        sent = self.sent_data.get(df_name)
+        if sent is None or df_name not in self.vis_spec:
+            return
+        # a new sequence number, so that the deltas that were already on their way are ignored
+        self.sent_data[df_name] = SentChartData(sent.seq + 1, sent.df, sent.keyed)
+        self.send_chart_data(sent.df, df_name, self.get_filtered_code(df_name), sent.seq + 1)
+
+    @logged(remove_on_chart_removal=True, latest_only=True)
     def after_selection(self, selections, df_name, tick: int):
-        self.comm.send({
+        self.send({
             "type": "after_selection",
             "selection": json.dumps(selections),
             "dfName": df_name,
@@ -320,7 +472,7 @@ class UiComm(object):
     def create_cell(self, s, fun_kind: str, should_run: bool):
         # self.send_debug_msg(f"create_cell_with_text called {s}")
         # self.send_debug_msg(fcreating cell: {annotated}")
-        self.comm.send({
+        self.send({
             "type": "create_cell",
             "funKind": fun_kind,
             "code": s,
@@ -328,7 +480,7 @@ class UiComm(object):
         })
 
     def remove_reactive_cell(self):
-        self.comm.send({
+        self.send({
             "type": "deactive",
         })
 
@@ -336,7 +488,7 @@ class UiComm(object):
     #   that's information to be captured on the JS end.
     def add_reactive_cell(self, df_name: str):
     # , do_append: bool):
-        self.comm.send({
+        self.send({
             "type": "reactive",
             "dfName": df_name,
             # "appendFlag": 1 if do_append else 0
@@ -344,28 +496,28 @@ class UiComm(object):
 
 
     def execute_selection(self, params: str, df_name: str):
-        self.comm.send({
+        self.send({
             "type": "execute_selection",
             "params": params,
             "dfName": df_name,
         })
 
     def execute_fun(self, fun: str, params: str):
-        self.comm.send({
+        self.send({
             "type": "execute_fun",
             "funName": fun,
             "params": params,
         })
 
     def send_debug_msg(self, message: str):
-        self.comm.send({
+        self.send({
             "type": "notification",
             "style": "debug",
             "value": message
         })
 
     def send_column_click_error_msg(self, message: str, df_name: str, column_name: str):
-        self.comm.send({
+        self.send({
             "type": "notification",
             "style": "error",
             "value": message,
@@ -374,7 +526,7 @@ class UiComm(object):
         })
 
     def log_start_task(self, task_id: str):
-        self.comm.send({
+        self.send({
             "type": "task-start",
             "value": task_id
         })
@@ -466,12 +618,16 @@ class UiComm(object):
         if (is_string_dtype(col_value)):
             # we need to check the cardinarily
             code = get_basic_group_vis(new_name, df.df_name, col_name)
-            try:
-                unique_vals = np.unique(col_value)
-            except TypeError:
-                # with None value
-                return (code, False, f"Please handle None values from {col_name}!")
-            current_max_bins = len(unique_vals)
+            encoding = get_encoding(col_value)
+            if encoding is not None:
+                current_max_bins = encoding.num_keys
+            else:
+                try:
+                    unique_vals = np.unique(col_value)
+                except TypeError:
+                    # with None value
+                    return (code, False, f"Please handle None values from {col_name}!")
+                current_max_bins = len(unique_vals)
             if current_max_bins < MAX_BINS:
                 return (code, True, "")
             else:
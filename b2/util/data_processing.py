@@ -3,7 +3,7 @@ import json
 import numpy as np
 from math import log10, pow, floor
 from pandas import notnull
-from typing import Tuple
+from typing import Tuple, Optional, List, Dict
 from IPython.core.debugger import set_trace
 
 from b2.constants import IS_OVERVIEW_FIELD_NAME, MAX_BINS, STUB_DISTRIBUTION_BIN, MAX_GENERATED_BINS
@@ -179,11 +179,15 @@ def sanitize_dataframe(df: Table):
     * Convert DateTime dtypes into appropriate string representations
     """
     import numpy as np
+    # cyclic imports
+    from b2.algebra.indexes import get_encoding
 
     if df is None:
         return None
         # raise InternalLogicalError("Cannot sanitize empty df")
 
+    # dictionary encoded columns only have strings, the copy would lose track of them
+    encoded = [l for l in df.labels if get_encoding(df.column(l)) is not None]
     df = df.copy()
 
     def to_list_if_array(val):
@@ -217,7 +221,7 @@ def sanitize_dataframe(df: Table):
             new_column = df[col_name].astype(str)
             new_column[new_column == 'NaT'] = ''
             df[col_name] = new_column
-        elif dtype == object:
+        elif dtype == object and col_name not in encoded:
             # Convert numpy arrays saved as objects to lists
             # Arrays are not JSON serializable
             col = np.vectorize(to_list_if_array)(df[col_name])
@@ -243,3 +247,114 @@ def dataframe_to_dict(df, include_filter_label: FilterLabelOptions):
             k[IS_OVERVIEW_FIELD_NAME] = include_filter_label.value
         return k
     return list(map(s, clean_df.rows))
+
+
+def dataframe_to_columns(df, include_filter_label: FilterLabelOptions, buffers: Optional[list] = None):
+    """the column oriented version of `dataframe_to_dict`, which the front end expands into rows.
+    The values are converted column by column, without building a dict per row.
+
+    Keyword Arguments:
+        include_filter_label {bool} -- whether the front end should insert the overview column
+        buffers {Optional[list]} -- if given, the numeric columns are appended to it as binary buffers,
+            and their entry in the columns describes the buffer instead
+    """
+    # cyclic imports
+    from b2.algebra.indexes import get_encoding
+
+    table = df.table
+    if table is None:
+        return {"fields": [], "columns": [], "numRows": 0}
+    columns = []
+    for label in table.labels:
+        column = table.column(label)
+        numbers = None if buffers is None else column_to_buffer(column)
+        if numbers is not None:
+            columns.append({"buffer": len(buffers), "dtype": numbers.dtype.name})
+            buffers.append(memoryview(numbers))
+            continue
+        columns.append(column_to_list(column, get_encoding(column)))
+    data = {"fields": list(table.labels), "columns": columns, "numRows": table.num_rows}
+    if include_filter_label != FilterLabelOptions.none:
+        data["overview"] = include_filter_label.value
+    return data
+
+
+def column_to_list(column: np.ndarray, encoding=None) -> list:
+    """same conversions as `sanitize_dataframe`, for a single column
+
+    Keyword Arguments:
+        encoding {Optional[DictionaryEncoding]} -- the encoding of the column, if it has one
+    """
+    if encoding is not None:
+        # one python string per distinct value, shared by the rows, instead of one per row
+        return encoding.dictionary.astype(object)[encoding.codes].tolist()
+    dtype = column.dtype
+    if dtype.kind == "f":
+        # NaN/inf values are not JSON serializable
+        return np.where(np.isfinite(column), column, None).tolist()
+    if dtype.kind == "M":
+        # astype(str) will choose the appropriate resolution
+        strings = column.astype(str)
+        strings[np.isnat(column)] = ''
+        return strings.tolist()
+    if dtype == object:
+        # numpy arrays saved as objects are not JSON serializable
+        return [v.tolist() if isinstance(v, np.ndarray) else (v if notnull(v) else None) for v in column]
+    # ints, bools and strings convert to their python equivalents
+    return column.tolist()
+
+
+def column_to_buffer(column: np.ndarray) -> Optional[np.ndarray]:
+    """the little endian array that the front end wraps as a TypedArray, without copying when the
+    column already has a matching type. Returns None for the columns that are not numeric, or that
+    have values JSON cannot represent"""
+    kind, size = column.dtype.kind, column.dtype.itemsize
+    if kind == "f":
+        if not np.isfinite(column).all():
+            # sent as null on the JSON path, the charts' scales break on NaN and infinity
+            return None
+        dtype = "<f4" if size <= 4 else "<f8"
+    elif kind in "iu" and size <= 4:
+        dtype = f"<{kind}{size}"
+    elif kind in "iu":
+        # there are no 64 bit integers in javascript (other than BigInt), numbers are doubles anyway
+        fits = len(column) == 0 or (column.min() >= np.iinfo(np.int32).min and column.max() <= np.iinfo(np.int32).max)
+        dtype = "<i4" if fits else "<f8"
+    else:
+        return None
+    return np.ascontiguousarray(column, dtype=dtype)
+
+
+def keyed_rows(df) -> Optional[Tuple[List[str], int, Dict[tuple, tuple]]]:
+    """the rows of a group by result keyed by their group, which is what the chart updates are diffed on
+
+    Returns:
+        the fields (the group columns first), the number of group columns, and the values of the other
+        fields by group. None if the df is not a group by, or its groups are not unique
+    """
+    # cyclic imports
+    from b2.algebra.dataframe import RelationalOpType
+    from b2.algebra.indexes import get_encoding
+
+    if df is None or df._ops.op_type != RelationalOpType.groupby:
+        return None
+    group_columns = df._ops.columns
+    key_fields = [group_columns] if isinstance(group_columns, str) else list(group_columns)
+    table = df.table
+    if table is None or not all(isinstance(l, str) and l in table.labels for l in key_fields):
+        return None
+    fields = key_fields + [l for l in table.labels if l not in key_fields]
+    columns = [column_to_list(table.column(l), get_encoding(table.column(l))) for l in fields]
+    key_count = len(key_fields)
+    rows = dict(zip(zip(*columns[:key_count]), zip(*columns[key_count:])))
+    if len(rows) != table.num_rows:
+        return None
+    return fields, key_count, rows
+
+
+def diff_rows(old: Dict[tuple, tuple], new: Dict[tuple, tuple]) -> Tuple[List[tuple], List[tuple]]:
+    """the keys whose values changed (or are new), and the keys that were removed"""
+    changed = [k for k, v in new.items() if old.get(k) != v]
+    removed = [k for k in old if k not in new]
+    return changed, removed
+
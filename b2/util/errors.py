@@ -16,7 +16,7 @@ class bcolors:
 class MockComm(object):
     def __init__(self):
         pass
-    def send(self, obj):
+    def send(self, obj, buffers=None):
         print(bcolors.GREY + "sending", obj, bcolors.ENDC)
 
 
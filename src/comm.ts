@@ -1,5 +1,5 @@
 /// <reference path="./external/Jupyter.d.ts" />
-import { MIDAS_CELL_COMM_NAME, MIDAS_RECOVERY_COMM_NAME, MIDAS_SELECTION_FUN } from "./constants";
+import { MIDAS_CELL_COMM_NAME, MIDAS_RECOVERY_COMM_NAME, MIDAS_SELECTION_FUN, IS_OVERVIEW_FIELD_NAME } from "./constants";
 import { LogSteps, LogDebug, LogInternalError, setupCellManagerUIChanges, getContainerFunctions, setupJupyterEvents, enableMidasInteractions, createMenuBtnGroup } from "./utils";
 import { createMidasComponent } from "./setup";
 import { AlertType, FunKind } from "./types";
@@ -50,11 +50,53 @@ type SynchronizeSelectionLoad = {
   selection: any;
 };
 
+// a numeric column sent as one of the binary buffers of the message
+type BufferColumn = {
+  buffer: number;
+  dtype: string;
+};
+
+// one array per field, the overview flag is the same for all the rows
+type ColumnarData = {
+  fields: string[];
+  columns: (any[] | BufferColumn)[];
+  numRows: number;
+  overview?: boolean;
+};
+
+const TYPED_ARRAYS: { [dtype: string]: any } = {
+  "int8": Int8Array,
+  "uint8": Uint8Array,
+  "int16": Int16Array,
+  "uint16": Uint16Array,
+  "int32": Int32Array,
+  "uint32": Uint32Array,
+  "float32": Float32Array,
+  "float64": Float64Array,
+};
+
 type UpdateCommLoad = {
   type: string;
   dfName: string;
-  newData: any;
+  newData: ColumnarData;
+  code: string;
+  seq: number;
+};
+
+// the fields of the upserts start with the keyCount fields that identify a row
+type ChartDelta = {
+  keyCount: number;
+  upserts: ColumnarData;
+  removed: any[][];
+};
+
+type UpdateDeltaCommLoad = {
+  type: string;
+  dfName: string;
+  delta: ChartDelta;
   code: string;
+  seq: number;
+  baseSeq: number;
 };
 
 type AddReactiveCell = {
@@ -71,12 +113,18 @@ type ProfilerComm = {
 type ChartRenderComm = {
   type: string;
   dfName: string;
-  data: string;
+  data: string; // decoded to ColumnarData
   encoding: string;
   code: string;
   hashVal: string;
 };
 
+// the messages of one tick, each with the range of its buffers in the buffers of the batch
+type BatchLoad = {
+  type: string;
+  messages: { message: MidasCommLoad; buffers: [number, number] }[];
+};
+
 type MidasCommLoad = CommandLoad
                      | BasicLoad
                      | InitLoad
@@ -87,9 +135,57 @@ type MidasCommLoad = CommandLoad
                      | ProfilerComm
                      | ChartRenderComm
                      | UpdateCommLoad
+                     | UpdateDeltaCommLoad
+                     | BatchLoad
                      | SynchronizeSelectionLoad
                      | ExecuteSelectionLoad;
 
+/**
+ * Wraps a binary buffer as a TypedArray, copying only if it is not aligned to the element size.
+ */
+function wrapBuffer(column: BufferColumn, buffers: any[]): ArrayLike<number> {
+  const arrayType = TYPED_ARRAYS[column.dtype];
+  const raw = buffers[column.buffer];
+  const view: ArrayBufferView = ArrayBuffer.isView(raw) ? raw : new DataView(raw);
+  if (view.byteOffset % arrayType.BYTES_PER_ELEMENT === 0) {
+    return new arrayType(view.buffer, view.byteOffset, view.byteLength / arrayType.BYTES_PER_ELEMENT);
+  }
+  return new arrayType(view.buffer.slice(view.byteOffset, view.byteOffset + view.byteLength));
+}
+
+/**
+ * Expands the columns sent by the kernel into the rows that Vega expects.
+ */
+function expandColumns(data: ColumnarData, buffers: any[] = []): any[] {
+  const columns = data.columns.map(c => Array.isArray(c) ? c : wrapBuffer(c, buffers));
+  const rows = new Array(data.numRows);
+  for (let i = 0; i < data.numRows; i++) {
+    const row: any = {};
+    for (let j = 0; j < data.fields.length; j++) {
+      row[data.fields[j]] = columns[j][i];
+    }
+    if (data.overview !== undefined) {
+      row[IS_OVERVIEW_FIELD_NAME] = data.overview;
+    }
+    rows[i] = row;
+  }
+  return rows;
+}
+
+/**
+ * Applies the changed and removed rows to the rows of the previous update.
+ */
+function applyDelta(rows: any[], delta: ChartDelta): any[] {
+  const keyFields = delta.upserts.fields.slice(0, delta.keyCount);
+  const keyOf = (row: any) => JSON.stringify(keyFields.map(f => row[f]));
+  // maps keep their insertion order, so the rows that changed stay in place
+  const byKey = new Map<string, any>();
+  rows.forEach(r => byKey.set(keyOf(r), r));
+  delta.removed.forEach(k => byKey.delete(JSON.stringify(k)));
+  expandColumns(delta.upserts).forEach(r => byKey.set(keyOf(r), r));
+  return Array.from(byKey.values());
+}
+
 export function openRecoveryComm() {
     const comm = Jupyter.notebook.kernel.comm_manager.new_comm(MIDAS_RECOVERY_COMM_NAME);
     LogDebug("Sending recovery message...");
@@ -173,7 +269,14 @@ export function makeComm(is_first_time = true) {
           containerFunctions
         );
 
-        const on_msg = makeOnMsg(ref, cellManager, logger);
+        const requestResync = (dfName: string) => {
+          comm.send({
+            "command": "resync",
+            "df_name": dfName,
+          });
+        };
+
+        const on_msg = makeOnMsg(ref, cellManager, logger, requestResync);
         set_on_msg(on_msg);
 
         if (is_first_time) {
@@ -188,9 +291,22 @@ export function makeComm(is_first_time = true) {
 }
 
 
-function makeOnMsg(refToSidebar: MidasSidebar, cellManager: CellManager, logger: LoggerFunction) {
+function makeOnMsg(refToSidebar: MidasSidebar, cellManager: CellManager, logger: LoggerFunction, requestResync: (dfName: string) => void) {
   let refToMidas = refToSidebar.getMidasContainerRef();
   let refToProfilerShelf = refToSidebar.getProfilerShelfRef();
+  // the last filtered rows of each chart, which the deltas apply to
+  const chartData: { [dfName: string]: { seq: number; rows: any[] } } = {};
+  // the charts changed by the batch being applied, which run once it is done, null outside of a batch
+  let staged: Set<string> | null = null;
+
+  function replaceData(dfName: string, rows: any[], code: string) {
+    if (staged) {
+      refToMidas.stageData(dfName, rows, code);
+      staged.add(dfName);
+    } else {
+      refToMidas.replaceData(dfName, rows, code);
+    }
+  }
 
   return function on_msg(msg: any) {
     const load = msg.content.data as MidasCommLoad;
@@ -264,7 +380,8 @@ function makeOnMsg(refToSidebar: MidasSidebar, cellManager: CellManager, logger:
         LogSteps("Chart", chartRenderLoad.dfName);
         const cellId = msg.parent_header.msg_id;
         const encoding = JSON.parse(chartRenderLoad.encoding);
-        const data = JSON.parse(chartRenderLoad.data);
+        const data = expandColumns(JSON.parse(chartRenderLoad.data), msg.buffers);
+        delete chartData[chartRenderLoad.dfName];
         refToMidas.addDataFrame(
           chartRenderLoad.dfName,
           encoding,
@@ -274,10 +391,46 @@ function makeOnMsg(refToSidebar: MidasSidebar, cellManager: CellManager, logger:
           chartRenderLoad.hashVal);
         return;
       }
+      case "batch": {
+        // applied in one go, so each chart is rendered once with all of the updates
+        const batchLoad = load as BatchLoad;
+        const buffers = msg.buffers || [];
+        const batchStaged = new Set<string>();
+        staged = batchStaged;
+        try {
+          batchLoad.messages.forEach(m => on_msg({
+            ...msg,
+            content: { ...msg.content, data: m.message },
+            buffers: buffers.slice(m.buffers[0], m.buffers[1]),
+          }));
+        } finally {
+          staged = null;
+          refToMidas.runViews(Array.from(batchStaged)).catch(err => LogInternalError(`Failed to render the batch: ${err}`));
+        }
+        return;
+      }
       case "chart_update_data": {
         // note that unlike chart_render, updates should NOT scroll!
         const updateLoad = load as UpdateCommLoad;
-        refToMidas.replaceData(updateLoad.dfName, updateLoad.newData, updateLoad.code);
+        const rows = expandColumns(updateLoad.newData, msg.buffers);
+        chartData[updateLoad.dfName] = { seq: updateLoad.seq, rows };
+        replaceData(updateLoad.dfName, rows, updateLoad.code);
+        return;
+      }
+      case "chart_update_delta": {
+        const deltaLoad = load as UpdateDeltaCommLoad;
+        const previous = chartData[deltaLoad.dfName];
+        if (!previous || previous.seq !== deltaLoad.baseSeq) {
+          // we missed an update, ask for all of the data instead (once, -1 marks the pending request)
+          if (!previous || previous.seq !== -1) {
+            chartData[deltaLoad.dfName] = { seq: -1, rows: previous ? previous.rows : [] };
+            requestResync(deltaLoad.dfName);
+          }
+          return;
+        }
+        const rows = applyDelta(previous.rows, deltaLoad.delta);
+        chartData[deltaLoad.dfName] = { seq: deltaLoad.seq, rows };
+        replaceData(deltaLoad.dfName, rows, deltaLoad.code);
         return;
       }
     }
@@ -235,6 +235,14 @@ export default class MidasContainer extends React.Component<ContainerProps, Cont
     this.refsCollection[dfName].replaceData(data, code);
   }
 
+  stageData(dfName: string, data: any[], code: string) {
+    this.refsCollection[dfName].stageData(data, code);
+  }
+
+  runViews(dfNames: string[]) {
+    return Promise.all(dfNames.map(dfName => this.refsCollection[dfName].runView()));
+  }
+
 
   /**
    * Removes the given data frame via id
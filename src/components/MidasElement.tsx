@@ -371,6 +371,17 @@ export class MidasElement extends React.Component<MidasElementProps, MidasElemen
 
   // FIXME: define type
   async replaceData(newValues: any, code: string) {
+    this.stageData(newValues, code);
+    await this.runView();
+  }
+
+  /**
+   * Changes the data without running the view, such that the updates of
+   * a batch are all applied before each view runs once (see `runView`).
+   * The last change before the run wins, since each one replaces the
+   * filtered values that the view currently has.
+   */
+  stageData(newValues: any, code: string) {
     if (!this.state.view) {
       LogInternalError(`Vega view should have already been defined by now!`);
     }
@@ -379,7 +390,7 @@ export class MidasElement extends React.Component<MidasElementProps, MidasElemen
       .remove((datum: any) => { return datum.is_overview === false; })
       .insert(newValues);
 
-    this.state.view.change(DEFAULT_DATA_SOURCE, changeSet).runAsync();
+    this.state.view.change(DEFAULT_DATA_SOURCE, changeSet);
     const hasFilteredValues = newValues.length > 0
       ? true
       : false
@@ -397,6 +408,10 @@ export class MidasElement extends React.Component<MidasElementProps, MidasElemen
     });
   }
 
+  runView() {
+    return this.state.view.runAsync();
+  }
+
   move(direction: "left" | "right") {
     this.props.moveElement(direction);
     const entry: LogDataframeInteraction = {
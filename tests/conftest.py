@@ -0,0 +1,57 @@
+import pytest
+
+from b2.algebra.cache import result_cache
+from b2.algebra.indexes import index_cache, sorted_columns, pinned_indexes
+from b2.algebra.tiles import interactive_index
+from b2.constants import INDEX_CACHE_MAX_BYTES, RESULT_CACHE_MAX_BYTES
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    # the caches and indexes are shared by the whole kernel, so each test starts from scratch
+    result_cache.clear()
+    index_cache.clear()
+    sorted_columns.clear()
+    pinned_indexes.clear()
+    interactive_index.set_enabled(False)
+    yield
+    result_cache.set_max_bytes(RESULT_CACHE_MAX_BYTES)
+    index_cache.set_max_bytes(INDEX_CACHE_MAX_BYTES)
+    interactive_index.set_enabled(False)
+
+
+class RecordingComm(object):
+    """stands in for the kernel's comm, keeping the messages instead of sending them"""
+    def __init__(self):
+        self.sent = []
+        self.buffers = []
+
+    def send(self, message, buffers=None):
+        self.sent.append(message)
+        self.buffers.append(buffers or [])
+
+    def messages(self):
+        """the messages, with the ones of the batches expanded"""
+        expanded = []
+        for m in self.sent:
+            if m["type"] == "batch":
+                expanded.extend(b["message"] for b in m["messages"])
+            else:
+                expanded.append(m)
+        return expanded
+
+
+@pytest.fixture
+def comm():
+    return RecordingComm()
+
+
+@pytest.fixture
+def m(monkeypatch, comm):
+    from b2 import B2
+    from b2.ui_comm import UiComm
+    # there is no kernel to register the comm with
+    monkeypatch.setattr(UiComm, "register_recovery_comm", lambda *args: None)
+    m = B2()
+    m._ui_comm.comm = comm
+    return m
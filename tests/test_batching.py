@@ -0,0 +1,16 @@
+from test_deltas import make_wide_chart
+
+
+def test_selection_is_sent_as_one_batch(m, comm):
+    make_wide_chart(m)
+    comm.sent.clear()
+    comm.buffers.clear()
+    m.sel([{"b": {"y": [0]}}])
+    assert len(comm.sent) == 1
+    batch = comm.sent[0]
+    assert batch["type"] == "batch"
+    assert [b["message"]["type"] for b in batch["messages"]][-1] == "after_selection"
+    # the ranges of the buffers cover the buffers of the batch
+    ends = [b["buffers"] for b in batch["messages"]]
+    assert ends[0][0] == 0 and ends[-1][1] == len(comm.buffers[0])
+    assert all(previous[1] == current[0] for previous, current in zip(ends, ends[1:]))
@@ -0,0 +1,71 @@
+import gc
+import weakref
+import numpy as np
+from datascience import Table, are
+
+from b2.algebra.cache import ResultCache, Fingerprinter, result_cache
+from b2.algebra.dataframe import BaseOp, Where, Predicate
+from b2.algebra.engine import execute_op
+
+
+class Anchor(object):
+    pass
+
+
+def test_evicts_the_least_recently_used():
+    cache = ResultCache(10)
+    cache.put("a", 1, 4)
+    cache.put("b", 2, 4)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 4)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["bytes"] == 8
+    cache.put("d", 4, 11)
+    assert "d" not in cache
+
+
+def test_entries_do_not_keep_their_anchors_alive():
+    cache = ResultCache(100)
+    anchor = Anchor()
+    ref = weakref.ref(anchor)
+    cache.put(("a", id(anchor)), 1, 1, (anchor,))
+    cache.put("b", 2, 1)
+    del anchor
+    gc.collect()
+    assert ref() is None
+    assert len(cache) == 1
+    assert cache.stats()["bytes"] == 1
+    assert cache.get("b") == 2
+
+
+def test_reused_ids_do_not_find_old_entries():
+    cache = ResultCache(100)
+    anchors = [Anchor() for _ in range(3)]
+    for a in anchors:
+        cache.put(id(a), "old", 1, (a,))
+    del anchors, a
+    gc.collect()
+    for a in [Anchor() for _ in range(3)]:
+        assert cache.get(id(a)) is None
+
+
+def test_deleted_tables_are_released():
+    t = Table().with_columns("x", np.arange(100))
+    op = Where(Predicate("x", are.above(50)), BaseOp("t", "t", t))
+    assert execute_op(op).num_rows == 49
+    assert len(result_cache) > 0
+    table_ref, column_ref = weakref.ref(t), weakref.ref(t.column("x"))
+    del t, op
+    gc.collect()
+    assert table_ref() is None
+    assert len(result_cache) == 0
+    gc.collect()
+    assert column_ref() is None
+
+
+def test_table_version_changes_with_the_columns():
+    t = Table().with_columns("x", np.arange(3))
+    before = Fingerprinter().table_version(t)
+    t.append_column("y", np.arange(3))
+    assert Fingerprinter().table_version(t) != before
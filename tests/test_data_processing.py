@@ -0,0 +1,66 @@
+import numpy as np
+from datascience import Table
+
+from b2.algebra.encoding import encode_table
+from b2.util.data_processing import dataframe_to_columns, dataframe_to_dict
+from b2.vis_types import FilterLabelOptions
+
+
+class Df(object):
+    """the part of MidasDataFrame that the conversions use"""
+    def __init__(self, table):
+        self.table = table
+
+
+def mixed_table():
+    return Table().with_columns(
+        "i", np.arange(6),
+        "f", np.array([0.5, 1.5, np.nan, 3.0, 4.5, 5.0]),
+        "s", np.array(["a", "b", "a", "a", "b", "a"]),
+        "d", np.array(["2020-01-01", "NaT", "2020-01-03", "2020-01-04", "2020-01-05", "2020-01-06"], dtype="datetime64[D]"),
+        "b", np.array([True, False] * 3),
+    )
+
+
+def expand(data, buffers=None):
+    """what the front end does with the columns"""
+    columns = []
+    for c in data["columns"]:
+        if isinstance(c, dict):
+            columns.append(np.frombuffer(buffers[c["buffer"]], dtype=c["dtype"]).tolist())
+        else:
+            columns.append(c)
+    rows = [dict(zip(data["fields"], values)) for values in zip(*columns)]
+    if "overview" in data:
+        for row in rows:
+            row["is_overview"] = data["overview"]
+    return rows
+
+
+def test_columns_expand_to_the_rows():
+    t = mixed_table()
+    encode_table(t)
+    for option in FilterLabelOptions:
+        data = dataframe_to_columns(Df(t), option)
+        assert data["numRows"] == 6
+        assert expand(data) == dataframe_to_dict(Df(t), option)
+
+
+def test_empty():
+    assert dataframe_to_columns(Df(None), FilterLabelOptions.filtered) == {"fields": [], "columns": [], "numRows": 0}
+
+
+def test_numbers_are_sent_as_buffers():
+    t = mixed_table().where("f", lambda f: f == f)
+    buffers = []
+    data = dataframe_to_columns(Df(t), FilterLabelOptions.filtered, buffers)
+    assert [isinstance(c, dict) for c in data["columns"]] == [True, True, False, False, False]
+    assert expand(data, buffers) == dataframe_to_dict(Df(t), FilterLabelOptions.filtered)
+
+
+def test_non_finite_floats_are_sent_as_null():
+    t = Table().with_columns("f", np.array([1.0, np.nan, np.inf, -np.inf], dtype=np.float32))
+    buffers = []
+    data = dataframe_to_columns(Df(t), FilterLabelOptions.none, buffers)
+    assert buffers == []
+    assert data["columns"] == [[1.0, None, None, None]]
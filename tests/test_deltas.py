@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def make_wide_chart(m):
+    # the first 10 rows are the only ones with y == 1, so selecting y changes 10 of the 100 groups of a
+    t = m.with_columns("x", np.arange(1000) % 100, "y", (np.arange(1000) < 10).astype(int))
+    a = t.group("x")
+    b = t.group("y")
+    a.vis()
+    b.vis()
+    return t, a, b
+
+
+def chart_updates(comm, df_name):
+    return [message for message in comm.messages() if message.get("dfName") == df_name and message["type"].startswith("chart_update")]
+
+
+def test_small_changes_are_sent_as_deltas(m, comm):
+    make_wide_chart(m)
+    m.sel([{"b": {"y": [0]}}])
+    m.sel([{"b": {"y": [0, 1]}}])
+    full, delta = chart_updates(comm, "a")
+    assert full["type"] == "chart_update_data" and full["seq"] == 0
+    assert delta["type"] == "chart_update_delta"
+    assert delta["seq"] == 1 and delta["baseSeq"] == 0
+    upserts = delta["delta"]["upserts"]
+    assert delta["delta"]["keyCount"] == 1
+    assert upserts["fields"] == ["x", "count"]
+    assert sorted(upserts["columns"][0]) == list(range(10))
+    assert upserts["columns"][1] == [10] * 10
+    assert delta["delta"]["removed"] == []
+
+
+def test_large_changes_are_sent_in_full(m, comm):
+    make_wide_chart(m)
+    m.sel([{"b": {"y": [0]}}])
+    m.sel([{"b": {"y": [1]}}])
+    updates = chart_updates(comm, "a")
+    assert [u["type"] for u in updates] == ["chart_update_data", "chart_update_data"]
+    assert updates[1]["seq"] == 1
+
+
+def test_resync_sends_the_data_again(m, comm):
+    make_wide_chart(m)
+    m.sel([{"b": {"y": [0]}}])
+    comm.sent.clear()
+    m._ui_comm.handle_msg({"content": {"data": {"command": "resync", "df_name": "a"}}})
+    (update,) = chart_updates(comm, "a")
+    assert update["type"] == "chart_update_data" and update["seq"] == 1
+    # the deltas that follow are based on the data that was sent again
+    m.sel([{"b": {"y": [0, 1]}}])
+    assert chart_updates(comm, "a")[-1]["baseSeq"] == 1
@@ -0,0 +1,88 @@
+import numpy as np
+from datascience import Table, are
+
+from b2.algebra.dataframe import BaseOp, Where, GroupBy, Predicate
+from b2.algebra.encoding import encode_table, encode_column
+from b2.algebra.engine import execute_op
+from b2.algebra.indexes import get_encoding, get_key_index
+from b2.util.data_processing import column_to_list
+
+
+def states_table(num_rows=10000):
+    rng = np.random.default_rng(0)
+    return Table().with_columns(
+        "state", rng.choice(["CA", "NY", "WA", "OR"], num_rows),
+        "name", np.array([f"n{i}" for i in range(num_rows)]),
+        "v", rng.random(num_rows),
+    )
+
+
+def test_encoding_keeps_the_values():
+    t = states_table()
+    column = t.column("state")
+    encode_table(t)
+    assert t.column("state") is column
+    assert column.dtype.kind == "U"
+    encoding = get_encoding(column)
+    assert encoding.codes.dtype == np.uint8
+    assert np.array_equal(encoding.dictionary[encoding.codes], column)
+    assert encoding.nbytes < column.nbytes
+
+
+def test_codes_are_sized_to_the_dictionary():
+    column = np.array([f"k{i % 300}" for i in range(3000)])
+    assert encode_column(column).codes.dtype == np.uint16
+
+
+def test_only_encodes_when_smaller():
+    t = states_table()
+    encode_table(t)
+    # all distinct
+    assert get_encoding(t.column("name")) is None
+    # the column only holds pointers to the strings, which the dictionary would copy
+    long_strings = np.array(["x" * 100 + str(i % 50) for i in range(100)], dtype=object)
+    assert encode_column(long_strings) is None
+
+
+def test_object_columns_stay_objects():
+    column = np.array(["a", "b", "a", "a"] * 10, dtype=object)
+    encoding = encode_column(column)
+    assert encoding is not None
+    assert column.dtype == object
+    assert encoding.dictionary.dtype.kind == "U"
+
+
+def test_encoded_key_index():
+    t = states_table()
+    encode_table(t)
+    index = get_key_index([t.column("state")])
+    # the index shares the narrow codes of the encoding
+    assert index.codes is get_encoding(t.column("state")).codes
+    assert index.codes.dtype == np.uint8
+    assert list(index.key_columns[0]) == ["CA", "NY", "OR", "WA"]
+
+
+def test_queries_on_encoded_columns():
+    t = states_table()
+    encode_table(t)
+    base = BaseOp("t", "t", t)
+    for predicate in ["CA", are.contained_in(["NY", "WA"]), are.above("NY")]:
+        result = execute_op(Where(Predicate("state", predicate), base))
+        expected = t.where("state", predicate)
+        assert np.array_equal(result.column("v"), expected.column("v"))
+    result = execute_op(GroupBy("state", None, base))
+    expected = t.group("state")
+    assert np.array_equal(result.column("state"), expected.column("state"))
+    assert np.array_equal(result.column("count"), expected.column("count"))
+
+
+def test_encoded_columns_are_listed_from_the_codes():
+    t = states_table()
+    column = t.column("state")
+    encoding = encode_column(column)
+    values = column_to_list(column, encoding)
+    assert values == column.tolist()
+    # one string object per distinct value
+    assert len(set(id(v) for v in values)) == encoding.num_keys
+    objects = column.astype(object)
+    assert column_to_list(objects, encode_column(objects)) == column.tolist()
@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+from datascience import Table, are
+
+from b2.algebra.cache import result_cache
+from b2.algebra.dataframe import BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin, Predicate
+from b2.algebra.encoding import encode_table
+from b2.algebra.engine import execute_op
+from b2.algebra.partitions import partition_pool
+from b2.algebra.tiles import interactive_index
+import b2.algebra.partitions as partitions
+
+
+def sales_table(num_rows=2000):
+    rng = np.random.default_rng(1)
+    return Table().with_columns(
+        "k", rng.integers(0, 50, num_rows),
+        "v", rng.random(num_rows) * 100,
+        "state", rng.choice(["CA", "NY", "WA", "OR"], num_rows),
+        "day", np.datetime64("2020-01-01") + rng.integers(0, 365, num_rows).astype("timedelta64[D]"),
+        "flag", rng.random(num_rows) < 0.3,
+    )
+
+
+def base(table, name="t"):
+    return BaseOp(name, name, table)
+
+
+def assert_same(result, expected):
+    assert result.labels == expected.labels
+    for label in expected.labels:
+        r, e = result.column(label), expected.column(label)
+        if e.dtype.kind == "f":
+            assert np.allclose(r, e, equal_nan=True), label
+        else:
+            assert np.array_equal(r, e), label
+
+
+@pytest.fixture(params=["plain", "encoded"])
+def t(request):
+    table = sales_table()
+    if request.param == "encoded":
+        encode_table(table)
+    return table
+
+
+WHERES = [
+    ("k", 7),
+    ("k", are.above(40)),
+    ("v", are.between(10, 20)),
+    ("v", are.below_or_equal_to(5) | are.above(95)),
+    ("state", "CA"),
+    ("state", are.contained_in(["NY", "WA"])),
+    ("state", -are.equal_to("OR")),
+    ("day", are.above(np.datetime64("2020-06-01"))),
+    ("flag", True),
+    ("k", lambda k: k % 3 == 0),
+]
+
+
+@pytest.mark.parametrize("interactive", [False, True])
+@pytest.mark.parametrize("label,value_or_predicate", WHERES)
+def test_where(t, interactive, label, value_or_predicate):
+    interactive_index.set_enabled(interactive)
+    result = execute_op(Where(Predicate(label, value_or_predicate), base(t)))
+    assert_same(result, t.where(label, value_or_predicate))
+
+
+def test_where_pairwise(t):
+    t = t.with_column("w", np.random.default_rng(2).random(t.num_rows) * 100)
+    result = execute_op(Where(Predicate("v", are.above, "w"), base(t)))
+    assert_same(result, t.where("v", are.above, "w"))
+
+
+def test_where_mask(t):
+    mask = t.column("v") > 50
+    result = execute_op(Where(Predicate(mask, None), base(t)))
+    assert_same(result, t.where(mask))
+
+
+@pytest.mark.parametrize("interactive", [False, True])
+def test_fused_where(t, interactive):
+    interactive_index.set_enabled(interactive)
+    predicates = [Predicate("state", are.contained_in(["CA", "NY"])), Predicate("v", are.above(30)), Predicate("k", are.below(25))]
+    result = execute_op(FusedWhere(predicates, base(t)))
+    expected = t
+    for p in predicates:
+        expected = expected.where(p.column_or_label, p.value_or_predicate)
+    assert_same(result, expected)
+
+
+def test_select(t):
+    op = Select(["v", "k"], Where(Predicate("k", are.above(10)), base(t)))
+    assert_same(execute_op(op), t.where("k", are.above(10)).select(["v", "k"]))
+
+
+@pytest.mark.parametrize("columns", ["state", "k", ["state", "flag"]])
+@pytest.mark.parametrize("collect", [None, np.sum, np.mean, np.max, len])
+def test_group(t, columns, collect):
+    op = GroupBy(columns, collect, Select(["k", "v", "state", "flag"], base(t)))
+    expected = t.select(["k", "v", "state", "flag"]).group(columns, collect)
+    assert_same(execute_op(op), expected)
+
+
+def test_group_filtered(t):
+    op = GroupBy("state", None, Where(Predicate("v", are.above(50)), base(t)))
+    assert_same(execute_op(op), t.where("v", are.above(50)).group("state"))
+
+
+def test_partitioned(t, monkeypatch):
+    monkeypatch.setattr(partitions, "PARTITION_ROWS", 300)
+    partition_pool.set_workers(3)
+    try:
+        where = Where(Predicate("v", are.above(25)), base(t))
+        assert_same(execute_op(where), t.where("v", are.above(25)))
+        group = GroupBy("state", np.mean, Select(["state", "v"], where))
+        assert_same(execute_op(group), t.where("v", are.above(25)).select(["state", "v"]).group("state", np.mean))
+    finally:
+        partition_pool.set_workers(1)
+
+
+def lookup_table():
+    return Table().with_columns(
+        "k", np.array([1, 2, 2, 3, 60]),
+        "state", np.array(["CA", "NY", "NY", "WA", "OR"]),
+        "region", np.array(["west", "east", "east2", "west", "west"]),
+    )
+
+
+def test_join(m, t):
+    u = lookup_table()
+    other = m.from_ops(base(u, "u"))
+    result = execute_op(Join("k", other, "k", base(t)))
+    assert_same(result, t.join("k", u, "k"))
+
+
+def test_join_on_two_columns(m, t):
+    u = lookup_table()
+    other = m.from_ops(base(u, "u"))
+    result = execute_op(Join(["k", "state"], other, ["k", "state"], base(t)))
+    expected = t.join(["k", "state"], u, ["k", "state"])
+    if expected is None:
+        assert result is None
+    else:
+        assert_same(result, expected)
+
+
+def test_empty_join(m, t):
+    u = lookup_table().where("k", 60)
+    other = m.from_ops(base(u, "u"))
+    assert execute_op(Join("k", other, "k", base(t))) is None
+    assert t.join("k", u, "k") is None
+
+
+def test_semi_join(m, t):
+    u = lookup_table()
+    other = m.from_ops(base(u, "u"))
+    result = execute_op(SemiJoin("k", other, "k", base(t)))
+    assert_same(result, t.where("k", are.contained_in(list(u.column("k")))))
+
+
+def test_repeated_evaluation_uses_the_cache(t):
+    op = GroupBy("state", None, Where(Predicate("k", are.above(10)), base(t)))
+    first = execute_op(op)
+    result_cache.reset_stats()
+    assert_same(execute_op(op), first)
+    assert result_cache.stats()["hits"] > 0
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from datascience import Table, are
+
+from b2.algebra.dataframe import BaseOp, Where, FusedWhere, GroupBy, Predicate
+from b2.algebra.engine import execute_op, prepare_group_index
+from b2.algebra.indexes import KeyIndex, SortedIndex, index_cache, get_sorted_index, get_key_index, get_key_order, pinned_indexes
+from b2.algebra.partitions import partition_pool
+from b2.algebra.predicate_compiler import compile_predicate
+from b2.algebra.tiles import interactive_index
+import b2.algebra.partitions as partitions
+
+
+def flags_table():
+    return Table().with_columns(
+        "flag", np.array([True, False, True, True] * 100),
+        "x", np.arange(400),
+    )
+
+
+@pytest.mark.parametrize("interactive", [False, True])
+@pytest.mark.parametrize("value_or_predicate", [True, False, are.above(0), are.equal_to(False), are.between(0, 1)])
+def test_where_on_bool_column(interactive, value_or_predicate):
+    interactive_index.set_enabled(interactive)
+    t = flags_table()
+    result = execute_op(Where(Predicate("flag", value_or_predicate), BaseOp("t", "t", t)))
+    expected = t.where("flag", value_or_predicate)
+    assert np.array_equal(result.column("x"), expected.column("x"))
+
+
+def test_bool_columns_are_not_sorted():
+    column = np.array([True, False, True])
+    assert SortedIndex.build(column) is None
+    assert compile_predicate(are.above(0)).value_range(column) is None
+
+
+def test_sorted_index_only_when_interactive():
+    t = Table().with_columns("x", np.arange(1000))
+    op = Where(Predicate("x", are.between(10, 20)), BaseOp("t", "t", t))
+    assert np.array_equal(execute_op(op).column("x"), np.arange(10, 20))
+    assert ("sorted_index", id(t.column("x"))) not in index_cache
+    interactive_index.set_enabled(True)
+    op = Where(Predicate("x", are.between(10, 21)), BaseOp("t", "t", t))
+    assert np.array_equal(execute_op(op).column("x"), np.arange(10, 21))
+    assert ("sorted_index", id(t.column("x"))) in index_cache
+
+
+def test_evicted_sorted_index_is_not_sorted_again():
+    a = np.arange(1000)
+    b = np.arange(1000)
+    # room for one of the indexes at a time
+    index_cache.set_max_bytes(3 * 1000 * 8)
+    assert get_sorted_index(a) is not None
+    assert get_sorted_index(b) is not None
+    assert ("sorted_index", id(a)) not in index_cache
+    assert get_sorted_index(a) is None
+    assert get_sorted_index(b) is not None
+
+
+def test_fused_where_with_sorted_index():
+    interactive_index.set_enabled(True)
+    rng = np.random.default_rng(0)
+    t = Table().with_columns("x", rng.integers(0, 1000, 5000), "y", rng.random(5000), "flag", rng.random(5000) > 0.5)
+    predicates = [Predicate("x", are.between(100, 120)), Predicate("y", are.above(0.5)), Predicate("flag", True)]
+    result = execute_op(FusedWhere(predicates, BaseOp("t", "t", t)))
+    expected = t.where("x", are.between(100, 120)).where("y", are.above(0.5)).where("flag", True)
+    for label in t.labels:
+        assert np.array_equal(result.column(label), expected.column(label))
+
+
+def test_key_index_codes_are_narrow():
+    index = KeyIndex.build([np.arange(1000) % 10])
+    assert index.codes.dtype == np.uint8
+    assert KeyIndex.build([np.arange(1000)]).codes.dtype == np.uint16
+    assert np.array_equal(index.counts, np.full(10, 100))
+
+
+def test_key_order_is_counted_once_sorted():
+    column = np.random.default_rng(0).integers(0, 50, 1000)
+    index = get_key_index([column])
+    assert not index.has_order
+    assert index_cache.stats()["bytes"] == index.nbytes
+    order = get_key_order(index, [column])
+    assert np.array_equal(column[order], np.sort(column))
+    assert index_cache.stats()["bytes"] == index.nbytes
+    assert index.nbytes == index.codes.nbytes + order.nbytes + 3 * 50 * 8
+
+
+@pytest.mark.parametrize("columns", ["state", ["state", "k"]])
+def test_prepare_group_index_pins_it_outside_the_budget(columns):
+    rng = np.random.default_rng(0)
+    t = Table().with_columns("state", rng.choice(["CA", "NY", "WA"], 2000), "k", rng.integers(0, 5, 2000), "v", rng.random(2000))
+    # too small for any of the indexes
+    index_cache.set_max_bytes(16)
+    op = GroupBy(columns, None, Where(Predicate("v", are.above(0.5)), BaseOp("t", "t", t)))
+    prepare_group_index(op)
+    labels = [columns] if isinstance(columns, str) else columns
+    index = get_key_index([t.column(l) for l in labels])
+    assert tuple(id(t.column(l)) for l in labels) in pinned_indexes
+    assert index_cache.stats()["bytes"] == 0
+    # the cached path is the one used, and agrees with datascience
+    result = execute_op(op)
+    assert get_key_index([t.column(l) for l in labels]) is index
+    expected = t.where("v", are.above(0.5)).group(columns)
+    for label in expected.labels:
+        assert np.array_equal(result.column(label), expected.column(label))
+
+
+@pytest.mark.parametrize("labels", [["k"], ["state"], ["state", "k"]])
+def test_partitioned_key_index(labels, monkeypatch):
+    monkeypatch.setattr(partitions, "PARTITION_ROWS", 300)
+    rng = np.random.default_rng(0)
+    t = Table().with_columns("k", rng.integers(0, 40, 2000), "state", rng.choice(["CA", "NY", "WA", "OR"], 2000))
+    columns = [t.column(l) for l in labels]
+    serial = KeyIndex.build(columns)
+    index_cache.clear()
+    partition_pool.set_workers(3)
+    try:
+        partitioned = KeyIndex.build(columns)
+        result = execute_op(GroupBy(labels, None, BaseOp("t", "t", t)))
+    finally:
+        partition_pool.set_workers(1)
+    assert np.array_equal(partitioned.codes, serial.codes)
+    for p, s in zip(partitioned.key_columns, serial.key_columns):
+        assert np.array_equal(p, s)
+    expected = t.group(labels)
+    for label in expected.labels:
+        assert np.array_equal(result.column(label), expected.column(label))
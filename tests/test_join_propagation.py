@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from b2.util.errors import UserError
+
+
+def make_tables(m):
+    # fact rows are keyed by (cid, cty), the same cid is a different customer in another cty
+    cid, cty, amt = np.array([1, 1, 2, 2, 3, 3]), np.array(["us", "ca", "us", "ca", "us", "ca"]), np.arange(6) * 10
+    fact = m.with_columns("cid", cid, "cty", cty, "amt", amt)
+    cust = m.with_columns("cid", np.array([1, 2, 3, 1]), "cty", np.array(["us", "us", "us", "ca"]), "rid", np.array([10, 20, 10, 20]))
+    reg = m.with_columns("rid", np.array([10, 20]), "name", np.array(["west", "east"]))
+    return fact, cust, reg
+
+
+def filtered_table(m, df_name):
+    return m.df_info_store[df_name].df.table
+
+
+def run_code(m, code, **dfs):
+    namespace = dict(dfs, m=m)
+    *statements, expression = code.split("\n")
+    exec("\n".join(statements), namespace)
+    return eval(expression, namespace)
+
+
+def test_multi_hop_composite_propagation(m):
+    fact, cust, reg = make_tables(m)
+    fact.can_join(cust, ["cid", "cty"])
+    cust.can_join(reg, "rid")
+    by_amt = fact.group("amt")
+    by_name = reg.group("name")
+    by_amt.vis()
+    by_name.vis()
+    m.sel([{"by_name": {"name": ["west"]}}])
+    # west is rid 10, which are the customers (1, us) and (3, us)
+    assert list(filtered_table(m, "by_amt").column("amt")) == [0, 40]
+    code = m._get_filtered_code("by_amt")
+    assert "['cid', 'cty']" in code
+    result = run_code(m, code, fact=fact.table, cust=cust.table, reg=reg.table)
+    assert list(result.column("amt")) == [0, 40]
+
+
+def test_single_column_code_reads_as_a_where(m):
+    fact, cust, reg = make_tables(m)
+    cust.can_join(reg, "rid")
+    by_cid = cust.group("cid")
+    by_name = reg.group("name")
+    by_cid.vis()
+    by_name.vis()
+    m.sel([{"by_name": {"name": ["east"]}}])
+    code = m._get_filtered_code("by_cid")
+    assert "m.are.contained_in" in code
+    result = run_code(m, code, cust=cust.table, reg=reg.table)
+    assert np.array_equal(result.column("cid"), filtered_table(m, "by_cid").column("cid"))
+
+
+def test_join_paths_are_found_again_after_a_join_is_added(m):
+    fact, cust, reg = make_tables(m)
+    fact.can_join(cust, ["cid", "cty"])
+    by_amt = fact.group("amt")
+    by_name = reg.group("name")
+    by_amt.vis()
+    by_name.vis()
+    m.sel([{"by_name": {"name": ["west"]}}])
+    # there is no path from reg to fact yet
+    assert filtered_table(m, "by_amt").num_rows == 6
+    cust.can_join(reg, "rid")
+    m.sel([{"by_name": {"name": ["west"]}}])
+    assert filtered_table(m, "by_amt").num_rows == 2
+
+
+def test_composite_keys_need_the_same_number_of_columns(m):
+    fact, cust, _ = make_tables(m)
+    with pytest.raises(UserError):
+        fact.can_join(cust, ["cid", "cty"], "cid")
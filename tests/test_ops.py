@@ -0,0 +1,68 @@
+import pickle
+from copy import copy, deepcopy
+import numpy as np
+import pytest
+from datascience import Table, are
+
+from b2.algebra.cache import Fingerprinter
+from b2.algebra.context import set_if_eq
+from b2.algebra.dataframe import BaseOp, Where, Select, GroupBy, Join, Predicate
+from b2.util.errors import InternalLogicalError
+
+
+def tree(m):
+    t = Table().with_columns("k", np.arange(4), "v", np.arange(4) * 2)
+    u = Table().with_columns("k", np.arange(4), "w", np.arange(4) * 3)
+    other = m.from_ops(Where(Predicate("w", are.above(2)), BaseOp("u", "u", u)))
+    filtered = Where(Predicate("v", are.above(1)), BaseOp("t", "t", t))
+    return GroupBy("k", None, Select(["k", "w"], Join("k", other, "k", filtered))), t
+
+
+def path(op):
+    """the ops from the root to the base of the child chain"""
+    ops = [op]
+    while ops[-1].has_child():
+        ops.append(ops[-1].child)
+    return ops
+
+
+def test_path_copying_keeps_the_old_tree(m):
+    op, t = tree(m)
+    before = path(op)
+    fingerprint = Fingerprinter().of(op)
+    replacement = Where(Predicate("k", 1), BaseOp("t", "t", t))
+    new_op = set_if_eq(op, replacement, "t")
+    # the old tree is unchanged
+    assert path(op) == before
+    assert Fingerprinter().of(op) == fingerprint
+    # the ops on the way to the base are copies, with the same fields
+    new_path = path(new_op)
+    assert new_path[-2:] == [replacement, replacement.child]
+    for old, new in zip(before[:4], new_path[:4]):
+        assert old is not new and type(old) is type(new)
+    assert new_op.columns == op.columns
+    # the other side of the join is not on the path, so it is shared
+    assert new_path[2].other is before[2].other
+    assert new_path[2].other._ops is before[2].other._ops
+
+
+def test_untouched_trees_are_shared(m):
+    op, _ = tree(m)
+    assert set_if_eq(op, BaseOp("x", "x", Table()), "not_a_base") is op
+
+
+def test_ops_are_immutable(m):
+    op, _ = tree(m)
+    with pytest.raises(InternalLogicalError):
+        op.child = None
+    with pytest.raises(InternalLogicalError):
+        del op.columns
+    assert copy(op) is op and deepcopy(op) is op
+
+
+def test_ops_pickle(m):
+    t = Table().with_columns("k", np.arange(4))
+    op = GroupBy("k", None, Where(Predicate("k", 2), BaseOp("t", "t", t)))
+    restored = pickle.loads(pickle.dumps(op))
+    assert restored.columns == "k" and restored.child.predicate.value_or_predicate == 2
+    assert list(restored.child.child.table.column("k")) == [0, 1, 2, 3]
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from datascience import Table, are
+
+from b2.algebra.dataframe import BaseOp, Where, FusedWhere, Select, GroupBy, Join, SemiJoin, Predicate, RelationalOpType, eval_op
+from b2.algebra.engine import execute_op
+from b2.algebra.optimizer import optimize
+
+from test_engine import assert_same
+
+
+def fact_table():
+    return Table().with_columns(
+        "k", np.arange(12) % 4,
+        "v", np.arange(12) * 1.5,
+        "s", np.array(["a", "b", "c"] * 4),
+    )
+
+
+def dim_table():
+    return Table().with_columns(
+        "s", np.array(["a", "b", "z"]),
+        "w", np.array([0, 2, 1]),
+        "v", np.array([10.0, 20.0, 30.0]),
+    )
+
+
+@pytest.fixture
+def dfs(m):
+    t, u = fact_table(), dim_table()
+    return t, u, m.from_ops(BaseOp("u", "u", u))
+
+
+def assert_equivalent(op, expected):
+    optimized = optimize(op)
+    assert_same(execute_op(optimized), expected)
+    assert_same(eval_op(op), expected)
+    return optimized
+
+
+def test_push_below_select(dfs):
+    t, _, _ = dfs
+    op = Where(Predicate("k", 1), Select(["k", "v"], BaseOp("t", "t", t)))
+    optimized = assert_equivalent(op, t.select(["k", "v"]).where("k", 1))
+    assert optimized.op_type == RelationalOpType.project
+
+
+def test_push_below_join(dfs):
+    t, u, other = dfs
+    left = Where(Predicate("k", are.above(1)), Join("s", other, "s", BaseOp("t", "t", t)))
+    optimized = assert_equivalent(left, t.join("s", u, "s").where("k", are.above(1)))
+    assert optimized.op_type == RelationalOpType.join
+    right = Where(Predicate("w", 2), Join("s", other, "s", BaseOp("t", "t", t)))
+    optimized = assert_equivalent(right, t.join("s", u, "s").where("w", 2))
+    assert optimized.op_type == RelationalOpType.join
+
+
+def test_renamed_columns_are_not_pushed(dfs):
+    t, u, other = dfs
+    # the v of u is v_2 after the join
+    op = Where(Predicate("v_2", are.above(15)), Join("s", other, "s", BaseOp("t", "t", t)))
+    assert_equivalent(op, t.join("s", u, "s").where("v_2", are.above(15)))
+
+
+def test_push_below_semi_join(dfs):
+    t, u, other = dfs
+    op = Where(Predicate("v", are.below(9)), SemiJoin("s", other, "s", BaseOp("t", "t", t)))
+    optimized = assert_equivalent(op, t.where("s", are.contained_in(["a", "b", "z"])).where("v", are.below(9)))
+    assert optimized.op_type == RelationalOpType.semi_join
+
+
+def test_wheres_that_empty_a_join_return_an_empty_table(dfs):
+    t, u, other = dfs
+    op = Where(Predicate("w", 1), Join("s", other, "s", BaseOp("t", "t", t)))
+    expected = t.join("s", u, "s").where("w", 1)
+    assert expected.num_rows == 0
+    assert execute_op(op).num_rows == 0
+    assert_same(eval_op(op), expected)
+
+
+def test_empty_joins_are_still_none(dfs):
+    t, u, other = dfs
+    op = Where(Predicate("k", 1), Join("s", other, "s", Where(Predicate("s", "c"), BaseOp("t", "t", t))))
+    assert t.where("s", "c").join("s", u, "s") is None
+    assert eval_op(op) is None
+
+
+def test_prune_columns_before_join(m, dfs):
+    t, _, _ = dfs
+    u = dim_table().relabeled("v", "x")
+    other = m.from_ops(BaseOp("u", "u", u))
+    op = GroupBy("w", None, Join("s", other, "s", BaseOp("t", "t", t)))
+    optimized = assert_equivalent(op, t.join("s", u, "s").group("w"))
+    j_op = optimized.child
+    assert j_op.op_type == RelationalOpType.join
+    # only the keys and w are needed
+    assert j_op.child.op_type == RelationalOpType.project and j_op.child.columns == ["s"]
+    assert j_op.other._ops.columns == ["s", "w"]
+
+
+def test_fused_wheres_run_the_most_selective_first():
+    t = Table().with_columns("wide", np.arange(1000), "narrow", np.arange(1000) % 100)
+    odd = lambda x: x % 2 == 1
+    op = Where(Predicate("wide", are.above(10)), Where(Predicate("narrow", 3), Where(Predicate("wide", odd), BaseOp("t", "t", t))))
+    optimized = optimize(op)
+    assert optimized.op_type == RelationalOpType.fused_where
+    labels = [(p.column_or_label, p.value_or_predicate is odd) for p in optimized.predicates]
+    # the callable that is not vectorized runs last
+    assert labels == [("narrow", False), ("wide", False), ("wide", True)]
+    expected = t.where("wide", odd).where("narrow", 3).where("wide", are.above(10))
+    assert_same(execute_op(optimized), expected)
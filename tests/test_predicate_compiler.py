@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from datascience import are
+
+from b2.algebra.predicate_compiler import compile_predicate
+
+rng = np.random.default_rng(3)
+COLUMNS = {
+    "int": rng.integers(-5, 5, 200),
+    "float": np.append(rng.random(199) * 10, np.nan),
+    "str": rng.choice(["a", "b", "c", "ab"], 200),
+    "object": np.array(rng.choice(["a", "b", "c"], 200), dtype=object),
+    "bool": rng.random(200) < 0.5,
+}
+PREDICATES = [
+    ("equal_to", are.equal_to(2)),
+    ("above", are.above(1)),
+    ("below", are.below(3)),
+    ("above_or_equal_to", are.above_or_equal_to(2)),
+    ("below_or_equal_to", are.below_or_equal_to(2)),
+    ("strictly_between", are.strictly_between(1, 4)),
+    ("between", are.between(1, 4)),
+    ("between_or_equal_to", are.between_or_equal_to(1, 4)),
+    ("contained_in", are.contained_in([1, 3])),
+    ("not", -are.above(2)),
+    ("and", are.above(0) & are.below(3)),
+    ("or", are.below(0) | are.above(3)),
+]
+STRING_PREDICATES = [
+    ("equal_to", are.equal_to("b")),
+    ("above", are.above("a")),
+    ("contained_in", are.contained_in(["a", "c"])),
+    ("substring", are.contained_in("abc")),
+    ("or", are.equal_to("a") | are.equal_to("c")),
+]
+
+
+def expected_mask(column, predicate):
+    return np.array([bool(predicate(v)) for v in column])
+
+
+@pytest.mark.parametrize("kind", ["int", "float", "bool"])
+@pytest.mark.parametrize("name,predicate", PREDICATES)
+def test_numbers(kind, name, predicate):
+    column = COLUMNS[kind]
+    compiled = compile_predicate(predicate)
+    assert compiled is not None
+    assert np.array_equal(compiled.mask(column), expected_mask(column, predicate))
+
+
+@pytest.mark.parametrize("kind", ["str", "object"])
+@pytest.mark.parametrize("name,predicate", STRING_PREDICATES)
+def test_strings(kind, name, predicate):
+    column = COLUMNS[kind]
+    mask = compile_predicate(predicate).mask(column)
+    if mask is None:
+        # e.g., substrings of object columns are left to the fallback
+        assert kind == "object"
+        return
+    assert np.array_equal(mask, expected_mask(column, predicate))
+
+
+def test_values_are_equality():
+    compiled = compile_predicate(3)
+    assert compiled.name == "equal_to"
+    assert np.array_equal(compiled.mask(COLUMNS["int"]), COLUMNS["int"] == 3)
+
+
+def test_datetimes():
+    column = np.datetime64("2020-01-01") + np.arange(100).astype("timedelta64[D]")
+    column[5] = np.datetime64("NaT")
+    predicate = are.between(np.datetime64("2020-02-01"), np.datetime64("2020-03-01"))
+    mask = compile_predicate(predicate).mask(column)
+    assert np.array_equal(mask, (column >= np.datetime64("2020-02-01")) & (column < np.datetime64("2020-03-01")))
+    # the brushes send milliseconds
+    millis = int(np.datetime64("2020-02-01", "ms").astype(np.int64))
+    assert np.array_equal(compile_predicate(are.above_or_equal_to(millis)).mask(column), column >= np.datetime64("2020-02-01"))
+
+
+def test_unknown_predicates():
+    assert compile_predicate(lambda x: x > 1) is None
+    assert compile_predicate(are.containing("a")) is None
+    # the combination is only compiled if both sides are
+    assert compile_predicate(are.above(1) & are.containing("a")) is None
+
+
+def test_value_range():
+    column = COLUMNS["float"]
+    low, high = compile_predicate(are.between(2, 4)).value_range(column)
+    assert low < 2 < 4 < high
+    assert compile_predicate(are.above(2)).value_range(column)[1] is None
+    assert compile_predicate(are.contained_in([1, 2])).value_range(column) is None
+    assert compile_predicate(are.equal_to("a")).value_range(COLUMNS["str"]) is None
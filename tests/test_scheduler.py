@@ -0,0 +1,158 @@
+from b2.algebra.context import Context
+from b2.scheduler import InteractionScheduler
+
+from test_deltas import make_wide_chart
+from test_ui_comm import make_charts
+
+
+class ManualLoop(object):
+    """stands in for the kernel's io loop, the callbacks run when `run` is called"""
+    def __init__(self):
+        self.callbacks = []
+
+    def call_later(self, delay, callback):
+        self.callbacks.append((delay, callback))
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for _, callback in callbacks:
+            callback()
+
+
+def test_runs_right_away_without_debounce():
+    ran = []
+    scheduler = InteractionScheduler(None, 50)
+    scheduler.submit("a", lambda: ran.append(1))
+    scheduler.submit("a", lambda: ran.append(2))
+    assert ran == [1, 2]
+
+
+def test_keeps_the_latest_work_of_each_key():
+    ran = []
+    loop = ManualLoop()
+    scheduler = InteractionScheduler(loop.call_later, 50)
+    scheduler.submit("a", lambda: ran.append("a1"))
+    scheduler.submit("b", lambda: ran.append("b1"))
+    scheduler.submit("a", lambda: ran.append("a2"))
+    assert ran == []
+    assert len(loop.callbacks) == 1 and loop.callbacks[0][0] == 0.05
+    loop.run()
+    assert ran == ["b1", "a2"]
+    scheduler.submit("a", lambda: ran.append("a3"))
+    assert len(loop.callbacks) == 1
+
+
+def test_generations():
+    scheduler = InteractionScheduler(None, 0)
+    generation = scheduler.generation
+    assert not scheduler.is_stale(generation)
+    scheduler.submit("a", lambda: None)
+    assert scheduler.is_stale(generation)
+
+
+def test_stale_ticks_stop_filtering(m, comm, monkeypatch):
+    make_charts(m)
+    c = m.with_columns("x", [1, 2, 3]).group("x")
+    c.vis()
+    filtered = []
+    apply_selection = Context.apply_selection
+
+    def interrupted(self, target_df, selections):
+        # a newer interaction comes in while the first chart is filtered
+        filtered.append(target_df.df_name)
+        m._ui_comm.scheduler.generation += 1
+        return apply_selection(self, target_df, selections)
+
+    monkeypatch.setattr(Context, "apply_selection", interrupted)
+    comm.sent.clear()
+    m.sel([{"a": {"x": [2, 4]}}])
+    assert filtered == ["b"]
+    assert all(message["type"] != "update_chart_filtered_value" for message in comm.messages())
+
+
+def wait_for_ticks(m):
+    m._background_worker.submit(lambda: None).result()
+
+
+def test_background_ticks_filter_the_charts(m):
+    t, a, b = make_charts(m)
+    m.set_background_ticks(True)
+    m.sel([{"a": {"x": [2]}}])
+    wait_for_ticks(m)
+    filtered = m.df_info_store["b"].df.table
+    assert list(filtered.column("y")) == [0, 2]
+    assert list(filtered.column("count")) == [5, 5]
+    m.sel([])
+    wait_for_ticks(m)
+    assert m.df_info_store["b"].df is None
+
+
+def test_background_ticks_skip_charts_shown_again(m, monkeypatch):
+    t, a, b = make_charts(m)
+    m.set_background_ticks(True)
+    apply_selection = Context.apply_selection
+    shown_again = []
+
+    def show_again(self, target_df, selections):
+        result = apply_selection(self, target_df, selections)
+        if target_df.df_name == "b" and len(shown_again) == 0:
+            # the notebook shows the chart again while the tick runs
+            shown_again.append(True)
+            b = t.group("x")
+            b.vis()
+        return result
+
+    monkeypatch.setattr(Context, "apply_selection", show_again)
+    m.sel([{"a": {"x": [2]}}])
+    wait_for_ticks(m)
+    b_info = m.df_info_store["b"]
+    # filtered when it was shown again, not with the result for the chart it replaced
+    assert b_info.df.table.labels == ("x", "count")
+
+
+def test_stale_background_ticks_skip_after_selection(m, comm, monkeypatch):
+    make_charts(m)
+    m.set_background_ticks(True)
+    apply_selection = Context.apply_selection
+
+    def interrupted(self, target_df, selections):
+        m._ui_comm.scheduler.generation += 1
+        return apply_selection(self, target_df, selections)
+
+    monkeypatch.setattr(Context, "apply_selection", interrupted)
+    comm.sent.clear()
+    m.sel([{"a": {"x": [2]}}])
+    wait_for_ticks(m)
+    assert all(message["type"] not in ("after_selection", "update_chart_filtered_value") for message in comm.messages())
+    # the tick that is not interrupted sends it
+    monkeypatch.setattr(Context, "apply_selection", apply_selection)
+    m.sel([{"a": {"x": [3]}}])
+    wait_for_ticks(m)
+    assert [message["type"] for message in comm.messages()].count("after_selection") == 1
+
+
+def brush(m, value):
+    m._ui_comm.handle_msg({"content": {"data": {"command": "add_current_selection", "value": value}}})
+
+
+def executed_selections(comm):
+    return [message["params"] for message in comm.messages() if message["type"] == "execute_selection"]
+
+
+def test_brushes_are_run_as_selections(m, comm):
+    make_wide_chart(m)
+    brush(m, '{"b": {"y": [1]}}')
+    assert [s.column.df_name for s in m.current_selection] == ["b"]
+    assert executed_selections(comm) == ['[{"b": {"y": [1]}}]']
+
+
+def test_brushes_are_coalesced(m, comm):
+    make_wide_chart(m)
+    loop = ManualLoop()
+    m._ui_comm.scheduler.call_later = loop.call_later
+    m._ui_comm.scheduler.set_debounce(50)
+    brush(m, '{"b": {"y": [0]}}')
+    brush(m, '{"b": {"y": [1]}}')
+    assert executed_selections(comm) == []
+    loop.run()
+    assert executed_selections(comm) == ['[{"b": {"y": [1]}}]']
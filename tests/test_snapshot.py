@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from datascience import are
+
+from b2 import B2
+from b2.algebra.indexes import get_encoding
+from b2.util.errors import UserError
+
+from conftest import RecordingComm
+
+
+def new_session(comm):
+    restored = B2()
+    restored._ui_comm.comm = comm
+    return restored
+
+
+def make_session(m):
+    rng = np.random.default_rng(0)
+    state, v = rng.choice(["CA", "NY", "WA"], 500), rng.random(500)
+    t = m.with_columns("state", state, "v", v, "k", np.arange(500) % 20)
+    u = m.with_columns("k", np.arange(20), "region", np.array(["west", "east"] * 10))
+    big = t.where("v", are.above(0.5))
+    by_state = big.group("state")
+    by_region = u.group("region")
+    by_state.vis()
+    by_region.vis()
+    t.join("k", u, "k")
+    m.sel([{"by_region": {"region": ["west"]}}])
+    return t, u, big, by_state
+
+
+def test_round_trip(m, tmp_path):
+    t, u, big, by_state = make_session(m)
+    m.save_session(str(tmp_path))
+    comm = RecordingComm()
+    restored = new_session(comm)
+    dfs = restored.load_session(str(tmp_path))
+    assert set(dfs) == {"t", "u", "big", "by_state", "by_region"}
+    for label in t.table.labels:
+        assert np.array_equal(dfs["t"].table.column(label), t.table.column(label))
+    assert dfs["big"].table.num_rows == big.table.num_rows
+    assert [s.column.df_name for s in restored.current_selection] == ["by_region"]
+    # the charts are created again, and filtered with the selection that was restored
+    types = [message["type"] for message in comm.messages()]
+    assert types.count("chart_render") == 2
+    filtered = restored.df_info_store["by_state"].df.table
+    assert np.array_equal(filtered.column("count"), m.df_info_store["by_state"].df.table.column("count"))
+
+
+def test_tables_are_memory_mapped_and_keep_their_encodings(m, tmp_path):
+    t, *_ = make_session(m)
+    m.save_session(str(tmp_path))
+    dfs = new_session(RecordingComm()).load_session(str(tmp_path))
+    v = dfs["t"].table.column("v")
+    assert isinstance(v.base, np.memmap)
+    state = dfs["t"].table.column("state")
+    encoding = get_encoding(state)
+    assert encoding is not None
+    assert np.array_equal(encoding.dictionary[encoding.codes], state)
+
+
+def test_saving_again_replaces_the_snapshot(m, tmp_path):
+    make_session(m)
+    m.save_session(str(tmp_path))
+    m.save_session(str(tmp_path))
+    assert "t" in new_session(RecordingComm()).load_session(str(tmp_path))
+
+
+def test_refuses_other_directories(m, tmp_path):
+    (tmp_path / "notes.txt").write_text("mine")
+    with pytest.raises(UserError):
+        m.save_session(str(tmp_path))
+    with pytest.raises(UserError):
+        m.load_session(str(tmp_path))
@@ -0,0 +1,44 @@
+import numpy as np
+
+from b2 import B2
+
+from conftest import RecordingComm
+
+
+def run_ticks(m, comm, tick_workers):
+    m.set_tick_workers(tick_workers)
+    rng = np.random.default_rng(0)
+    x, y, z = rng.integers(0, 20, 5000), rng.integers(0, 6, 5000), rng.random(5000)
+    t = m.with_columns("x", x, "y", y, "z", z)
+    by_x = t.group("x")
+    by_y = t.group("y")
+    low_z = t.where("z", m.are.below(0.5))
+    low_by_y = low_z.group("y")
+    by_x.vis()
+    by_y.vis()
+    low_by_y.vis()
+    comm.sent.clear()
+    comm.buffers.clear()
+    m.sel([{"by_x": {"x": [1, 2, 3]}}])
+    m.sel([{"by_y": {"y": [4]}}])
+    m.sel([{"by_x": {"x": [5]}}, {"by_y": {"y": [0, 1]}}])
+    filtered = {name: m.df_info_store[name].df.table for name in ["by_x", "by_y", "low_by_y"]}
+    m.sel([])
+    return comm.messages(), comm.buffers, filtered
+
+
+def test_pool_matches_a_single_worker(m, comm):
+    pooled = run_ticks(m, comm, 4)
+    pool = m._tick_pool
+    serial_comm = RecordingComm()
+    # same name, which is part of the code that is sent
+    m = B2()
+    m._ui_comm.comm = serial_comm
+    expected = run_ticks(m, serial_comm, 1)
+    assert pool is not None
+    assert pooled[0] == expected[0]
+    assert [[bytes(b) for b in buffers] for buffers in pooled[1]] == [[bytes(b) for b in buffers] for buffers in expected[1]]
+    for name, table in expected[2].items():
+        assert table.labels == pooled[2][name].labels
+        for label in table.labels:
+            assert np.array_equal(table.column(label), pooled[2][name].column(label))
@@ -0,0 +1,60 @@
+import pytest
+from datascience import are
+
+from b2.algebra.dataframe import Where, GroupBy, Predicate
+from b2.algebra.engine import execute_op
+from b2.algebra.tiles import CountTile, interactive_index
+
+from test_engine import sales_table, base, assert_same
+
+
+@pytest.fixture
+def tile_calls(monkeypatch):
+    """the number of times the counts of a chart were answered from a tile"""
+    calls = []
+    group_counts = CountTile.group_counts
+
+    def recording(self, value_or_predicate):
+        calls.append(value_or_predicate)
+        return group_counts(self, value_or_predicate)
+    monkeypatch.setattr(CountTile, "group_counts", recording)
+    return calls
+
+
+# low, high of each brush on "k", which goes from 0 to 49
+BRUSHES = [(10, 20), (12, 20), (12, 35), (30, 31), (100, 200), (-1, 50), (0, 49), (25, 26), (5, 5)]
+
+
+@pytest.mark.parametrize("columns", ["state", ["state", "flag"]])
+def test_brush_sequence_matches_datascience(tile_calls, columns):
+    interactive_index.set_enabled(True)
+    t = sales_table()
+    for low, high in BRUSHES:
+        op = GroupBy(columns, None, Where(Predicate("k", are.between(low, high)), Where(Predicate("v", are.above(20)), base(t))))
+        result = execute_op(op)
+        expected = t.where("v", are.above(20)).where("k", are.between(low, high)).group(columns)
+        assert_same(result, expected)
+    # the first query has nothing to compare to, the rest are brushes of "k"
+    assert len(tile_calls) == len(BRUSHES) - 1
+
+
+def test_empty_and_full_selections(tile_calls):
+    interactive_index.set_enabled(True)
+    t = sales_table()
+    for low, high in [(0, 10), (100, 200), (-100, 100), (60, 70)]:
+        op = GroupBy("state", None, Where(Predicate("k", are.between(low, high)), base(t)))
+        result = execute_op(op)
+        expected = t.where("k", are.between(low, high)).group("state")
+        assert result.num_rows == expected.num_rows
+        assert_same(result, expected)
+    assert len(tile_calls) == 3
+
+
+def test_brushing_different_columns():
+    interactive_index.set_enabled(True)
+    t = sales_table()
+    # (low, high) of "k" and the lower bound of "v", sometimes both change at once
+    for low, high, v in [(0, 10, 20), (0, 20, 20), (0, 20, 50), (5, 30, 60), (5, 40, 60), (0, 49, 0)]:
+        op = GroupBy("state", None, Where(Predicate("k", are.between(low, high)), Where(Predicate("v", are.above(v)), base(t))))
+        expected = t.where("v", are.above(v)).where("k", are.between(low, high)).group("state")
+        assert_same(execute_op(op), expected)
@@ -0,0 +1,76 @@
+import numpy as np
+
+from conftest import RecordingComm
+
+
+def message_types(comm):
+    return [(message["type"], message.get("dfName")) for message in comm.messages()]
+
+
+def make_charts(m):
+    t = m.with_columns("x", np.arange(100) % 10, "y", np.arange(100) % 4)
+    a = t.group("x")
+    b = t.group("y")
+    a.vis()
+    b.vis()
+    return t, a, b
+
+
+def replay(m):
+    ui_comm = m._ui_comm
+    ui_comm.vis_spec = {}
+    ui_comm.sent_data = {}
+    ui_comm.comm = RecordingComm()
+    ui_comm.run_log()
+    return ui_comm.comm
+
+
+def test_replay_ends_on_the_latest_selection(m):
+    make_charts(m)
+    m.sel([{"a": {"x": [2, 4]}}])
+    m.sel([{"b": {"y": [1]}}])
+    m.sel([{"a": {"x": [5]}}])
+    after_selections = [k for k in m._ui_comm.logged_comms if k[0] == "after_selection"]
+    assert after_selections == [("after_selection", None)]
+    replayed = replay(m).messages()
+    assert replayed[-1]["type"] == "after_selection"
+    assert replayed[-1]["selection"] == '[{"a": {"x": [5]}}]'
+
+
+def test_replay_creates_charts_before_updating_them(m):
+    t, a, b = make_charts(m)
+    m.sel([{"a": {"x": [2, 4]}}])
+    # shown again without changes, which logs the call again
+    a.vis()
+    types = message_types(replay(m))
+    for df_name in ["a", "b"]:
+        created = types.index(("chart_render", df_name))
+        updates = [i for i, (kind, name) in enumerate(types) if name == df_name and kind != "chart_render"]
+        assert all(i > created for i in updates)
+    assert len(m._ui_comm.logged_comms) == len(set(m._ui_comm.logged_comms))
+
+
+def test_recreated_chart_drops_its_updates(m):
+    t, a, b = make_charts(m)
+    m.sel([{"a": {"x": [2, 4]}}])
+    a = t.group("y")
+    a.vis()
+    keys = list(m._ui_comm.logged_comms)
+    # only the updates of the new chart are left
+    if ("update_chart_filtered_value", "a") in keys:
+        assert keys.index(("update_chart_filtered_value", "a")) > keys.index(("create_chart", "a"))
+    assert ("after_selection", None) not in keys
+    assert ("update_chart_filtered_value", "b") in keys
+
+
+def test_after_selection_of_any_chart_is_replaced(m):
+    make_charts(m)
+    ui_comm = m._ui_comm
+    ui_comm.after_selection([{"a": {"x": [1]}}], "a", 0)
+    ui_comm.after_selection([{"b": {"y": [1]}}], "b", 1)
+    ui_comm.after_selection([{"a": {"x": [2]}}], "a", 2)
+    keys = list(ui_comm.logged_comms)
+    assert keys[-1] == ("after_selection", None)
+    assert [k for k in keys if k[0] == "after_selection"] == [("after_selection", None)]
+    replayed = replay(m).messages()
+    assert replayed[-1]["tick"] == 2
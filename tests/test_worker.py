@@ -0,0 +1,73 @@
+import pytest
+from datascience import are
+
+from b2.algebra.dataframe import Where, FusedWhere, Select, GroupBy, Predicate
+from b2.algebra.encoding import encode_table
+from b2.algebra.engine import execute_op
+from b2.algebra.indexes import get_encoding
+from b2.algebra.worker import ComputeBackend, NotOffloadable, NOT_OFFLOADED, from_plan
+
+from test_engine import sales_table, base, assert_same
+
+
+@pytest.fixture
+def backend():
+    backend = ComputeBackend()
+    yield backend
+    backend.set_processes(0)
+
+
+def shared_sales(backend):
+    t = encode_table(sales_table())
+    backend.share_table(t)
+    return t
+
+
+def queries(t):
+    filtered = FusedWhere([Predicate("v", are.above(20)), Predicate("state", are.contained_in(["CA", "WA"]))], base(t))
+    return [
+        GroupBy("state", None, Where(Predicate("k", are.between(10, 30)), base(t))),
+        GroupBy(["state", "flag"], None, filtered),
+        GroupBy("state", sum, Select(["state", "v"], Where(Predicate("flag", True), base(t)))),
+        Where(Predicate("k", -are.below(45)), base(t)),
+    ]
+
+
+def test_plans_round_trip(backend):
+    t = shared_sales(backend)
+    # the encoding is moved into shared memory along with the column
+    assert get_encoding(t.column("state")) is not None
+    tables = {backend.token_of(t): t}
+    for op in queries(t):
+        assert_same(execute_op(from_plan(backend.to_plan(op), tables)), execute_op(op))
+
+
+def test_only_shared_tables_and_known_predicates_are_offloaded(backend):
+    t = shared_sales(backend)
+    with pytest.raises(NotOffloadable):
+        backend.to_plan(Where(Predicate("k", lambda k: k > 3), base(t)))
+    with pytest.raises(NotOffloadable):
+        backend.to_plan(GroupBy("state", None, base(sales_table())))
+
+
+def test_queries_in_a_worker(backend):
+    t = shared_sales(backend)
+    backend.set_processes(1)
+    for op in queries(t):
+        assert_same(backend.evaluate(op), execute_op(op))
+    # and for the tables shared once the worker is running
+    u = shared_sales(backend)
+    op = GroupBy("state", None, Where(Predicate("k", are.above(40)), base(u)))
+    assert_same(backend.evaluate(op), execute_op(op))
+
+
+def test_dead_worker_is_replaced(backend):
+    t = shared_sales(backend)
+    backend.set_processes(1)
+    dead = backend.workers[0]
+    dead.process.kill()
+    dead.process.join()
+    op = GroupBy("state", None, Where(Predicate("k", are.between(10, 30)), base(t)))
+    assert backend.evaluate(op) is NOT_OFFLOADED
+    assert len(backend.workers) == 1 and backend.workers[0] is not dead
+    assert_same(backend.evaluate(op), execute_op(op))